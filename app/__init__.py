@@ -61,6 +61,10 @@ def create_app():
     app.register_blueprint(reports_bp)
     app.register_blueprint(notifications_bp)
 
+    # CLI 維運指令
+    from app.commands import register_commands
+    register_commands(app)
+
     # 全域錯誤處理
     from marshmallow import ValidationError
     from werkzeug.exceptions import HTTPException
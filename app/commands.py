@@ -0,0 +1,78 @@
+# app/commands.py
+# Flask CLI 維運指令（flask <command>）
+import click
+
+
+def register_commands(app):
+    @app.cli.command('purge-idempotency-keys')
+    @click.option('--batch-size', default=1000, show_default=True, help='每批刪除筆數')
+    def purge_idempotency_keys(batch_size):
+        """刪除已過期的 Idempotency-Key 紀錄"""
+        from app.utils.idempotency import purge_expired_idempotency_keys
+        deleted = purge_expired_idempotency_keys(batch_size=batch_size)
+        click.echo(f"已刪除 {deleted} 筆過期的 Idempotency-Key")
+
+    @app.cli.command('reconcile-stock')
+    @click.option('--fix', is_flag=True, help='將 products.stock 修正為異動帳加總')
+    def reconcile_stock_command(fix):
+        """以庫存異動帳重新計算並比對所有商品庫存"""
+        from app import db
+        from app.services.inventory_service import reconcile_stock
+        drift = reconcile_stock(fix=fix)
+        for d in drift:
+            click.echo(f"商品 {d['product_id']}: stock={d['stock']} ledger={d['ledger']}")
+        if fix:
+            db.session.commit()
+        click.echo(f"共 {len(drift)} 筆不一致" + ("，已修正" if fix and drift else ""))
+
+    @app.cli.command('sweep-expired-orders')
+    @click.option('--batch-size', default=500, show_default=True, help='每批取消筆數')
+    @click.option('--interval', default=0, show_default=True, help='每隔幾秒重複掃描（0 表示只執行一次）')
+    def sweep_expired_orders_command(batch_size, interval):
+        """取消逾期未付款的訂單並釋回保留的庫存"""
+        import time
+        from app import db
+        from app.services.order_service import sweep_expired_orders
+        while True:
+            cancelled = sweep_expired_orders(batch_size=batch_size)
+            click.echo(f"已取消 {cancelled} 筆逾期未付款訂單")
+            if not interval:
+                break
+            db.session.remove()
+            time.sleep(interval)
+
+    @app.cli.command('rebuild-sales-rollup')
+    @click.option('--start', type=click.DateTime(formats=['%Y-%m-%d']), help='起始日期（含），預設為最早的訂單')
+    @click.option('--end', type=click.DateTime(formats=['%Y-%m-%d']), help='結束日期（含），預設為最新的訂單')
+    def rebuild_sales_rollup_command(start, end):
+        """由 orders 重新計算每日銷售彙總與每日商品銷售（回填 / 修復）"""
+        from app.services.sales_rollup_service import rebuild_sales_rollup
+        rows = rebuild_sales_rollup(start.date() if start else None, end.date() if end else None)
+        click.echo(f"已重建 {rows} 筆每日銷售彙總")
+
+    @app.cli.command('run-report-jobs')
+    @click.option('--interval', default=5, show_default=True, help='每隔幾秒輪詢（0 表示只執行一次）')
+    @click.option('--min-age', default=0, show_default=True, help='只執行建立超過幾秒的工作（與 web worker 並用時可留給提交的 worker 執行）')
+    @click.option('--limit', default=10, show_default=True, help='每輪最多執行幾個工作')
+    def run_report_jobs_command(interval, min_age, limit):
+        """執行排隊中的報表工作，並把逾時未回報心跳的執行中工作標記為失敗"""
+        import time
+        from app import db
+        from app.services.report_job_service import fail_stale_report_jobs, run_pending_report_jobs
+        while True:
+            failed = fail_stale_report_jobs()
+            ran = run_pending_report_jobs(limit=limit, min_age=min_age)
+            if failed or ran or not interval:
+                click.echo(f"已執行 {ran} 個報表工作，{failed} 個中斷的工作標記為失敗")
+            if not interval:
+                break
+            db.session.remove()
+            time.sleep(interval)
+
+    @app.cli.command('purge-report-jobs')
+    @click.option('--days', default=7, show_default=True, help='保留天數')
+    def purge_report_jobs_command(days):
+        """刪除已結束且超過保留天數的報表工作與結果檔"""
+        from app.services.report_job_service import purge_report_jobs
+        deleted = purge_report_jobs(older_than_days=days)
+        click.echo(f"已刪除 {deleted} 筆報表工作")
@@ -7,3 +7,9 @@ from .payment import Payment
 from .customer import Customer
 from .operation_log import OperationLog
 from .notification import Notification
+from .sequence import IdSequence
+from .idempotency import IdempotencyKey
+from .inventory import InventoryMovement
+from .cache_version import CacheVersion
+from .sales_rollup import SalesDailyRollup, ProductSalesDaily
+from .report_job import ReportJob
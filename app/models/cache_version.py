@@ -0,0 +1,9 @@
+from app import db
+from datetime import datetime
+
+class CacheVersion(db.Model):
+    """快取版本戳記：資料異動時遞增，各 worker 比對版本決定是否重建 process 內快取"""
+    __tablename__ = 'cache_versions'
+    name = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -0,0 +1,19 @@
+from app import db
+from datetime import datetime
+
+class IdempotencyKey(db.Model):
+    """Idempotency-Key 紀錄：保存第一次成功的回應，供重試時直接重播"""
+    __tablename__ = 'idempotency_keys'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'endpoint', 'key', name='uq_idempotency_keys_scope'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(128), nullable=False)
+    user_id = db.Column(db.Integer, nullable=False)
+    endpoint = db.Column(db.String(128), nullable=False)
+    request_hash = db.Column(db.String(64), nullable=False)
+    status_code = db.Column(db.Integer)  # None = 處理中
+    response_body = db.Column(db.Text)
+    committed_at = db.Column(db.DateTime)  # view 的交易 commit 時間（與資料同一個交易寫入）
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
@@ -0,0 +1,32 @@
+from app import db
+from datetime import datetime
+
+class InventoryMovement(db.Model):
+    """庫存異動帳（只新增不修改），商品庫存 = 該商品所有異動數量加總"""
+    __tablename__ = 'inventory_movements'
+    __table_args__ = (
+        db.Index('ix_inventory_movements_product_id_id', 'product_id', 'id'),
+        db.Index('ix_inventory_movements_ref', 'ref_type', 'ref_id'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id', ondelete='CASCADE'), nullable=False)
+    kind = db.Column(db.String(20), nullable=False)  # opening/receipt/sale/adjustment/release
+    qty = db.Column(db.Integer, nullable=False)  # 正數入庫、負數出庫
+    ref_type = db.Column(db.String(32))  # e.g. 'order'
+    ref_id = db.Column(db.Integer)
+    operator = db.Column(db.String(64))
+    remark = db.Column(db.String(255))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'product_id': self.product_id,
+            'kind': self.kind,
+            'qty': self.qty,
+            'ref_type': self.ref_type,
+            'ref_id': self.ref_id,
+            'operator': self.operator,
+            'remark': self.remark,
+            'created_at': self.created_at,
+        }
@@ -5,20 +5,33 @@ from app.models.user import User  # 確保有 import User 模型
 class Order(db.Model):
     """訂單資料表"""
     __tablename__ = 'orders'
+    __table_args__ = (
+        # 關鍵字搜尋用全文索引（MySQL ngram parser 支援中文）
+        db.Index('ft_orders_keyword', 'order_sn', 'remark', 'receiver_name', mysql_prefix='FULLTEXT', mysql_with_parser='ngram'),
+        # 逾期未付款掃描：WHERE status = 'pending' AND reserved_until <= now
+        db.Index('ix_orders_status_reserved_until', 'status', 'reserved_until'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     order_sn = db.Column(db.String(64), unique=True, nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     customer_id = db.Column(db.Integer, db.ForeignKey('customers.id'), nullable=True)
-    total_amount = db.Column(db.Float, nullable=False)
-    status = db.Column(db.String(20), default='pending', nullable=False)
+    total_amount = db.Column(db.Float, nullable=False, index=True)
+    status = db.Column(db.String(20), default='pending', nullable=False, index=True)
     shipping_fee = db.Column(db.Float, default=0, nullable=False)
     payment_status = db.Column(db.String(20), default='unpaid', nullable=False)
+    # 庫存保留（付款）期限，逾期未付款由排程自動取消並釋回庫存；離開 pending 後清空
+    reserved_until = db.Column(db.DateTime)
     remark = db.Column(db.Text)
+    # 明細摘要（反正規化），列表不需載入 items
+    item_count = db.Column(db.Integer, default=0, nullable=False)
+    item_qty = db.Column(db.Integer, default=0, nullable=False)
+    item_summary = db.Column(db.String(255))
     receiver_name = db.Column(db.String(120), nullable=False)
     receiver_phone = db.Column(db.String(40), nullable=False)
     shipping_address = db.Column(db.String(255), nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # 排序欄位皆建索引（InnoDB 次級索引隱含主鍵），供 keyset 分頁使用
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     updated_at = db.Column(db.DateTime, onupdate=datetime.utcnow)
 
     # 關聯設定
@@ -38,7 +51,11 @@ class Order(db.Model):
             "status": self.status,
             "shipping_fee": self.shipping_fee,
             "payment_status": self.payment_status,
+            "reserved_until": self.reserved_until,
             "remark": self.remark,
+            "item_count": self.item_count,
+            "item_qty": self.item_qty,
+            "item_summary": self.item_summary,
             "receiver_name": self.receiver_name,
             "receiver_phone": self.receiver_phone,
             "shipping_address": self.shipping_address,
@@ -53,6 +70,18 @@ class Order(db.Model):
             data["user"] = self.user.to_dict() if self.user else None
         return data
 
+    def set_item_summary(self, lines):
+        """依明細 [(product_name, qty), ...] 更新筆數、總數量與摘要文字"""
+        lines = list(lines)
+        self.item_count = len(lines)
+        self.item_qty = sum(qty for _, qty in lines)
+        self.item_summary = build_item_summary(lines)
+
+def build_item_summary(lines, max_length=255):
+    """摘要文字，例如「鍵盤 x2、滑鼠 x1」，超過長度以「…」截斷"""
+    text = "、".join(f"{name} x{qty}" for name, qty in lines)
+    return text if len(text) <= max_length else text[:max_length - 1] + "…"
+
 class OrderItem(db.Model):
     __tablename__ = 'order_items'
     id = db.Column(db.Integer, primary_key=True)
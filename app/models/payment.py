@@ -7,9 +7,22 @@ class Payment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     order_id = db.Column(db.Integer, db.ForeignKey('orders.id'), nullable=False)
     amount = db.Column(db.Float, nullable=False)
-    status = db.Column(db.String(20), default='initiated')  # 可值: initiated, pending, success, failed
+    status = db.Column(db.String(20), default='initiated')  # 可值: initiated, pending, success, failed, refund_required（訂單已取消後才付款，待退款）
     payment_method = db.Column(db.String(40), nullable=False)
     transaction_id = db.Column(db.String(128))
     paid_at = db.Column(db.DateTime)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "order_id": self.order_id,
+            "amount": self.amount,
+            "status": self.status,
+            "payment_method": self.payment_method,
+            "transaction_id": self.transaction_id,
+            "paid_at": self.paid_at,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
@@ -9,6 +9,9 @@ class Category(db.Model):
     sku = db.Column(db.String(64), unique=True, nullable=True)
     parent_id = db.Column(db.Integer, db.ForeignKey('categories.id'))
     parent = db.relationship('Category', remote_side=[id], backref='children')
+    # 物化路徑（如 /1/4/9/，含自己）與深度（根為 0）：子樹以 path 前綴一次查出
+    path = db.Column(db.String(255), index=True)
+    depth = db.Column(db.Integer, default=0, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, onupdate=datetime.utcnow)
 
@@ -17,6 +20,8 @@ class Category(db.Model):
             "id": self.id,
             "name": self.name,
             "parent_id": self.parent_id,
+            "path": self.path,
+            "depth": self.depth,
             "created_at": self.created_at,
             "updated_at": self.updated_at,
         }
@@ -55,9 +60,3 @@ class Product(db.Model):
             "created_at": self.created_at,
             "updated_at": self.updated_at,
         }
-
-    def change_stock(self, delta):
-        """庫存異動（正數進貨，負數銷售）"""
-        self.stock += delta
-        if self.stock < 0:
-            self.stock = 0
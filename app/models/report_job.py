@@ -0,0 +1,45 @@
+from app import db
+from datetime import datetime
+import json
+
+class ReportJob(db.Model):
+    """
+    非同步報表 / 匯出工作：背景執行後把結果檔寫到磁碟，供輪詢狀態與下載
+    active_key 只在排隊 / 執行中時有值（唯一），相同參數的工作同時只會有一個在跑
+    狀態存在資料庫：worker 重啟後由 flask run-report-jobs 或下一次提交重新派送 / 判定中斷
+    """
+    __tablename__ = 'report_jobs'
+    __table_args__ = (
+        db.Index('ix_report_jobs_status_created_at', 'status', 'created_at'),
+    )
+    id = db.Column(db.String(32), primary_key=True)
+    kind = db.Column(db.String(32), nullable=False)
+    format = db.Column(db.String(10), nullable=False)
+    params = db.Column(db.Text, nullable=False, default='{}')
+    params_hash = db.Column(db.String(64), nullable=False, index=True)
+    active_key = db.Column(db.String(64), unique=True)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, succeeded, failed
+    artifact_path = db.Column(db.String(255))
+    artifact_size = db.Column(db.BigInteger)
+    error = db.Column(db.Text)
+    created_by = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    started_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)  # 執行中定期更新，逾時未更新視為 worker 中斷
+    finished_at = db.Column(db.DateTime)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "format": self.format,
+            "params": json.loads(self.params or '{}'),
+            "status": self.status,
+            "artifact_size": self.artifact_size,
+            "error": self.error,
+            "created_by": self.created_by,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "heartbeat_at": self.heartbeat_at,
+            "finished_at": self.finished_at,
+        }
@@ -0,0 +1,50 @@
+from app import db
+from datetime import datetime
+
+class SalesDailyRollup(db.Model):
+    """
+    每日銷售彙總（依訂單建立日期、狀態、付款狀態），由訂單寫入時增量維護
+    報表只需讀取數百筆彙總列，不必掃描整個 orders 資料表
+    """
+    __tablename__ = 'sales_daily_rollups'
+    day = db.Column(db.Date, primary_key=True)
+    status = db.Column(db.String(20), primary_key=True)
+    payment_status = db.Column(db.String(20), primary_key=True)
+    order_count = db.Column(db.Integer, nullable=False, default=0)
+    amount = db.Column(db.Float, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            "day": self.day.isoformat(),
+            "status": self.status,
+            "payment_status": self.payment_status,
+            "order_count": self.order_count,
+            "amount": self.amount,
+        }
+
+class ProductSalesDaily(db.Model):
+    """
+    每日商品銷售（依訂單建立日期、商品），由建單、改單、取消與刪除時增量維護（已取消的訂單不計）
+    熱銷排行只需加總期間內的彙總列，不必 JOIN 訂單明細
+    """
+    __tablename__ = 'product_sales_daily'
+    day = db.Column(db.Date, primary_key=True)
+    product_id = db.Column(db.Integer, primary_key=True)
+    qty = db.Column(db.Integer, nullable=False, default=0)
+    amount = db.Column(db.Float, nullable=False, default=0)
+    order_count = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_product_sales_daily_product_id_day', 'product_id', 'day'),
+    )
+
+    def to_dict(self):
+        return {
+            "day": self.day.isoformat(),
+            "product_id": self.product_id,
+            "qty": self.qty,
+            "amount": self.amount,
+            "order_count": self.order_count,
+        }
@@ -0,0 +1,7 @@
+from app import db
+
+class IdSequence(db.Model):
+    """號碼配發序列（例如訂單編號），各 process 一次取一整段號碼"""
+    __tablename__ = 'id_sequences'
+    name = db.Column(db.String(32), primary_key=True)
+    next_value = db.Column(db.BigInteger, nullable=False, default=1)
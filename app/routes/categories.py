@@ -1,7 +1,8 @@
-from flask import Blueprint, request, jsonify, abort
+from flask import Blueprint, request, jsonify, abort, current_app
 from app import db
 from app.models.product import Category
-from app.schemas.product import category_schema, categories_schema
+from app.schemas.product import category_schema
+from app.services.category_service import place_category, move_category, ensure_deletable, category_tree_snapshot, invalidate_category_tree, CategoryTreeError
 from flask_jwt_extended import jwt_required, get_jwt
 
 bp_categories = Blueprint('categories', __name__, url_prefix='/categories')
@@ -9,15 +10,17 @@ bp_categories = Blueprint('categories', __name__, url_prefix='/categories')
 @bp_categories.route('', methods=['GET'])
 @jwt_required(optional=True)
 def list_categories():
-    """取得所有分類（巢狀結構）"""
-    roots = Category.query.filter_by(parent_id=None).all()
-    return jsonify(categories_schema.dump(roots))
+    """取得所有分類（巢狀結構），直接回傳本 worker 快照中預先序列化的 JSON"""
+    return current_app.response_class(category_tree_snapshot().body, mimetype='application/json')
 
 @bp_categories.route('/<int:cid>', methods=['GET'])
 @jwt_required(optional=True)
 def get_category(cid):
-    cat = Category.query.get_or_404(cid)
-    return jsonify(category_schema.dump(cat))
+    """取得分類與其所有子分類（取自分類樹快照）"""
+    body = category_tree_snapshot().subtree_body(cid)
+    if body is None:
+        abort(404)
+    return current_app.response_class(body, mimetype='application/json')
 
 @bp_categories.route('', methods=['POST'])
 @jwt_required()
@@ -29,7 +32,13 @@ def create_category():
         abort(400, description="缺少分類名稱")
     cat = Category(name=name, parent_id=parent_id)
     db.session.add(cat)
+    try:
+        place_category(cat)
+    except CategoryTreeError as e:
+        db.session.rollback()
+        abort(400, description=str(e))
     db.session.commit()
+    invalidate_category_tree()
     return jsonify(category_schema.dump(cat)), 201
 
 @bp_categories.route('/<int:cid>', methods=['PUT'])
@@ -40,14 +49,24 @@ def update_category(cid):
     if 'name' in data:
         cat.name = data['name']
     if 'parent_id' in data:
-        cat.parent_id = data['parent_id']
+        try:
+            move_category(cat, data['parent_id'])
+        except CategoryTreeError as e:
+            db.session.rollback()
+            abort(400, description=str(e))
     db.session.commit()
-    return jsonify(category_schema.dump(cat))
+    invalidate_category_tree()
+    return current_app.response_class(category_tree_snapshot().subtree_body(cid), mimetype='application/json')
 
 @bp_categories.route('/<int:cid>', methods=['DELETE'])
 @jwt_required()
 def delete_category(cid):
     cat = Category.query.get_or_404(cid)
+    try:
+        ensure_deletable(cat)
+    except CategoryTreeError as e:
+        abort(400, description=str(e))
     db.session.delete(cat)
     db.session.commit()
+    invalidate_category_tree()
     return jsonify({'msg': '分類已刪除'})
@@ -62,13 +62,15 @@ def delete(customer_id):
 
 @bp_customers.route('/<int:customer_id>/orders', methods=['GET'])
 def customer_orders(customer_id):
-    """某客戶的所有訂單"""
+    """某客戶的所有訂單（items=full 時一次批次載入所有明細）"""
     from app.models.order import Order
+    from app.services.order_service import order_load_options
     customer = get_customer_by_id(customer_id)
     if not customer:
         return jsonify({'error': 'Not found'}), 404
-    orders = Order.query.filter_by(customer_id=customer_id).all()
-    return jsonify([o.to_dict() for o in orders])
+    include_items = request.args.get('items') == 'full'
+    orders = Order.query.options(*order_load_options(include_items=include_items)).filter_by(customer_id=customer_id).all()
+    return jsonify([o.to_dict(include_items=include_items) for o in orders])
 
 @bp_customers.route('/<int:customer_id>/stats', methods=['GET'])
 def customer_stats(customer_id):
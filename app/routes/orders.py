@@ -3,17 +3,49 @@ from app import db
 from app.models import Order, OrderItem, OrderHistory, Product
 from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
 from sqlalchemy import or_, and_, func
-from sqlalchemy.orm import joinedload  # 重要，為了一起查出 user
+from app.services.order_service import order_load_options, bulk_transition_status, apply_keyword_filter, apply_item_changes, reservation_deadline, ORDER_STATUSES, ConcurrentTransitionError
+from app.services.order_sn_service import next_order_sn
+from app.services.sales_rollup_service import sales_key, record_sales_changes, product_sales_lines, record_product_sales, remove_orders_product_sales
 from datetime import datetime
-import random
-from app.services.notification_service import log_operation, create_notification
+from app.services.notification_service import log_operation
+from app.services.inventory_service import merge_lines, require_products, reserve_stock, ProductNotFoundError, InsufficientStockError
+from app.utils.idempotency import idempotent
+from app.utils.pagination import encode_cursor, decode_cursor, keyset_page, InvalidCursor
 
 bp_orders = Blueprint('orders', __name__, url_prefix='/orders')
 
+def _positive_int(value):
+    """以 int() 轉換（接受數字字串，例如 "5"），無法轉換、非正數、布林值或帶小數時回傳 None"""
+    if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+        return None
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        return None
+    return number if number > 0 else None
+
+def _validate_items(items):
+    """檢查訂單明細格式：product_id 須可轉為正整數（轉換後寫回）、qty 須為正整數"""
+    for item in items:
+        if not isinstance(item, dict) or item.get('product_id') is None:
+            abort(400, description="明細缺少 product_id")
+        pid = _positive_int(item['product_id'])
+        if pid is None:
+            abort(400, description=f"product_id {item['product_id']!r} 必須為正整數")
+        item['product_id'] = pid
+        qty = item.get('qty')
+        if not isinstance(qty, int) or isinstance(qty, bool) or qty <= 0:
+            abort(400, description=f"商品 {item['product_id']} 數量必須為正整數")
+
 @bp_orders.route('', methods=['GET'])
 @jwt_required()
 def list_orders():
-    """取得訂單列表，支援分頁、篩選、關鍵字、狀態、排序，並帶出 user"""
+    """
+    取得訂單列表，支援分頁、篩選、關鍵字、狀態、排序，並帶出 user
+    - 預設為 page/page_size 分頁
+    - 帶 cursor（或 pagination=cursor）時改用 keyset 分頁：依 (排序欄位, id) 接續，
+      深頁成本與第一頁相同；回傳 next_cursor，total 僅在 with_total=true 時計算
+    """
     claims = get_jwt()
     uid = int(get_jwt_identity())
     page = int(request.args.get('page', 1))
@@ -24,8 +56,12 @@ def list_orders():
     keyword = request.args.get('keyword')
     sort_by = request.args.get('sort_by', 'created_at')
     sort_order = request.args.get('sort_order', 'desc')
+    # items=full（預設）帶出明細；items=summary 只回傳反正規化的明細摘要，不查 order_items
+    include_items = request.args.get('items', 'full') != 'summary'
+    cursor = request.args.get('cursor')
+    use_cursor = bool(cursor) or request.args.get('pagination') == 'cursor'
 
-    q = Order.query.options(joinedload(Order.user))  # 關鍵，避免 N+1 查詢
+    q = Order.query.options(*order_load_options(include_items=include_items, include_user=True))  # 關鍵，避免 N+1 查詢
 
     if claims.get('role') != 'admin':
         q = q.filter_by(user_id=uid)
@@ -36,7 +72,10 @@ def list_orders():
     if date_end:
         q = q.filter(Order.created_at <= date_end)
     if keyword:
-        q = q.filter(or_(Order.order_sn.like(f"%{keyword}%"), Order.remark.like(f"%{keyword}%"), Order.receiver_name.like(f"%{keyword}%")))
+        q = apply_keyword_filter(q, keyword)
+
+    if use_cursor:
+        return _list_orders_by_cursor(q, cursor, sort_by, sort_order, page_size, include_items)
 
     if sort_by in ['created_at', 'total_amount', 'status']:
         sort_col = getattr(Order, sort_by)
@@ -46,10 +85,43 @@ def list_orders():
     orders = q.offset((page-1)*page_size).limit(page_size).all()
 
     return jsonify({
-        "data": [o.to_dict(include_items=True, include_user=True) for o in orders],
+        "data": [o.to_dict(include_items=include_items, include_user=True) for o in orders],
         "total": total
     })
 
+def _list_orders_by_cursor(q, cursor, sort_by, sort_order, page_size, include_items):
+    """
+    keyset 分頁：只讀 page_size + 1 筆判斷是否還有下一頁
+    排序欄位可為 NULL（created_at）時，NULL 的訂單排在最後，依 id 接續（見 keyset_page）
+    """
+    if sort_by not in ['created_at', 'total_amount', 'status']:
+        abort(400, description="sort_by 僅支援 created_at、total_amount、status")
+    if sort_order not in ['asc', 'desc']:
+        abort(400, description="sort_order 僅支援 asc、desc")
+    sort_col = getattr(Order, sort_by)
+    with_total = request.args.get('with_total') == 'true'
+    total = q.count() if with_total else None
+    position = None
+    if cursor:
+        try:
+            position = decode_cursor(cursor, sort_by, sort_order)
+        except InvalidCursor as e:
+            abort(400, description=str(e))
+    rows = keyset_page(q, sort_col, Order.id, sort_order, page_size + 1, cursor=position, nullable=Order.__table__.c[sort_by].nullable)
+    orders = rows[:page_size]
+    next_cursor = None
+    if len(rows) > page_size:
+        last = orders[-1]
+        next_cursor = encode_cursor(sort_by, sort_order, getattr(last, sort_by), last.id)
+    resp = {
+        "data": [o.to_dict(include_items=include_items, include_user=True) for o in orders],
+        "next_cursor": next_cursor,
+        "has_more": next_cursor is not None,
+    }
+    if with_total:
+        resp["total"] = total
+    return jsonify(resp)
+
 @bp_orders.route('/<int:order_id>', methods=['GET'])
 @jwt_required()
 def get_order(order_id):
@@ -71,7 +143,7 @@ def get_order_by_sn(order_sn):
     """
     claims = get_jwt()
     uid = int(get_jwt_identity())
-    order = Order.query.filter_by(order_sn=order_sn).first_or_404()
+    order = Order.query.options(*order_load_options(include_items=True, include_history=True)).filter_by(order_sn=order_sn).first_or_404()
     if claims.get('role') != 'admin' and order.user_id != uid:
         abort(403, description="Permission denied")
     return jsonify(order.to_dict(include_items=True, include_history=True)), 200
@@ -91,36 +163,45 @@ def get_order_history(order_id):
 @bp_orders.route('/status', methods=['PUT'])
 @jwt_required()
 def batch_update_status():
+    """
+    批次變更訂單狀態
+    依允許的狀態轉換驗證，每批一次 UPDATE 並批次寫入歷程與通知，整批只 commit 一次
+    回傳每筆結果：updated / forbidden / not_found / invalid_transition
+    """
     data = request.get_json() or {}
     ids = data.get('ids', [])
     status = data.get('status')
     remark = data.get('remark')
     claims = get_jwt()
     uid = int(get_jwt_identity())
-    for oid in ids:
-        order = Order.query.get(oid)
-        if not order:
-            continue
-        if claims.get('role') != 'admin' and order.user_id != uid:
-            continue
-        order.status = status
-        h = OrderHistory(order_id=order.id, status=status, operator=str(uid), operated_at=datetime.now(), remark=remark)
-        db.session.add(h)
-        # 狀態異動通知（站內）
-        create_notification(order.user_id, 'order_status', f'訂單狀態更新', f'您的訂單 {order.id} 狀態已變更為 {order.status}')
+    if not isinstance(ids, list):
+        abort(400, description="ids 必須為陣列")
+    if status not in ORDER_STATUSES:
+        abort(400, description=f"不支援的訂單狀態 {status}")
+    owner_id = None if claims.get('role') == 'admin' else uid
+    try:
+        results = bulk_transition_status(ids, status, operator=str(uid), remark=remark, owner_id=owner_id)
+    except ConcurrentTransitionError as e:
+        db.session.rollback()
+        abort(409, description=f"{e}，請重試")
     db.session.commit()
-    return jsonify({'msg': '狀態更新成功'})
+    counts = {}
+    for r in results:
+        counts[r['result']] = counts.get(r['result'], 0) + 1
+    return jsonify({'msg': '狀態更新成功', 'results': results, 'counts': counts})
 
 @bp_orders.route('', methods=['POST'])
 @jwt_required()
+@idempotent
 def create_order():
     """
     建立新訂單 (Create a new order)
+    支援 Idempotency-Key header：重試時重播第一次的回應，不會重複建單與扣庫存
     """
     data = request.get_json() or {}
     user_id = int(get_jwt_identity())
-    # 自動產生訂單編號
-    order_sn = f"OMS{datetime.now().strftime('%Y%m%d%H%M%S')}{random.randint(100,999)}"
+    # 自動產生訂單編號（號碼段配發，跨 worker 不重複）
+    order_sn = next_order_sn()
     receiver_name = data.get('receiver_name')
     receiver_phone = data.get('receiver_phone')
     shipping_address = data.get('shipping_address')
@@ -128,12 +209,16 @@ def create_order():
     items = data.get('items', [])
     if not all([receiver_name, receiver_phone, shipping_address, items]):
         abort(400, description="缺少必要欄位")
+    _validate_items(items)
+    # 一次批次查詢所有商品
+    try:
+        products = require_products(merge_lines(items).keys())
+    except ProductNotFoundError as e:
+        abort(400, description=str(e))
     # 計算金額
     total_amount = 0
     for item in items:
-        product = Product.query.get(item['product_id'])
-        if not product:
-            abort(400, description=f"找不到商品 {item['product_id']}")
+        product = products[int(item['product_id'])]
         item['product_name'] = product.name
         item['price'] = product.price
         total_amount += product.price * item['qty']
@@ -144,6 +229,7 @@ def create_order():
         status='pending',
         shipping_fee=0,
         payment_status='unpaid',
+        reserved_until=reservation_deadline(),
         remark=remark,
         receiver_name=receiver_name,
         receiver_phone=receiver_phone,
@@ -153,16 +239,20 @@ def create_order():
     db.session.flush()
     for item in items:
         db.session.add(OrderItem(order_id=order.id, product_id=item['product_id'], product_name=item['product_name'], qty=item['qty'], price=item['price']))
+    order.set_item_summary((item['product_name'], item['qty']) for item in items)
+    record_sales_changes([(None, sales_key(order))])
+    record_product_sales(product_sales_lines(sales_key(order)[0], [(item['product_id'], item['qty'], item['price']) for item in items]))
     # 狀態歷史
     db.session.add(OrderHistory(order_id=order.id, status='pending', operator=str(user_id), operated_at=datetime.now(), remark='訂單建立'))
-    # 扣減商品庫存
-    for item in items:
-        product = Product.query.get(item['product_id'])
-        if not product:
-            abort(400, description=f"找不到商品 {item['product_id']}")
-        if product.stock < item['qty']:
-            abort(400, description=f"商品 {product.name} 庫存不足")
-        product.change_stock(-item['qty'])
+    # 最後才扣庫存：鎖定商品列、條件式扣減（避免超賣）並寫入異動帳，縮短熱門商品的持鎖時間
+    try:
+        reserve_stock(items, order_id=order.id, operator=str(user_id))
+    except ProductNotFoundError as e:
+        db.session.rollback()
+        abort(400, description=str(e))
+    except InsufficientStockError as e:
+        db.session.rollback()
+        return jsonify({"code": 400, "name": "Bad Request", "message": str(e), "errors": e.shortages}), 400
     db.session.commit()
     return jsonify(order.to_dict(include_items=True, include_history=True)), 201
 
@@ -183,17 +273,20 @@ def update_order(order_id):
         o.shipping_address = data['shipping_address']
     if 'remark' in data:
         o.remark = data['remark']
-    # 商品明細可編輯（僅未結單）
+    # 商品明細可編輯（僅未結單）：差異更新明細並調整庫存
     if o.status == 'pending' and 'items' in data:
-        OrderItem.query.filter_by(order_id=o.id).delete()
-        total_amount = 0
-        for item in data['items']:
-            product = Product.query.get(item['product_id'])
-            if not product:
-                abort(400, description=f"找不到商品 {item['product_id']}")
-            db.session.add(OrderItem(order_id=o.id, product_id=product.id, product_name=product.name, qty=item['qty'], price=product.price))
-            total_amount += product.price * item['qty']
-        o.total_amount = total_amount
+        items = data['items'] or []
+        if not items:
+            abort(400, description="訂單至少需要一項商品")
+        _validate_items(items)
+        try:
+            apply_item_changes(o, items, operator=str(uid))
+        except ProductNotFoundError as e:
+            db.session.rollback()
+            abort(400, description=str(e))
+        except InsufficientStockError as e:
+            db.session.rollback()
+            return jsonify({"code": 400, "name": "Bad Request", "message": str(e), "errors": e.shortages}), 400
     db.session.commit()
     return jsonify(o.to_dict(include_items=True, include_history=True)), 200
 
@@ -207,6 +300,9 @@ def delete_order(order_id):
         abort(404, description="找不到或無權限刪除此訂單")
     # 在刪除訂單時記錄操作日誌
     log_operation(uid, claims.get('username', str(uid)), 'delete', 'order', order_id, f"刪除訂單 {order_id}")
+    record_sales_changes([(sales_key(o), None)])
+    if o.status != 'cancelled':
+        remove_orders_product_sales({o.id: sales_key(o)[0]})
     db.session.delete(o)
     db.session.commit()
     return jsonify({"message": "訂單刪除成功"}), 200
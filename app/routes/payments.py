@@ -4,7 +4,9 @@ from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
 from app import db
 from app.models import Order, Payment
 from app.services.notification_service import create_notification
+from app.services.order_service import is_reservation_expired, mark_order_paid
 from app.utils.check_mac_value import verify_check_mac_value
+from app.utils.idempotency import idempotent
 import hashlib
 import urllib.parse
 from datetime import datetime
@@ -14,9 +16,10 @@ bp_pay = Blueprint('payments', __name__, url_prefix='/payments')
 
 @bp_pay.route('/<int:order_id>', methods=['POST'])
 @jwt_required()
+@idempotent
 def pay_order(order_id):
     """
-    付款訂單
+    付款訂單（支援 Idempotency-Key header，重試時重播第一次的回應）
     ---
     tags:
       - Payments
@@ -37,7 +40,7 @@ def pay_order(order_id):
             schema:
               $ref: '#/components/schemas/Payment'
       400:
-        description: 訂單狀態不允許付款
+        description: 訂單狀態不允許付款或已超過付款期限
       403:
         description: 不是該用戶的訂單
       404:
@@ -55,6 +58,11 @@ def pay_order(order_id):
     if order.status != 'pending':
         abort(400, description="訂單已付款或已取消")
 
+    # 鎖定訂單並以條件式 UPDATE 改為已付款，避免與逾期取消同時發生
+    # （已過付款期限但尚未被排程取消的訂單庫存仍保留，照常付款）
+    if not mark_order_paid(order.id):
+        db.session.rollback()
+        abort(400, description="訂單已付款或已取消")
     # 建立 Payment 紀錄，使用 total_amount 屬性
     payment = Payment(
         order_id=order.id,
@@ -63,7 +71,6 @@ def pay_order(order_id):
         payment_method='mock',
         paid_at=datetime.now()
     )
-    order.status = 'paid'
     db.session.add(payment)
     db.session.commit()
 
@@ -95,6 +102,8 @@ def ecpay_pay_order(order_id):
         abort(403, "這不是你的訂單")
     if order.status != 'pending':
         abort(400, "訂單已付款或已取消")
+    if is_reservation_expired(order):
+        abort(400, "訂單已超過付款期限")
 
     merchant_id = current_app.config.get('ECPAY_MERCHANT_ID')
     hash_key    = current_app.config.get('ECPAY_HASH_KEY')
@@ -194,7 +203,11 @@ def ecpay_callback():
             return 'fail'
         order = Order.query.get(order_id)
         if order:
-            order.status = 'paid'
+            # 綠界重送相同的通知：已處理過，直接回覆成功
+            if Payment.query.filter_by(order_id=order.id, transaction_id=trade_no).first():
+                return '1|OK'
+            if not mark_order_paid(order.id):
+                return _late_ecpay_payment(order, trade_no)
             payment = Payment(
                 order_id=order.id,
                 amount=order.total_amount,
@@ -220,6 +233,30 @@ def ecpay_callback():
             return '1|OK'
     return '0|FAIL'
 
+def _late_ecpay_payment(order, trade_no):
+    """
+    訂單已取消（例如付款期間逾期被自動取消）或狀態不允許付款時收到付款成功通知：
+    庫存已釋回，不把訂單改回已付款；保留付款紀錄並標記待退款，由客服處理
+    """
+    db.session.rollback()
+    current_app.logger.warning(f"訂單 {order.id} 狀態為 {order.status}，付款 {trade_no} 標記為待退款")
+    db.session.add(Payment(
+        order_id=order.id,
+        amount=order.total_amount,
+        status='refund_required',
+        payment_method='ecpay',
+        transaction_id=trade_no,
+        paid_at=datetime.now()
+    ))
+    db.session.commit()
+    create_notification(
+        user_id=order.user_id,
+        type='payment_refund',
+        title='付款待退款',
+        content=f'您的訂單 {order.order_sn} 已取消，本次付款將辦理退款。'
+    )
+    return '1|OK'
+
 @bp_pay.route('', methods=['GET'])
 @jwt_required()
 def list_payments():
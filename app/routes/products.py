@@ -1,43 +1,118 @@
 # app/routes/products.py
 
-from flask import Blueprint, request, jsonify, abort
+from flask import Blueprint, request, jsonify, abort, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
 from app import db
+from sqlalchemy import func
 from app.models.product import Product, Category
 from app.schemas.product import product_schema, products_schema
+from app.models.inventory import InventoryMovement
+from app.services.product_service import batch_set_active, bulk_update_products, set_stock
+from app.services.inventory_service import adjust_stock, record_opening_stock, InsufficientStockError
+from app.services.catalog_service import catalog_cache, catalog_key, cached_catalog_response, invalidate_catalog, product_options_snapshot, product_options_delta, facet_matrix, filter_product_ids, FacetMatrix
+from app.services.search_service import product_search_index, name_condition, fallback_autocomplete, AUTOCOMPLETE_LIMIT
+from app.services.category_service import category_descendants
 
 bp_prod = Blueprint('products', __name__, url_prefix='/products')
 
+def _bool_arg(value):
+    return None if value is None else value == 'true'
+
 # 允許未登入（訪客）也能查詢商品
 @bp_prod.route('', methods=['GET'])
 def list_products():
     """
-    查詢商品清單，支援條件查詢（名稱、分類、上下架）、分頁、排序
+    查詢商品清單，支援條件查詢（名稱、分類、上下架、有無庫存）、分頁、排序
+    category_id 涵蓋整個子樹（子孫分類 id 由記憶體索引取得，單一 IN 查詢）
+    有 name 時走商品搜尋索引（n-gram），依相關度排序
+    facets=true 時一併回傳分類、上下架、有無庫存的數量（由預先彙總的數量矩陣計算，總數也不另外 count）
+    結果依查詢參數快取，商品異動時失效
     """
     name = request.args.get('name')
     category_id = request.args.get('category_id')
     is_active = request.args.get('is_active')
+    in_stock = request.args.get('in_stock')
+    with_facets = request.args.get('facets') in ('1', 'true')
     page = int(request.args.get('page', 1))
     page_size = int(request.args.get('page_size', 20))
-    q = Product.query
-    if name:
-        q = q.filter(Product.name.like(f"%{name}%"))
-    if category_id:
-        q = q.filter(Product.category_id == int(category_id))
-    if is_active is not None:
-        q = q.filter(Product.is_active == (is_active == 'true'))
-    total = q.count()
-    products = q.order_by(Product.created_at.desc()).offset((page-1)*page_size).limit(page_size).all()
-    return jsonify({
-        "data": products_schema.dump(products),
-        "total": total
-    })
+    filters = {
+        "category_ids": category_descendants(category_id) if category_id else None,
+        "is_active": _bool_arg(is_active),
+        "in_stock": _bool_arg(in_stock),
+    }
+
+    def build():
+        index = product_search_index() if name else None
+        if index is not None:
+            return _search_products(index, name, filters, page, page_size, with_facets)
+        q = Product.query
+        if name:
+            # 搜尋索引仍在背景建立：改用 LIKE（比對方式相同，依建立時間排序）
+            q = q.filter(name_condition(name))
+        if category_id:
+            q = q.filter(Product.category_id.in_(filters["category_ids"]))
+        if is_active is not None:
+            q = q.filter(Product.is_active == filters["is_active"])
+        if in_stock is not None:
+            q = q.filter((Product.stock > 0) if filters["in_stock"] else (func.coalesce(Product.stock, 0) <= 0))
+        matrix = None
+        if with_facets:
+            # 與索引路徑相同：facets 以符合名稱的所有商品計算
+            matrix = FacetMatrix.query([pid for (pid,) in Product.query.filter(name_condition(name)).with_entities(Product.id)]) if name else facet_matrix()
+        total = matrix.count(**filters) if matrix else q.count()
+        products = q.order_by(Product.created_at.desc()).offset((page-1)*page_size).limit(page_size).all()
+        payload = {
+            "data": products_schema.dump(products),
+            "total": total
+        }
+        if matrix:
+            payload["facets"] = matrix.facets(**filters)
+        return payload, 200
+
+    key = catalog_key('list', name=name, category_id=category_id, is_active=is_active, in_stock=in_stock,
+                      facets=with_facets or None, page=page, page_size=page_size)
+    return cached_catalog_response(key, build)
+
+def _search_products(index, name, filters, page, page_size, with_facets):
+    """
+    以搜尋索引取得依相關度排序、名稱符合的 id，上下架 / 分類 / 庫存篩選以資料庫為準，只查詢當頁商品
+    facets 以符合名稱的商品另建數量矩陣
+    """
+    matched = index.search(name)
+    ids = filter_product_ids(matched, **filters)
+    page_ids = ids[(page-1)*page_size:page*page_size]
+    found = {p.id: p for p in Product.query.filter(Product.id.in_(page_ids))} if page_ids else {}
+    payload = {
+        "data": products_schema.dump([found[pid] for pid in page_ids if pid in found]),
+        "total": len(ids)
+    }
+    if with_facets:
+        payload["facets"] = FacetMatrix.query(matched).facets(**filters)
+    return payload, 200
+
+@bp_prod.route('/autocomplete', methods=['GET'])
+def autocomplete():
+    """商品名稱輸入提示（上架商品），?q=關鍵字&limit=10"""
+    q = request.args.get('q', '')
+    limit = min(int(request.args.get('limit', AUTOCOMPLETE_LIMIT)), 50)
+    index = product_search_index()
+    if index is None:
+        return jsonify(fallback_autocomplete(q, limit=limit))
+    # 索引中的上下架狀態可能尚未反映其他 worker 的異動，以資料庫再確認
+    found = index.autocomplete(q, limit=limit)
+    active = set(filter_product_ids([p["id"] for p in found], is_active=True))
+    return jsonify([p for p in found if p["id"] in active])
 
 @bp_prod.route('/<int:pid>', methods=['GET'])
 def get_product(pid):
-    """取得單一商品"""
-    p = Product.query.get_or_404(pid)
-    return jsonify(product_schema.dump(p))
+    """取得單一商品（快取）"""
+    return cached_catalog_response(catalog_key('product', pid), lambda: (product_schema.dump(Product.query.get_or_404(pid)), 200))
+
+@bp_prod.route('/cache/stats', methods=['GET'])
+@jwt_required()
+def catalog_cache_stats():
+    """商品目錄快取命中統計（本 worker）"""
+    return jsonify(catalog_cache().stats())
 
 @bp_prod.route('', methods=['POST'])
 @jwt_required()
@@ -65,7 +140,11 @@ def create_product():
         category_id=category_id
     )
     db.session.add(prod)
+    db.session.flush()
+    # 期初庫存寫入庫存異動帳
+    record_opening_stock(prod, operator=get_jwt_identity())
     db.session.commit()
+    invalidate_catalog([prod.id])
     return jsonify(product_schema.dump(prod)), 201
 
 @bp_prod.route('/<int:pid>', methods=['PUT'])
@@ -74,10 +153,16 @@ def update_product(pid):
     """編輯商品"""
     p = Product.query.get_or_404(pid)
     data = request.get_json() or {}
-    for field in ['name', 'price', 'promo_price', 'stock', 'desc', 'image_url', 'is_active', 'category_id']:
+    for field in ['name', 'price', 'promo_price', 'desc', 'image_url', 'is_active', 'category_id']:
         if field in data:
             setattr(p, field, data[field])
+    # 直接設定庫存視為盤點調整，以差額寫入異動帳
+    if data.get('stock') is not None:
+        if isinstance(data['stock'], bool) or not isinstance(data['stock'], int) or data['stock'] < 0:
+            abort(400, description="stock 必須為非負整數")
+        set_stock(p, data['stock'], operator=get_jwt_identity())
     db.session.commit()
+    invalidate_catalog([pid])
     return jsonify(product_schema.dump(p))
 
 @bp_prod.route('/<int:pid>', methods=['DELETE'])
@@ -87,40 +172,99 @@ def delete_product(pid):
     p = Product.query.get_or_404(pid)
     db.session.delete(p)
     db.session.commit()
+    invalidate_catalog([pid])
     return jsonify({'msg': '商品已刪除'})
 
 @bp_prod.route('/batch/active', methods=['PUT'])
 @jwt_required()
 def batch_active():
-    """批次上下架商品"""
+    """批次上下架商品（單一 UPDATE ... WHERE id IN）"""
     data = request.get_json() or {}
     ids = data.get('ids', [])
     is_active = data.get('is_active', True)
-    for pid in ids:
-        p = Product.query.get(pid)
-        if p:
-            p.is_active = is_active
+    if not isinstance(ids, list):
+        abort(400, description="ids 必須為陣列")
+    try:
+        updated = batch_set_active(ids, is_active)
+    except (TypeError, ValueError):
+        abort(400, description="ids 格式錯誤")
+    invalidate_catalog(ids)
+    return jsonify({'msg': '批次上下架完成', 'updated': updated})
+
+@bp_prod.route('/bulk', methods=['PUT'])
+@jwt_required()
+def bulk_update():
+    """
+    批次異動商品：上下架、價格 / 促銷價、庫存增減
+    body: {"items": [{"id": 1, "is_active": true, "price": 99, "promo_price": null, "stock_delta": -3}, ...]}
+    回傳每個商品的結果：updated / not_found / invalid / insufficient_stock
+    """
+    data = request.get_json() or {}
+    items = data.get('items')
+    if not isinstance(items, list) or not items:
+        abort(400, description="items 必須為非空陣列")
+    try:
+        results = bulk_update_products(items, operator=get_jwt_identity())
+    except InsufficientStockError as e:
+        db.session.rollback()
+        return jsonify({"code": 409, "name": "Conflict", "message": str(e), "errors": e.shortages}), 409
     db.session.commit()
-    return jsonify({'msg': '批次上下架完成'})
+    invalidate_catalog([r['id'] for r in results if r['result'] == 'updated'])
+    counts = {}
+    for r in results:
+        counts[r['result']] = counts.get(r['result'], 0) + 1
+    return jsonify({'results': results, 'counts': counts})
 
 @bp_prod.route('/<int:pid>/stock', methods=['PUT'])
 @jwt_required()
 def change_stock(pid):
-    """庫存異動（進貨/銷售）"""
+    """
+    庫存異動（進貨/出庫），以條件式 UPDATE 原子調整並寫入庫存異動帳
+    庫存不足時回 400（不再默默歸零）
+    """
     p = Product.query.get_or_404(pid)
     data = request.get_json() or {}
     delta = data.get('delta')
     if delta is None:
         abort(400, description="缺少 delta 參數")
-    p.change_stock(delta)
+    if isinstance(delta, bool) or not isinstance(delta, int):
+        abort(400, description="delta 必須為整數")
+    try:
+        adjust_stock({p.id: delta}, {p.id: p}, operator=get_jwt_identity(), remark=data.get('remark'))
+    except InsufficientStockError as e:
+        db.session.rollback()
+        return jsonify({"code": 400, "name": "Bad Request", "message": str(e), "errors": e.shortages}), 400
+    # commit 後只清除此商品的快取（見 catalog_service.invalidate_product_stock）
     db.session.commit()
     return jsonify(product_schema.dump(p))
 
+@bp_prod.route('/<int:pid>/movements', methods=['GET'])
+@jwt_required()
+def stock_movements(pid):
+    """商品的庫存異動紀錄（新到舊，分頁）"""
+    Product.query.get_or_404(pid)
+    page = int(request.args.get('page', 1))
+    page_size = int(request.args.get('page_size', 50))
+    q = InventoryMovement.query.filter_by(product_id=pid).order_by(InventoryMovement.id.desc())
+    movements = q.offset((page-1)*page_size).limit(page_size).all()
+    return jsonify([m.to_dict() for m in movements])
+
 @bp_prod.route('/options', methods=['GET'])
 @jwt_required()
 def product_options():
-    """商品下拉選單用（id, name, price, stock）"""
-    qs = Product.query.filter_by(is_active=True).order_by(Product.created_at)
-    return jsonify([
-        {"id": p.id, "name": p.name, "price": p.price, "stock": p.stock} for p in qs
-    ])
+    """
+    商品下拉選單用（id, name, price, stock）
+    回傳預先建立的版本化快照，帶 ETag（版本號），未變動時回 304
+    ?since_version=<版本> 只回傳該版本之後的差異（changed / removed）
+    """
+    since_version = request.args.get('since_version')
+    if since_version:
+        delta = product_options_delta(since_version)
+        resp = jsonify(delta)
+        resp.set_etag(delta["version"])
+        return resp
+    snapshot = product_options_snapshot()
+    resp = current_app.response_class(snapshot.body, mimetype='application/json')
+    resp.set_etag(snapshot.version)
+    resp.headers['X-Catalog-Version'] = snapshot.version
+    return resp.make_conditional(request)
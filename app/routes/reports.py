@@ -1,47 +1,174 @@
-from flask import Blueprint, request, jsonify, Response
+from flask import Blueprint, request, jsonify, Response, abort, stream_with_context, send_file, current_app
 from app.services.report_service import *
+from app.services.report_job_service import submit_report_job, ReportJobError, JOB_SUCCEEDED
+from app.utils.xlsx import XLSX_MIMETYPE
+from app.models.report_job import ReportJob
+from flask_jwt_extended import jwt_required, get_jwt, get_jwt_identity
 from app.models.customer import Customer
 from app.models.order import Order
 from app.models.product import Product
 from app import db
+from datetime import datetime
+import os
+import tempfile
 
 bp = Blueprint('reports', __name__, url_prefix='/api/reports')
 
+def _report_date(name):
+    """報表日期參數正規化為 YYYY-MM-DD（相同日期的不同寫法共用快取）"""
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value).date().isoformat()
+    except ValueError:
+        abort(400, description=f"{name} 必須為 ISO 日期格式（YYYY-MM-DD）")
+
+def _report_response(endpoint, params, compute):
+    try:
+        body = cached_report(endpoint, params, compute)
+    except ValueError as e:
+        abort(400, description=str(e))
+    return current_app.response_class(body, mimetype='application/json')
+
 @bp.route('/sales', methods=['GET'])
 def sales():
+    """?period=day|week|month|year&start=&end=&tz=Asia/Taipei（預設 UTC）"""
     period = request.args.get('period', 'day')
-    start = request.args.get('start')
-    end = request.args.get('end')
-    data = sales_summary(period, start, end)
-    return jsonify(data)
+    if period not in PERIODS:
+        abort(400, description=f"period 僅支援 {'、'.join(PERIODS)}")
+    try:
+        zone = resolve_timezone(request.args.get('tz'))
+    except ValueError as e:
+        abort(400, description=str(e))
+    params = {'period': period, 'start': _report_date('start'), 'end': _report_date('end'), 'tz': zone and zone.key}
+    return _report_response('sales', params, lambda: sales_summary(**params))
 
 @bp.route('/product-ranking', methods=['GET'])
 def product_ranking():
-    start = request.args.get('start')
-    end = request.args.get('end')
-    limit = int(request.args.get('limit', 10))
-    data = product_sales_ranking(start, end, limit)
-    return jsonify(data)
+    """?start=&end=（日期，含）&limit=10&sort_by=qty|amount"""
+    sort_by = request.args.get('sort_by', 'qty')
+    if sort_by not in ('qty', 'amount'):
+        abort(400, description="sort_by 僅支援 qty、amount")
+    try:
+        limit = int(request.args.get('limit', 10))
+    except ValueError:
+        abort(400, description="limit 必須為整數")
+    params = {'start': _report_date('start'), 'end': _report_date('end'), 'limit': limit, 'sort_by': sort_by}
+    return _report_response('product-ranking', params, lambda: product_sales_ranking(**params))
 
 @bp.route('/customer-summary', methods=['GET'])
 def customer_summary():
-    data = customer_sales_summary()
-    return jsonify(data)
+    return _report_response('customer-summary', {}, customer_sales_summary)
+
+@bp.route('/cache/stats', methods=['GET'])
+@jwt_required()
+def report_cache_stats():
+    """報表結果快取命中統計（本 worker）"""
+    return jsonify(report_cache().stats())
+
+def _export_filters():
+    """匯出的建立時間範圍（start / end，ISO 日期或日期時間）"""
+    try:
+        return parse_date_range(request.args.get('start'), request.args.get('end'))
+    except ValueError as e:
+        abort(400, description=str(e))
+
+def _csv_response(chunks, filename):
+    """邊查詢邊輸出（chunked），不把整份 CSV 放進記憶體"""
+    return Response(stream_with_context(chunks), mimetype='text/csv', headers={'Content-Disposition': f'attachment;filename={filename}'})
+
+def _wants_xlsx():
+    fmt = request.args.get('format', 'csv')
+    if fmt not in ('csv', 'xlsx'):
+        abort(400, description="format 僅支援 csv、xlsx")
+    return fmt == 'xlsx'
+
+def _xlsx_response(write, filename):
+    """
+    XLSX 必須寫完才能輸出（zip 格式），先以 write-only 模式寫到暫存檔，再分段送出檔案
+    回應結束後刪除暫存檔
+    """
+    fd, path = tempfile.mkstemp(suffix='.xlsx')
+    os.close(fd)
+    try:
+        write(path)
+    except Exception:
+        os.remove(path)
+        raise
+    resp = send_file(path, mimetype=XLSX_MIMETYPE, as_attachment=True, download_name=filename)
+    resp.call_on_close(lambda: os.remove(path))
+    return resp
 
 @bp.route('/export/customers', methods=['GET'])
 def export_customers():
-    customers = Customer.query.all()
-    csv_data = export_customers_csv(customers)
-    return Response(csv_data, mimetype='text/csv', headers={'Content-Disposition': 'attachment;filename=customers.csv'})
+    """?start=&end=（建立時間）&format=csv|xlsx"""
+    start, end = _export_filters()
+    if _wants_xlsx():
+        return _xlsx_response(lambda path: write_customers_xlsx(path, start, end), 'customers.xlsx')
+    return _csv_response(stream_customers_csv(start, end), 'customers.csv')
 
 @bp.route('/export/orders', methods=['GET'])
 def export_orders():
-    orders = Order.query.all()
-    csv_data = export_orders_csv(orders)
-    return Response(csv_data, mimetype='text/csv', headers={'Content-Disposition': 'attachment;filename=orders.csv'})
+    """
+    ?start=&end=（建立時間）&status=pending,paid&format=csv|xlsx
+    xlsx 含訂單、明細、付款三個工作表
+    """
+    start, end = _export_filters()
+    statuses = [s for s in request.args.get('status', '').split(',') if s]
+    if _wants_xlsx():
+        return _xlsx_response(lambda path: write_orders_xlsx(path, start, end, statuses), 'orders.xlsx')
+    return _csv_response(stream_orders_csv(start, end, statuses), 'orders.csv')
 
 @bp.route('/export/products', methods=['GET'])
 def export_products():
-    products = Product.query.all()
-    csv_data = export_products_csv(products)
-    return Response(csv_data, mimetype='text/csv', headers={'Content-Disposition': 'attachment;filename=products.csv'})
+    """?start=&end=（建立時間）&is_active=true|false&format=csv|xlsx"""
+    start, end = _export_filters()
+    is_active = request.args.get('is_active')
+    is_active = None if is_active is None else is_active == 'true'
+    if _wants_xlsx():
+        return _xlsx_response(lambda path: write_products_xlsx(path, start, end, is_active), 'products.xlsx')
+    return _csv_response(stream_products_csv(start, end, is_active), 'products.csv')
+
+# 非同步報表工作：大範圍的匯出 / 報表改為背景產生，完成後再下載
+_JOB_MIMETYPES = {'csv': 'text/csv', 'xlsx': XLSX_MIMETYPE, 'json': 'application/json'}
+
+def _require_admin():
+    if get_jwt().get('role') != 'admin':
+        abort(403, description="Permission denied")
+
+@bp.route('/jobs', methods=['POST'])
+@jwt_required()
+def create_report_job():
+    """
+    {"kind": "orders|customers|products|sales", "format": "csv|xlsx|json", "params": {...}}
+    新建立回傳 202；相同條件的工作仍在排隊或執行中時回傳該工作（200，deduplicated=true）
+    """
+    _require_admin()
+    data = request.get_json() or {}
+    try:
+        job, created = submit_report_job(data.get('kind'), data.get('format', 'csv'), data.get('params') or {},
+                                         user_id=int(get_jwt_identity()))
+    except ReportJobError as e:
+        abort(400, description=str(e))
+    body = dict(job.to_dict(), deduplicated=not created)
+    return jsonify(body), 202 if created else 200
+
+@bp.route('/jobs/<string:job_id>', methods=['GET'])
+@jwt_required()
+def get_report_job(job_id):
+    _require_admin()
+    job = ReportJob.query.get_or_404(job_id)
+    return jsonify(job.to_dict())
+
+@bp.route('/jobs/<string:job_id>/download', methods=['GET'])
+@jwt_required()
+def download_report_job(job_id):
+    _require_admin()
+    job = ReportJob.query.get_or_404(job_id)
+    if job.status != JOB_SUCCEEDED:
+        abort(409, description=f"報表工作尚未完成（{job.status}）")
+    if not job.artifact_path or not os.path.exists(job.artifact_path):
+        abort(410, description="報表結果檔已不存在")
+    return send_file(job.artifact_path, mimetype=_JOB_MIMETYPES[job.format], as_attachment=True,
+                     download_name=f"{job.kind}-{job.id}.{job.format}")
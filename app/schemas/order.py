@@ -26,6 +26,9 @@ class OrderSchema(Schema):
     shipping_fee = fields.Float()
     payment_status = fields.Str()
     remark = fields.Str()
+    item_count = fields.Int(dump_only=True)
+    item_qty = fields.Int(dump_only=True)
+    item_summary = fields.Str(dump_only=True)
     receiver_name = fields.Str(required=True)
     receiver_phone = fields.Str(required=True)
     shipping_address = fields.Str(required=True)
@@ -4,6 +4,8 @@ class CategorySchema(Schema):
     id = fields.Int(dump_only=True)
     name = fields.Str(required=True)
     parent_id = fields.Int(allow_none=True)
+    path = fields.Str(dump_only=True)
+    depth = fields.Int(dump_only=True)
     children = fields.Nested(lambda: CategorySchema(), many=True, dump_only=True)
     created_at = fields.DateTime(dump_only=True)
     updated_at = fields.DateTime(dump_only=True)
@@ -18,11 +20,18 @@ class ProductSchema(Schema):
     image_url = fields.Str()
     is_active = fields.Boolean()
     category_id = fields.Int(allow_none=True)
-    category = fields.Nested(CategorySchema, dump_only=True)
+    # 取自 process 內的分類樹快照，不逐筆 lazy load 分類與子分類
+    category = fields.Method('get_category', dump_only=True)
     created_at = fields.DateTime(dump_only=True)
     updated_at = fields.DateTime(dump_only=True)
 
+    def get_category(self, obj):
+        from app.services.category_service import category_node
+        return category_node(obj.category_id)
+
 product_schema = ProductSchema()
 products_schema = ProductSchema(many=True)
 category_schema = CategorySchema()
 categories_schema = CategorySchema(many=True)
+# 分類樹節點（children 由 category_service 一次查詢後組成，不逐層 lazy load）
+category_node_schema = CategorySchema(exclude=('children',))
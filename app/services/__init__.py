@@ -7,3 +7,4 @@ from .order_service import *
 from .payment_service import *
 from .customer_service import *
 from .report_service import *
+from .inventory_service import *
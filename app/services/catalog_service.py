@@ -0,0 +1,261 @@
+from app.models.product import Product
+from app import db
+from sqlalchemy import func, select
+from app.utils.cache import get_cache, MISSING
+from app.services.search_service import reindex_products
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from collections import OrderedDict
+import hashlib
+import time
+
+CATALOG_CACHE = 'catalog'
+STOCK_CHANGED = 'catalog_stock_changed'
+FACET_MATRIX = 'product_facets'
+FACET_CHUNK_SIZE = 1000
+OPTIONS_HISTORY_SIZE = 16
+
+
+def catalog_cache():
+    """商品目錄快取（GET /products、GET /products/<pid>）"""
+    return get_cache(
+        CATALOG_CACHE,
+        ttl=current_app.config.get('CATALOG_CACHE_TTL', 60),
+        max_entries=current_app.config.get('CATALOG_CACHE_MAX_ENTRIES', 1024),
+    )
+
+
+def catalog_key(kind, *parts, **params):
+    """依查詢參數組成快取 key（參數排序後正規化）"""
+    return (kind,) + parts + tuple(sorted((k, v) for k, v in params.items() if v is not None))
+
+
+def cached_catalog_response(key, build):
+    """
+    讀穿快取：命中時直接回傳已序列化的 JSON；未命中才呼叫 build() 查詢資料庫
+    build() 回傳 (payload, status)，只快取 200 的結果
+    """
+    cache = catalog_cache()
+    body = cache.get(key)
+    if body is MISSING:
+        payload, status = build()
+        body = current_app.json.dumps(payload)
+        if status != 200:
+            return current_app.response_class(body, status=status, mimetype='application/json')
+        cache.set(key, body)
+    return current_app.response_class(body, mimetype='application/json')
+
+
+def invalidate_catalog(product_ids=None):
+    """
+    商品異動後清除目錄快取，並標記下拉選單快照需重建
+    product_ids：名稱、上下架或分類有異動的商品，增量更新搜尋索引
+    """
+    catalog_cache().clear()
+    current_app.extensions.pop(FACET_MATRIX, None)
+    if product_ids:
+        reindex_products(product_ids)
+    _options_state()["dirty"] = True
+
+
+def invalidate_product_stock(product_ids):
+    """
+    庫存異動（commit 之後）：只清除這些商品的單筆快取，下拉選單快照下次只重新查詢這些商品
+    清單頁與數量矩陣中的庫存（in_stock 篩選、facets）視為可短暫過期的資料，在 CATALOG_CACHE_TTL 內更新；
+    其他 worker 的快取同樣在 TTL 內更新，下單不會清空整個目錄快取
+    """
+    catalog_cache().delete(*(catalog_key('product', pid) for pid in product_ids))
+    _options_state()["stale_ids"].update(product_ids)
+
+
+def mark_stock_changed(product_ids):
+    """
+    記錄目前交易中庫存有異動的商品（下單、改單、取消、逾期釋回、盤點）
+    交易 commit 後才清除這些商品的快取（見 invalidate_product_stock），rollback 則不處理
+    """
+    db.session.info.setdefault(STOCK_CHANGED, set()).update(product_ids)
+
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_after_stock_commit(session):
+    product_ids = session.info.pop(STOCK_CHANGED, None)
+    if product_ids and has_app_context():
+        # 庫存不影響搜尋索引，不需重新索引
+        invalidate_product_stock(product_ids)
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_stock_changes(session):
+    session.info.pop(STOCK_CHANGED, None)
+
+
+class OptionsSnapshot:
+    """商品下拉選單快照：內容雜湊即版本號，相同資料在各 worker 得到相同版本"""
+
+    def __init__(self, rows, built_at):
+        self.rows = rows
+        self.by_id = {r["id"]: r for r in rows}
+        self.body = current_app.json.dumps(rows)
+        self.version = hashlib.sha1(self.body.encode('utf-8')).hexdigest()[:16]
+        self.built_at = built_at
+
+
+def _options_state():
+    return current_app.extensions.setdefault(
+        'product_options', {"current": None, "dirty": True, "stale_ids": set(), "history": OrderedDict()})
+
+
+def _options_query():
+    return (
+        db.session.query(Product.id, Product.name, Product.price, Product.stock)
+        .filter(Product.is_active.is_(True))
+        .order_by(Product.created_at, Product.id)
+    )
+
+
+def _option_row(r):
+    return {"id": r.id, "name": r.name, "price": r.price, "stock": r.stock}
+
+
+def _patched_options(current, product_ids):
+    """只重新查詢庫存異動的商品並替換快照中的對應列；出現快照中沒有的商品時回傳 None（改為完整重建）"""
+    fresh = {}
+    ids = sorted(product_ids)
+    for i in range(0, len(ids), FACET_CHUNK_SIZE):
+        fresh.update((r.id, _option_row(r)) for r in _options_query().filter(Product.id.in_(ids[i:i + FACET_CHUNK_SIZE])))
+    if any(pid not in current.by_id for pid in fresh):
+        return None
+    rows = [fresh.get(r["id"]) if r["id"] in product_ids else r for r in current.rows]
+    return OptionsSnapshot([r for r in rows if r is not None], current.built_at)
+
+
+def product_options_snapshot():
+    """
+    取得目前的下拉選單快照；商品異動（invalidate_catalog）或超過 TTL 時才完整重建
+    只有庫存異動（invalidate_product_stock）時只重新查詢這些商品並替換，不掃描整個商品表
+    保留最近 OPTIONS_HISTORY_SIZE 個版本供 since_version 計算差異
+    """
+    state = _options_state()
+    current = state["current"]
+    ttl = current_app.config.get('CATALOG_CACHE_TTL', 60)
+    fresh = current is not None and not state["dirty"] and time.monotonic() - current.built_at < ttl
+    if fresh and not state["stale_ids"]:
+        return current
+    stale_ids, state["stale_ids"] = state["stale_ids"], set()
+    snapshot = _patched_options(current, stale_ids) if fresh else None
+    if snapshot is None:
+        snapshot = OptionsSnapshot([_option_row(r) for r in _options_query()], time.monotonic())
+    if current is not None and current.version == snapshot.version:
+        current.built_at = snapshot.built_at
+        snapshot = current
+    state["current"] = snapshot
+    state["dirty"] = False
+    history = state["history"]
+    history[snapshot.version] = snapshot
+    history.move_to_end(snapshot.version)
+    while len(history) > OPTIONS_HISTORY_SIZE:
+        history.popitem(last=False)
+    return snapshot
+
+
+def product_options_delta(since_version):
+    """
+    回傳自 since_version 以來的差異 {'version', 'full', 'changed', 'removed'}
+    本 worker 沒有該版本時回傳完整資料（full=True）
+    """
+    snapshot = product_options_snapshot()
+    old = _options_state()["history"].get(since_version)
+    if old is None:
+        return {"version": snapshot.version, "full": True, "changed": snapshot.rows, "removed": []}
+    changed = [r for r in snapshot.rows if old.by_id.get(r["id"]) != r]
+    removed = [pid for pid in old.by_id if pid not in snapshot.by_id]
+    return {"version": snapshot.version, "full": False, "changed": changed, "removed": removed}
+
+
+class FacetMatrix:
+    """
+    商品數量矩陣 {(category_id, is_active, in_stock): count}
+    各 facet 的數量皆由矩陣在記憶體中加總，不必每次查詢多個 count()
+    """
+
+    def __init__(self, cells, built_at=None):
+        self.cells = cells
+        self.built_at = time.monotonic() if built_at is None else built_at
+
+    @classmethod
+    def query(cls, product_ids=None):
+        """一次 GROUP BY 建立矩陣；給 product_ids 時只計算這些商品（分批 IN 查詢後相加）"""
+        in_stock = func.coalesce(Product.stock, 0) > 0
+        base = select(Product.category_id, Product.is_active, in_stock, func.count()).group_by(Product.category_id, Product.is_active, in_stock)
+        cells = {}
+        chunks = [None] if product_ids is None else [product_ids[i:i + FACET_CHUNK_SIZE] for i in range(0, len(product_ids), FACET_CHUNK_SIZE)]
+        for chunk in chunks:
+            q = base if chunk is None else base.where(Product.id.in_(chunk))
+            for category_id, active, stocked, n in db.session.execute(q):
+                key = (category_id, bool(active), bool(stocked))
+                cells[key] = cells.get(key, 0) + n
+        return cls(cells)
+
+    def count(self, category_ids=None, is_active=None, in_stock=None):
+        return sum(
+            n for (cid, active, stocked), n in self.cells.items()
+            if (category_ids is None or cid in category_ids)
+            and (is_active is None or active == is_active)
+            and (in_stock is None or stocked == in_stock)
+        )
+
+    def facets(self, category_ids=None, is_active=None, in_stock=None):
+        """
+        各 facet 的數量：每個 facet 套用其他篩選條件、但不套用自己的條件
+        （選了某個分類後，仍可看到其他分類各有幾筆）
+        """
+        categories = {}
+        for (cid, active, stocked), n in self.cells.items():
+            if (is_active is None or active == is_active) and (in_stock is None or stocked == in_stock):
+                categories[cid] = categories.get(cid, 0) + n
+        return {
+            "category": [
+                {"category_id": cid, "count": n}
+                for cid, n in sorted(categories.items(), key=lambda kv: (-kv[1], kv[0] is None, kv[0] or 0))
+                if n
+            ],
+            "is_active": {
+                "true": self.count(category_ids, True, in_stock),
+                "false": self.count(category_ids, False, in_stock),
+            },
+            "in_stock": {
+                "true": self.count(category_ids, is_active, True),
+                "false": self.count(category_ids, is_active, False),
+            },
+        }
+
+
+def filter_product_ids(product_ids, category_ids=None, is_active=None, in_stock=None):
+    """
+    依資料庫目前的上下架、分類、庫存篩選 product_ids（保持原順序，分批 IN 查詢）
+    搜尋索引各 worker 各自一份，可能尚未反映其他 worker 的異動，篩選條件一律以資料庫為準
+    """
+    conditions = []
+    if category_ids is not None:
+        conditions.append(Product.category_id.in_(category_ids))
+    if is_active is not None:
+        conditions.append(Product.is_active.is_(is_active))
+    if in_stock is not None:
+        conditions.append((Product.stock > 0) if in_stock else (func.coalesce(Product.stock, 0) <= 0))
+    if not conditions:
+        return list(product_ids)
+    found = set()
+    for i in range(0, len(product_ids), FACET_CHUNK_SIZE):
+        chunk = product_ids[i:i + FACET_CHUNK_SIZE]
+        found.update(db.session.execute(select(Product.id).where(Product.id.in_(chunk), *conditions)).scalars())
+    return [pid for pid in product_ids if pid in found]
+
+
+def facet_matrix():
+    """全商品的數量矩陣（本 worker），商品異動（invalidate_catalog）或超過 TTL 時重建"""
+    matrix = current_app.extensions.get(FACET_MATRIX)
+    ttl = current_app.config.get('CATALOG_CACHE_TTL', 60)
+    if matrix is None or time.monotonic() - matrix.built_at >= ttl:
+        matrix = FacetMatrix.query()
+        current_app.extensions[FACET_MATRIX] = matrix
+    return matrix
@@ -0,0 +1,157 @@
+from app.models.product import Category
+from app import db
+from app.schemas.product import category_node_schema
+from app.services.catalog_service import invalidate_catalog
+from app.utils.cache import read_version, bump_version
+from flask import current_app
+from sqlalchemy import func, select, update
+import time
+
+CATEGORY_TREE = 'categories'
+
+
+class CategoryTreeError(ValueError):
+    """分類樹操作不合法（父分類不存在、移到自己底下、仍有子分類）"""
+
+
+def category_path(parent, cid):
+    return f"{parent.path if parent is not None else '/'}{cid}/"
+
+
+def _get_parent(parent_id):
+    if parent_id is None:
+        return None
+    parent = db.session.get(Category, int(parent_id))
+    if parent is None:
+        raise CategoryTreeError(f"找不到父分類 {parent_id}")
+    return parent
+
+
+def place_category(cat):
+    """新分類寫入物化路徑與深度（會先 flush 取得 id，不 commit）"""
+    parent = _get_parent(cat.parent_id)
+    db.session.flush()
+    cat.path = category_path(parent, cat.id)
+    cat.depth = parent.depth + 1 if parent is not None else 0
+    return cat
+
+
+def move_category(cat, parent_id):
+    """
+    將分類（連同整個子樹）移到新的父分類下，不 commit
+    子樹所有節點的 path / depth 以一次 UPDATE 依前綴改寫，parent_id 也直接寫入資料庫
+    """
+    parent = _get_parent(parent_id)
+    if parent is not None and parent.path.startswith(cat.path):
+        raise CategoryTreeError("不能將分類移到自己或自己的子分類底下")
+    old_path = cat.path
+    new_path = category_path(parent, cat.id)
+    if new_path == old_path:
+        return cat
+    # 先寫入 session 中尚未 flush 的變更（例如同一個請求改的名稱），下面的 expire_all 才不會丟棄
+    db.session.flush()
+    depth_diff = (parent.depth + 1 if parent is not None else 0) - cat.depth
+    db.session.execute(
+        update(Category)
+        .where(Category.path.like(f"{old_path}%"))
+        .values(
+            path=new_path + func.substr(Category.path, len(old_path) + 1),
+            depth=Category.depth + depth_diff,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    db.session.execute(
+        update(Category)
+        .where(Category.id == cat.id)
+        .values(parent_id=parent.id if parent is not None else None)
+        .execution_options(synchronize_session=False)
+    )
+    # session 中已載入的分類重新讀取 parent_id / path / depth
+    db.session.expire_all()
+    return cat
+
+
+def ensure_deletable(cat):
+    """仍有子分類時不可刪除（避免子樹變成孤兒）"""
+    has_children = db.session.execute(select(Category.id).where(Category.parent_id == cat.id).limit(1)).first()
+    if has_children:
+        raise CategoryTreeError("請先刪除或移走子分類")
+
+
+class CategoryTreeSnapshot:
+    """
+    某個版本的整棵分類樹（process 內、唯讀）
+    - body：整棵樹預先序列化好的 JSON（GET /categories 直接回傳）
+    - nodes：id -> 巢狀節點 dict（含 children），供單一分類與 ProductSchema.category 使用
+    - descendants：id -> 自己與所有子孫 id 的集合
+    """
+
+    def __init__(self, categories, version, dump):
+        self.version = version
+        self.nodes = {}
+        roots = []
+        descendants = {}
+        # 依 path 排序，父節點必定排在子節點之前
+        for cat in categories:
+            node = dump(cat)
+            node["children"] = []
+            self.nodes[cat.id] = node
+            parent = self.nodes.get(cat.parent_id)
+            (parent["children"] if parent is not None else roots).append(node)
+            for ancestor in (cat.path or f"/{cat.id}/").strip('/').split('/'):
+                descendants.setdefault(int(ancestor), set()).add(cat.id)
+        self.descendants = {cid: frozenset(ids) for cid, ids in descendants.items()}
+        self.body = current_app.json.dumps(roots)
+        self._bodies = {}
+        self.checked_at = time.monotonic()
+
+    def subtree_body(self, cid):
+        """單一分類（含子孫）的 JSON，第一次使用時序列化後保留"""
+        body = self._bodies.get(cid)
+        if body is None and cid in self.nodes:
+            body = self._bodies.setdefault(cid, current_app.json.dumps(self.nodes[cid]))
+        return body
+
+
+def category_tree_snapshot():
+    """
+    本 worker 的分類樹快照
+    每 CACHE_VERSION_CHECK_SECONDS 秒最多比對一次資料庫的版本戳記（主鍵查詢），
+    版本不同才重新查詢整棵樹；期間的讀取完全不碰資料庫
+    其他 worker 異動分類後，本 worker 的商品目錄快取（內含分類）也一併清除
+    """
+    snapshot = current_app.extensions.get(CATEGORY_TREE)
+    interval = current_app.config.get('CACHE_VERSION_CHECK_SECONDS', 5)
+    if snapshot is not None and time.monotonic() - snapshot.checked_at < interval:
+        return snapshot
+    version = read_version(CATEGORY_TREE)
+    if snapshot is not None and snapshot.version == version:
+        snapshot.checked_at = time.monotonic()
+        return snapshot
+    if snapshot is not None:
+        invalidate_catalog()
+    snapshot = CategoryTreeSnapshot(Category.query.order_by(Category.path), version, category_node_schema.dump)
+    current_app.extensions[CATEGORY_TREE] = snapshot
+    return snapshot
+
+
+def category_descendants(cid):
+    """分類與其所有子孫的 id（取自分類樹快照）"""
+    return category_tree_snapshot().descendants.get(int(cid), frozenset())
+
+
+def category_node(cid):
+    """分類的巢狀節點（含 children，取自分類樹快照），不存在時為 None"""
+    if cid is None:
+        return None
+    return category_tree_snapshot().nodes.get(cid)
+
+
+def invalidate_category_tree():
+    """
+    分類新增、移動、刪除（commit 之後）呼叫：遞增版本戳記讓所有 worker 重建分類樹快照，
+    並清除本 worker 的快照與商品目錄快取（分類篩選涵蓋子樹、商品內含分類）
+    """
+    bump_version(CATEGORY_TREE)
+    current_app.extensions.pop(CATEGORY_TREE, None)
+    invalidate_catalog()
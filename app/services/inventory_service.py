@@ -0,0 +1,234 @@
+from app.models.product import Product
+from app.models.inventory import InventoryMovement
+from app.models.order import OrderItem
+from app import db
+from app.services.catalog_service import mark_stock_changed
+from sqlalchemy import case, func, insert, select, update
+from datetime import datetime
+
+# 庫存異動類型
+MOVEMENT_OPENING = 'opening'        # 期初（導入異動帳時的既有庫存）
+MOVEMENT_RECEIPT = 'receipt'        # 進貨
+MOVEMENT_SALE = 'sale'              # 訂單扣減
+MOVEMENT_ADJUSTMENT = 'adjustment'  # 手動調整 / 盤點
+MOVEMENT_RELEASE = 'release'        # 訂單取消、逾期或明細減少而釋回
+MOVEMENT_KINDS = (MOVEMENT_OPENING, MOVEMENT_RECEIPT, MOVEMENT_SALE, MOVEMENT_ADJUSTMENT, MOVEMENT_RELEASE)
+
+RECONCILE_CHUNK_SIZE = 1000
+
+
+class ProductNotFoundError(ValueError):
+    """訂單明細中有不存在的商品"""
+
+    def __init__(self, product_ids):
+        self.product_ids = list(product_ids)
+        super().__init__(f"找不到商品 {', '.join(str(pid) for pid in self.product_ids)}")
+
+
+class InsufficientStockError(ValueError):
+    """庫存不足，shortages 一次列出所有不足的品項"""
+
+    def __init__(self, shortages):
+        self.shortages = shortages
+        super().__init__("、".join(f"商品 {s['product_name']} 庫存不足" for s in shortages))
+
+
+def merge_lines(items):
+    """合併相同商品的明細數量，回傳 {product_id: qty}（保留原始順序）"""
+    needed = {}
+    for item in items:
+        pid = int(item['product_id'])
+        needed[pid] = needed.get(pid, 0) + int(item['qty'])
+    return needed
+
+
+def load_products(product_ids, lock=False):
+    """
+    一次查出多個商品，回傳 {id: Product}
+    lock=True 時使用 SELECT ... FOR UPDATE，並依 id 排序鎖定避免死結
+    （同時以鎖定後讀到的最新值覆蓋 session 中已載入的商品）
+    """
+    ids = sorted(set(product_ids))
+    if not ids:
+        return {}
+    q = Product.query.filter(Product.id.in_(ids)).order_by(Product.id)
+    if lock:
+        q = q.with_for_update().populate_existing()
+    return {p.id: p for p in q}
+
+
+def require_products(product_ids, lock=False):
+    """同 load_products，但有不存在的商品時拋出 ProductNotFoundError"""
+    products = load_products(product_ids, lock=lock)
+    missing = [pid for pid in dict.fromkeys(product_ids) if pid not in products]
+    if missing:
+        raise ProductNotFoundError(missing)
+    return products
+
+
+def _shortages(products, needed):
+    return [
+        {
+            "product_id": pid,
+            "product_name": products[pid].name,
+            "requested": qty,
+            "available": products[pid].stock or 0,
+        }
+        for pid, qty in needed.items()
+        if (products[pid].stock or 0) < qty
+    ]
+
+
+def _movement_kind(kind, delta):
+    """kind 可為字串，或 (增加時類型, 減少時類型)"""
+    if isinstance(kind, tuple):
+        return kind[0] if delta > 0 else kind[1]
+    return kind
+
+
+def adjust_stock(deltas, products=None, kind=(MOVEMENT_RECEIPT, MOVEMENT_ADJUSTMENT), ref_type=None, ref_id=None, operator=None, remark=None):
+    """
+    批次調整庫存 {product_id: delta}（正數入庫、負數出庫），並寫入庫存異動帳，回傳 {product_id: Product}
+    - products 未提供時一次批次查詢並鎖定所有商品列（依 id 排序）
+    - 所有庫存不足的品項一次回報（InsufficientStockError），不會扣成負數
+    - 以單一條件式 UPDATE（stock + delta >= 0）原子地調整，異動帳一次批次 INSERT，
+      皆在呼叫端的交易內；熱門商品只在 UPDATE 到 commit 之間持有列鎖，
+      呼叫端應把庫存調整放在交易最後
+    發生例外時可能已部分調整，呼叫端必須 rollback
+    """
+    deltas = {pid: d for pid, d in deltas.items() if d}
+    if products is None:
+        products = require_products(deltas.keys(), lock=True)
+    if not deltas:
+        return products
+    taking = {pid: -d for pid, d in deltas.items() if d < 0}
+    shortages = _shortages(products, taking)
+    if shortages:
+        raise InsufficientStockError(shortages)
+
+    delta = case(deltas, value=Product.id)
+    result = db.session.execute(
+        update(Product)
+        .where(Product.id.in_(deltas.keys()), Product.stock + delta >= 0)
+        .values(stock=Product.stock + delta)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount != len(deltas):
+        # 沒有列鎖的資料庫（如 SQLite）在查詢後被其他交易搶先扣減：
+        # 庫存恰好變動了 delta 的列是本次已調整成功的，其餘即為不足品項
+        before = {pid: products[pid].stock or 0 for pid in deltas}
+        for pid in deltas:
+            db.session.refresh(products[pid], ['stock'])
+        failed = {pid: taking[pid] for pid in taking if products[pid].stock != before[pid] - taking[pid]}
+        raise InsufficientStockError(_shortages(products, failed))
+    for pid in deltas:
+        db.session.expire(products[pid], ['stock'])
+    mark_stock_changed(deltas.keys())
+
+    now = datetime.utcnow()
+    db.session.execute(insert(InventoryMovement), [
+        {
+            "product_id": pid,
+            "kind": _movement_kind(kind, d),
+            "qty": d,
+            "ref_type": ref_type,
+            "ref_id": ref_id,
+            "operator": operator,
+            "remark": remark,
+            "created_at": now,
+        }
+        for pid, d in deltas.items()
+    ])
+    return products
+
+
+def reserve_stock(items, order_id=None, operator=None):
+    """
+    扣減訂單明細的商品庫存（異動類型 sale），回傳 {product_id: Product}
+    一次批次查詢鎖定、一次條件式 UPDATE，不足品項一次回報（見 adjust_stock）
+    """
+    return adjust_stock({pid: -qty for pid, qty in merge_lines(items).items()},
+                        kind=MOVEMENT_SALE, ref_type='order', ref_id=order_id, operator=operator)
+
+
+def release_order_stock(order_ids, operator=None, remark=None):
+    """
+    釋回多筆訂單的明細庫存（異動類型 release，ref 為各自的訂單）
+    一次 GROUP BY 查詢明細、一次 CASE UPDATE 加回庫存、一次批次 INSERT 異動帳（不 commit）
+    """
+    order_ids = list(order_ids)
+    if not order_ids:
+        return
+    lines = db.session.execute(
+        select(OrderItem.order_id, OrderItem.product_id, func.sum(OrderItem.qty))
+        .where(OrderItem.order_id.in_(order_ids))
+        .group_by(OrderItem.order_id, OrderItem.product_id)
+        .order_by(OrderItem.product_id)
+    ).all()
+    deltas = {}
+    for _, pid, qty in lines:
+        deltas[pid] = deltas.get(pid, 0) + int(qty)
+    deltas = {pid: qty for pid, qty in deltas.items() if qty}
+    if not deltas:
+        return
+    db.session.execute(
+        update(Product)
+        .where(Product.id.in_(deltas.keys()))
+        .values(stock=Product.stock + case(deltas, value=Product.id))
+        .execution_options(synchronize_session='fetch')
+    )
+    mark_stock_changed(deltas.keys())
+    now = datetime.utcnow()
+    db.session.execute(insert(InventoryMovement), [
+        {
+            "product_id": pid,
+            "kind": MOVEMENT_RELEASE,
+            "qty": int(qty),
+            "ref_type": 'order',
+            "ref_id": oid,
+            "operator": operator,
+            "remark": remark,
+            "created_at": now,
+        }
+        for oid, pid, qty in lines if qty
+    ])
+
+
+def record_opening_stock(product, operator=None):
+    """新商品的期初庫存寫入異動帳（呼叫端需先 flush 取得 product.id）"""
+    if product.stock:
+        db.session.add(InventoryMovement(product_id=product.id, kind=MOVEMENT_OPENING, qty=product.stock, operator=operator))
+
+
+def reconcile_stock(product_ids=None, fix=False, chunk_size=RECONCILE_CHUNK_SIZE):
+    """
+    以異動帳重新計算庫存並與 products.stock 比對，回傳不一致的清單
+    [{'product_id', 'stock', 'ledger'}, ...]
+    每批商品一次 GROUP BY 查詢；fix=True 時以一次 CASE UPDATE 修正為異動帳的數值（不 commit）
+    """
+    if product_ids is None:
+        product_ids = [pid for pid, in db.session.execute(select(Product.id).order_by(Product.id))]
+    drift = []
+    for start in range(0, len(product_ids), chunk_size):
+        chunk = product_ids[start:start + chunk_size]
+        ledger = dict(db.session.execute(
+            select(InventoryMovement.product_id, func.sum(InventoryMovement.qty))
+            .where(InventoryMovement.product_id.in_(chunk))
+            .group_by(InventoryMovement.product_id)
+        ).all())
+        stocks = db.session.execute(select(Product.id, Product.stock).where(Product.id.in_(chunk))).all()
+        chunk_drift = {
+            pid: int(ledger.get(pid) or 0)
+            for pid, stock in stocks
+            if (stock or 0) != int(ledger.get(pid) or 0)
+        }
+        drift += [{"product_id": pid, "stock": stock or 0, "ledger": chunk_drift[pid]} for pid, stock in stocks if pid in chunk_drift]
+        if fix and chunk_drift:
+            db.session.execute(
+                update(Product)
+                .where(Product.id.in_(chunk_drift.keys()))
+                .values(stock=case(chunk_drift, value=Product.id))
+                .execution_options(synchronize_session=False)
+            )
+            mark_stock_changed(chunk_drift.keys())
+    return drift
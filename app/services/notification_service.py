@@ -1,6 +1,7 @@
 from app.models import OperationLog, Notification
 from app import db
 from datetime import datetime
+from sqlalchemy import insert
 
 def log_operation(user_id, username, action, target_type, target_id=None, content=None):
     log = OperationLog(
@@ -27,3 +28,13 @@ def create_notification(user_id, type, title, content):
     db.session.add(notif)
     db.session.commit()
     return notif
+
+def bulk_create_notifications(rows):
+    """
+    批次新增通知（單一 INSERT，不 commit，由呼叫端控制交易）
+    rows: [{'user_id', 'type', 'title', 'content'}, ...]
+    """
+    if not rows:
+        return
+    now = datetime.utcnow()
+    db.session.execute(insert(Notification), [dict(is_read=False, created_at=now, **r) for r in rows])
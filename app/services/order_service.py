@@ -1,11 +1,325 @@
-from app.models.order import Order
+from app.models.order import Order, OrderItem, OrderHistory
 from app import db
+from flask import current_app
+from app.services.notification_service import bulk_create_notifications
+from app.services.sales_rollup_service import sales_key, record_sales_changes, product_sales_lines, record_product_sales, remove_orders_product_sales
+from app.services.inventory_service import merge_lines, load_products, adjust_stock, release_order_stock, ProductNotFoundError, MOVEMENT_RELEASE, MOVEMENT_SALE
+from sqlalchemy import insert, select, update, or_
+from sqlalchemy.dialects.mysql import match
+from sqlalchemy.orm import joinedload, selectinload
+from datetime import datetime, timedelta
+import re
+
+# 訂單狀態允許的轉換（from -> to）
+ORDER_STATUS_TRANSITIONS = {
+    'pending': {'paid', 'confirmed', 'cancelled'},
+    'paid': {'confirmed', 'shipped', 'cancelled'},
+    'confirmed': {'shipped', 'cancelled'},
+    'shipped': {'delivered'},
+    'delivered': set(),
+    'cancelled': set(),
+}
+ORDER_STATUSES = set(ORDER_STATUS_TRANSITIONS)
+
+# 批次狀態更新的結果
+TRANSITION_UPDATED = 'updated'
+TRANSITION_FORBIDDEN = 'forbidden'
+TRANSITION_NOT_FOUND = 'not_found'
+TRANSITION_INVALID = 'invalid_transition'
+
+BULK_CHUNK_SIZE = 500
+
+# 逾期未付款訂單自動取消
+EXPIRED_ORDER_OPERATOR = 'system'
+EXPIRED_ORDER_REMARK = '逾期未付款，自動取消並釋回庫存'
+
+# 看起來像訂單編號的關鍵字（英文前綴 + 數字），走 order_sn 唯一索引
+ORDER_SN_PATTERN = re.compile(r'^[A-Za-z]{2,5}\d{4,}$')
+# MySQL ngram_token_size 預設為 2，短於此長度的關鍵字無法使用全文索引
+FULLTEXT_MIN_LENGTH = 2
+
+class ConcurrentTransitionError(RuntimeError):
+    """批次狀態更新時，有訂單在讀取後被其他交易改變狀態（無法得知是哪幾筆），呼叫端應 rollback 後重試"""
+
 
 def create_order(**kwargs):
     order = Order(**kwargs)
     db.session.add(order)
+    db.session.flush()
+    record_sales_changes([(None, sales_key(order))])
     db.session.commit()
     return order
 
 def get_order_by_sn(order_sn):
     return Order.query.filter_by(order_sn=order_sn).first()
+
+def order_load_options(include_items=False, include_history=False, include_user=False):
+    """
+    訂單查詢的預先載入設定，查詢次數與筆數無關
+    - user：joinedload 同一個查詢帶出
+    - items/histories：selectinload，每頁各一次 IN 查詢
+    """
+    opts = []
+    if include_user:
+        opts.append(joinedload(Order.user))
+    if include_items:
+        opts.append(selectinload(Order.items))
+    if include_history:
+        opts.append(selectinload(Order.histories))
+    return opts
+
+def can_transition(from_status, to_status):
+    return to_status in ORDER_STATUS_TRANSITIONS.get(from_status, ())
+
+def bulk_transition_status(ids, status, operator, remark=None, owner_id=None, from_statuses=None, chunk_size=BULK_CHUNK_SIZE):
+    """
+    批次變更訂單狀態（set-based），回傳 [{'id', 'result'}, ...]
+    - 每個 chunk：一次 SELECT ... FOR UPDATE、一次 UPDATE、一次批次 INSERT 歷程與通知
+    - owner_id 不為 None 時只能變更該使用者自己的訂單
+    - from_statuses 可再限縮允許的原狀態（例如逾期取消只處理 pending）
+    - 變更為 cancelled 時一併釋回明細庫存（見 release_order_stock），並自每日商品銷售扣除
+    - 以讀取時的原狀態為條件更新，期間被其他交易改變的訂單回報 invalid_transition（見 _apply_transition）
+    - 不 commit，由呼叫端一次 commit（失敗時整批 rollback，不會部分更新）
+    """
+    if status not in ORDER_STATUSES:
+        raise ValueError(f"不支援的訂單狀態 {status}")
+    results = {}
+    order_ids = []
+    for oid in ids:
+        try:
+            oid = int(oid)
+        except (TypeError, ValueError):
+            results[str(oid)] = TRANSITION_NOT_FOUND
+            continue
+        if oid not in results:
+            results[oid] = None
+            order_ids.append(oid)
+
+    now = datetime.now()
+    for start in range(0, len(order_ids), chunk_size):
+        chunk = order_ids[start:start + chunk_size]
+        rows = db.session.execute(
+            select(Order.id, Order.user_id, Order.status, Order.payment_status, Order.total_amount, Order.created_at)
+            .where(Order.id.in_(chunk))
+            .order_by(Order.id)
+            .with_for_update()
+        ).all()
+        found = {r.id: r for r in rows}
+        changed = []
+        for oid in chunk:
+            row = found.get(oid)
+            if row is None:
+                results[oid] = TRANSITION_NOT_FOUND
+            elif owner_id is not None and row.user_id != owner_id:
+                results[oid] = TRANSITION_FORBIDDEN
+            elif not can_transition(row.status, status) or (from_statuses is not None and row.status not in from_statuses):
+                results[oid] = TRANSITION_INVALID
+            else:
+                results[oid] = TRANSITION_UPDATED
+                changed.append(row)
+        if not changed:
+            continue
+        values = {"status": status}
+        if status != 'pending':
+            values["reserved_until"] = None
+        # 歷程、通知、釋回庫存等只針對實際更新成功的訂單
+        updated = _apply_transition(changed, values)
+        for r in changed:
+            if r.id not in updated:
+                results[r.id] = TRANSITION_INVALID
+        changed = [r for r in changed if r.id in updated]
+        if not changed:
+            continue
+        if status == 'cancelled':
+            release_order_stock([r.id for r in changed], operator=operator, remark=remark)
+            remove_orders_product_sales({r.id: r.created_at.date() for r in changed})
+        # 每日銷售彙總：由原狀態移到新狀態
+        record_sales_changes([
+            (
+                (r.created_at.date(), r.status, r.payment_status or 'unpaid', r.total_amount or 0),
+                (r.created_at.date(), status, r.payment_status or 'unpaid', r.total_amount or 0),
+            )
+            for r in changed
+        ])
+        db.session.execute(insert(OrderHistory), [
+            {"order_id": r.id, "status": status, "operator": operator, "operated_at": now, "remark": remark}
+            for r in changed
+        ])
+        # 狀態異動通知（站內）
+        bulk_create_notifications([
+            {"user_id": r.user_id, "type": "order_status", "title": "訂單狀態更新", "content": f"您的訂單 {r.id} 狀態已變更為 {status}"}
+            for r in changed
+        ])
+    return [{"id": oid, "result": result} for oid, result in results.items()]
+
+def _apply_transition(rows, values):
+    """
+    條件式 UPDATE：每個原狀態一次（WHERE status = 讀取時的狀態），回傳實際更新的訂單 id
+    - 支援 RETURNING 的資料庫（SQLite、PostgreSQL）直接取回更新的 id，讀取後被改變的訂單略過
+    - 其他資料庫（MySQL，已以 SELECT ... FOR UPDATE 鎖定）比對 rowcount，不符時拋出 ConcurrentTransitionError
+    """
+    by_status = {}
+    for r in rows:
+        by_status.setdefault(r.status, []).append(r.id)
+    returning = db.engine.dialect.update_returning
+    updated = set()
+    for from_status, ids in by_status.items():
+        stmt = (
+            update(Order)
+            .where(Order.id.in_(ids), Order.status == from_status)
+            .values(**values)
+            .execution_options(synchronize_session=False)
+        )
+        if returning:
+            updated.update(db.session.execute(stmt.returning(Order.id)).scalars())
+            continue
+        if db.session.execute(stmt).rowcount != len(ids):
+            raise ConcurrentTransitionError(f"有 {from_status} 訂單在更新前已被其他交易變更狀態")
+        updated.update(ids)
+    return updated
+
+def reservation_deadline(now=None):
+    """新訂單的庫存保留期限（付款期限）"""
+    minutes = current_app.config.get('ORDER_PAYMENT_WINDOW_MINUTES', 30)
+    return (now or datetime.utcnow()) + timedelta(minutes=minutes)
+
+def is_reservation_expired(order, now=None):
+    return order.reserved_until is not None and order.reserved_until <= (now or datetime.utcnow())
+
+def mark_order_paid(order_id, now=None):
+    """
+    付款成功：將仍為 pending 的訂單改為已付款（不 commit），回傳是否成功
+    先以 SELECT ... FOR UPDATE 鎖定訂單，再以條件式 UPDATE（status = pending）更新，與逾期取消
+    （sweep_expired_orders）互斥：已被取消的訂單不會被改回已付款；已過付款期限但尚未被取消的訂單
+    庫存仍保留，照常入帳，由排程的條件式 UPDATE 因原狀態不符而略過
+    """
+    now = now or datetime.utcnow()
+    row = db.session.execute(
+        select(Order.status, Order.payment_status, Order.total_amount, Order.created_at)
+        .where(Order.id == order_id)
+        .with_for_update()
+    ).first()
+    if row is None or row.status != 'pending':
+        return False
+    claimed = db.session.execute(
+        update(Order)
+        .where(Order.id == order_id, Order.status == 'pending')
+        .values(status='paid', payment_status='paid', reserved_until=None)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if claimed != 1:
+        return False
+    day = (row.created_at or now).date()
+    amount = row.total_amount or 0
+    record_sales_changes([((day, row.status, row.payment_status or 'unpaid', amount), (day, 'paid', 'paid', amount))])
+    return True
+
+def sweep_expired_orders(now=None, batch_size=BULK_CHUNK_SIZE, max_batches=None):
+    """
+    取消逾期未付款的 pending 訂單並釋回庫存，回傳取消筆數
+    - 依 (status, reserved_until) 索引每次取 batch_size 筆，
+      以 bulk_transition_status 一次更新狀態、寫歷程、通知、釋回庫存
+    - 每批各自 commit，縮短鎖定時間；期間被付款的訂單會因原狀態不符而略過
+    """
+    now = now or datetime.utcnow()
+    cancelled = 0
+    batches = 0
+    last_id = 0
+    while max_batches is None or batches < max_batches:
+        ids = db.session.execute(
+            select(Order.id)
+            .where(Order.status == 'pending', Order.reserved_until <= now, Order.id > last_id)
+            .order_by(Order.id)
+            .limit(batch_size)
+        ).scalars().all()
+        if not ids:
+            break
+        try:
+            results = bulk_transition_status(ids, 'cancelled', operator=EXPIRED_ORDER_OPERATOR,
+                                             remark=EXPIRED_ORDER_REMARK, from_statuses=('pending',), chunk_size=batch_size)
+        except ConcurrentTransitionError:
+            # 同時有訂單被付款：整批 rollback，下一輪重新讀取
+            db.session.rollback()
+            batches += 1
+            continue
+        db.session.commit()
+        cancelled += sum(1 for r in results if r['result'] == TRANSITION_UPDATED)
+        last_id = ids[-1]
+        batches += 1
+    return cancelled
+
+def apply_keyword_filter(q, keyword, dialect_name=None):
+    """
+    訂單關鍵字搜尋（order_sn、remark、receiver_name）
+    - 訂單編號格式且確實有訂單編號以此開頭：只做 order_sn 前綴比對，走唯一索引
+    - 否則（例如格式相同的備註、收件人文字）照一般關鍵字搜尋：
+      - MySQL：FULLTEXT (ngram) 片語比對
+      - 其他資料庫（SQLite 測試環境）或過短的關鍵字：LIKE 比對
+    """
+    keyword = keyword.strip()
+    if not keyword:
+        return q
+    if ORDER_SN_PATTERN.match(keyword):
+        prefix = Order.order_sn.like(f"{keyword}%")
+        if db.session.query(Order.id).filter(prefix).first() is not None:
+            return q.filter(prefix)
+    dialect_name = dialect_name or db.engine.dialect.name
+    phrase = keyword.replace('"', ' ').strip()
+    if dialect_name == 'mysql' and len(phrase) >= FULLTEXT_MIN_LENGTH:
+        return q.filter(match(Order.order_sn, Order.remark, Order.receiver_name, against=f'"{phrase}"').in_boolean_mode())
+    return q.filter(or_(Order.order_sn.like(f"%{keyword}%"), Order.remark.like(f"%{keyword}%"), Order.receiver_name.like(f"%{keyword}%")))
+
+def apply_item_changes(order, items, operator=None):
+    """
+    以差異方式更新訂單明細（同一個交易，不 commit）
+    - 一次批次查詢鎖定相關商品，依目前售價重新計價
+    - 只對新增 / 刪除 / 數量或價格變動的明細寫入
+    - 依數量差一次調整庫存（增加扣庫存、減少補回）
+    - 金額與明細變動同步到每日銷售彙總、每日商品銷售
+    回傳 {'added': n, 'removed': n, 'changed': n}
+    """
+    before = sales_key(order)
+    before_lines = [(line.product_id, line.qty, line.price) for line in order.items]
+    wanted = merge_lines(items)
+    current = {}
+    for line in order.items:
+        current.setdefault(line.product_id, []).append(line)
+
+    products = load_products(set(wanted) | set(current), lock=True)
+    missing = [pid for pid in wanted if pid not in products]
+    if missing:
+        raise ProductNotFoundError(missing)
+
+    deltas = {}
+    for pid in set(wanted) | set(current):
+        old_qty = sum(line.qty for line in current.get(pid, []))
+        if pid in products and old_qty != wanted.get(pid, 0):
+            deltas[pid] = old_qty - wanted.get(pid, 0)
+    adjust_stock(deltas, products, kind=(MOVEMENT_RELEASE, MOVEMENT_SALE), ref_type='order', ref_id=order.id, operator=operator)
+
+    stats = {'added': 0, 'removed': 0, 'changed': 0}
+    for pid, lines in current.items():
+        # 不再需要的品項，以及舊資料中重複的同商品明細
+        for line in (lines if pid not in wanted else lines[1:]):
+            order.items.remove(line)
+            stats['removed'] += 1
+    for pid, qty in wanted.items():
+        product = products[pid]
+        if pid in current:
+            line = current[pid][0]
+            if (line.qty, line.price, line.product_name) != (qty, product.price, product.name):
+                line.qty, line.price, line.product_name = qty, product.price, product.name
+                stats['changed'] += 1
+        else:
+            order.items.append(OrderItem(product_id=pid, product_name=product.name, qty=qty, price=product.price))
+            stats['added'] += 1
+
+    order.total_amount = sum(products[pid].price * qty for pid, qty in wanted.items())
+    order.set_item_summary((products[pid].name, qty) for pid, qty in wanted.items())
+    record_sales_changes([(before, sales_key(order))])
+    if order.status != 'cancelled':
+        record_product_sales(
+            product_sales_lines(before[0], before_lines, sign=-1)
+            + product_sales_lines(before[0], [(pid, qty, products[pid].price) for pid, qty in wanted.items()])
+        )
+    return stats
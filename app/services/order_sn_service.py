@@ -0,0 +1,79 @@
+from app.models.sequence import IdSequence
+from app import db
+from flask import current_app
+from sqlalchemy import insert, select, update
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime
+import os
+import threading
+
+ORDER_SN_SEQUENCE = 'order_sn'
+DEFAULT_BLOCK_SIZE = 1000
+
+
+class OrderSnGenerator:
+    """
+    訂單編號產生器：OMS + 日期 + 10 碼序號
+    序號由 id_sequences 以「整段配發」取得：每個 process 一次保留 block_size 個號碼，
+    用完才再跟資料庫要下一段，因此一般情況產生編號不需要任何 DB 往返。
+    不同 process 拿到的號碼段不重疊，編號全域唯一；同一個 process 內單調遞增。
+    """
+
+    def __init__(self, engine, name=ORDER_SN_SEQUENCE, block_size=DEFAULT_BLOCK_SIZE, prefix='OMS'):
+        self.engine = engine
+        self.name = name
+        self.block_size = block_size
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._next = self._end = 0
+
+    def _allocate_block(self):
+        """以獨立交易原子地保留下一段號碼，回傳 [start, end)"""
+        table = IdSequence.__table__
+        with self.engine.begin() as conn:
+            bumped = conn.execute(
+                update(table).where(table.c.name == self.name).values(next_value=table.c.next_value + self.block_size)
+            )
+            if bumped.rowcount == 0:
+                try:
+                    with conn.begin_nested():
+                        conn.execute(insert(table).values(name=self.name, next_value=1 + self.block_size))
+                    return 1, 1 + self.block_size
+                except IntegrityError:
+                    # 其他 process 同時建立了序列，改走一般配發
+                    conn.execute(
+                        update(table).where(table.c.name == self.name).values(next_value=table.c.next_value + self.block_size)
+                    )
+            end = conn.execute(select(table.c.next_value).where(table.c.name == self.name)).scalar_one()
+        return end - self.block_size, end
+
+    def next_value(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # fork 後的子 process 不可沿用父 process 的號碼段
+                self._pid = os.getpid()
+                self._next = self._end = 0
+            if self._next >= self._end:
+                self._next, self._end = self._allocate_block()
+            value = self._next
+            self._next += 1
+            return value
+
+    def next_sn(self, now=None):
+        now = now or datetime.now()
+        return f"{self.prefix}{now.strftime('%Y%m%d')}{self.next_value():010d}"
+
+
+def get_order_sn_generator(app=None):
+    """每個 app 一個產生器（存在 app.extensions）"""
+    app = app or current_app._get_current_object()
+    gen = app.extensions.get('order_sn_generator')
+    if gen is None:
+        gen = OrderSnGenerator(db.engine, block_size=app.config.get('ORDER_SN_BLOCK_SIZE', DEFAULT_BLOCK_SIZE))
+        app.extensions['order_sn_generator'] = gen
+    return gen
+
+
+def next_order_sn():
+    return get_order_sn_generator().next_sn()
@@ -1,15 +1,26 @@
 from app.models.product import Product, Category
 from app import db
+from app.services.inventory_service import load_products, adjust_stock, record_opening_stock, MOVEMENT_ADJUSTMENT
+from app.services.category_service import place_category, move_category, ensure_deletable, invalidate_category_tree
+from sqlalchemy import case, update
+
+BULK_CHUNK_SIZE = 500
+BULK_FIELDS = ('is_active', 'price', 'promo_price', 'stock_delta')
 
 def create_product(**kwargs):
     prod = Product(**kwargs)
     db.session.add(prod)
+    db.session.flush()
+    record_opening_stock(prod)
     db.session.commit()
     return prod
 
 def update_product(prod, **kwargs):
+    stock = kwargs.pop('stock', None)
     for k, v in kwargs.items():
         setattr(prod, k, v)
+    if stock is not None:
+        set_stock(prod, stock)
     db.session.commit()
     return prod
 
@@ -17,30 +28,148 @@ def delete_product(prod):
     db.session.delete(prod)
     db.session.commit()
 
-def batch_set_active(ids, is_active=True):
-    for pid in ids:
-        p = Product.query.get(pid)
-        if p:
-            p.is_active = is_active
+def batch_set_active(ids, is_active=True, chunk_size=BULK_CHUNK_SIZE):
+    """批次上下架（每批一次 UPDATE ... WHERE id IN），回傳實際更新筆數"""
+    ids = list(dict.fromkeys(int(pid) for pid in ids))
+    updated = 0
+    for start in range(0, len(ids), chunk_size):
+        result = db.session.execute(
+            update(Product)
+            .where(Product.id.in_(ids[start:start + chunk_size]))
+            .values(is_active=bool(is_active))
+            .execution_options(synchronize_session=False)
+        )
+        updated += result.rowcount
     db.session.commit()
+    return updated
 
-def change_stock(prod, delta):
-    prod.change_stock(delta)
+def change_stock(prod, delta, operator=None, remark=None):
+    """庫存異動（正數進貨，負數出庫），庫存不足時拋出 InsufficientStockError"""
+    adjust_stock({prod.id: delta}, {prod.id: prod}, operator=operator, remark=remark)
     db.session.commit()
     return prod
 
+def set_stock(prod, stock, operator=None):
+    """
+    直接設定庫存（盤點），以差額寫入異動帳（不 commit）
+    先鎖定商品並重新讀取庫存再計算差額，避免以過期的庫存覆蓋同時進行的扣庫存
+    """
+    products = load_products([prod.id], lock=True)
+    current = products[prod.id].stock or 0
+    adjust_stock({prod.id: int(stock) - current}, products, kind=MOVEMENT_ADJUSTMENT, operator=operator, remark='設定庫存')
+
 def create_category(**kwargs):
     cat = Category(**kwargs)
     db.session.add(cat)
+    place_category(cat)
     db.session.commit()
+    invalidate_category_tree()
     return cat
 
 def update_category(cat, **kwargs):
+    parent_id = kwargs.pop('parent_id', cat.parent_id)
     for k, v in kwargs.items():
         setattr(cat, k, v)
+    if parent_id != cat.parent_id:
+        move_category(cat, parent_id)
     db.session.commit()
+    invalidate_category_tree()
     return cat
 
 def delete_category(cat):
+    ensure_deletable(cat)
     db.session.delete(cat)
     db.session.commit()
+    invalidate_category_tree()
+
+def _validate_bulk_change(change):
+    """檢查單一商品的批次異動內容，回傳錯誤訊息或 None"""
+    if not any(f in change for f in BULK_FIELDS):
+        return "沒有任何異動欄位"
+    if 'is_active' in change and not isinstance(change['is_active'], bool):
+        return "is_active 必須為布林值"
+    for f in ('price', 'promo_price'):
+        v = change.get(f)
+        if f in change and not (v is None and f == 'promo_price'):
+            if isinstance(v, bool) or not isinstance(v, (int, float)) or v < 0:
+                return f"{f} 必須為非負數"
+    if 'stock_delta' in change:
+        v = change['stock_delta']
+        if isinstance(v, bool) or not isinstance(v, int):
+            return "stock_delta 必須為整數"
+    return None
+
+def _merge_bulk_changes(changes):
+    """同一商品出現多次時合併：stock_delta 相加，其餘欄位以後者為準"""
+    merged = {}
+    for change in changes:
+        pid = int(change['id'])
+        target = merged.setdefault(pid, {})
+        for f in BULK_FIELDS:
+            if f not in change:
+                continue
+            if f == 'stock_delta' and isinstance(target.get(f), int) and isinstance(change[f], int):
+                target[f] += change[f]
+            else:
+                target[f] = change[f]
+    return merged
+
+def bulk_update_products(changes, operator=None, chunk_size=BULK_CHUNK_SIZE):
+    """
+    批次異動商品（上下架、價格 / 促銷價、庫存增減），回傳每個商品的結果
+    changes: [{'id', 'is_active'?, 'price'?, 'promo_price'?, 'stock_delta'?}, ...]
+    每個 chunk：一次鎖定查詢，上下架最多兩次 UPDATE，價格、促銷價、庫存各一次 CASE UPDATE
+    結果：updated / not_found / invalid / insufficient_stock（該商品的所有異動皆不套用）
+    不 commit，由呼叫端一次 commit
+    """
+    results = {}
+    well_formed = []
+    for change in changes:
+        try:
+            int(change['id'])
+        except (TypeError, ValueError, KeyError):
+            results[str(change.get('id') if isinstance(change, dict) else change)] = {"result": "invalid", "error": "缺少或錯誤的 id"}
+            continue
+        well_formed.append(change)
+    merged = _merge_bulk_changes(well_formed)
+
+    ids = list(merged)
+    for start in range(0, len(ids), chunk_size):
+        chunk = ids[start:start + chunk_size]
+        products = load_products(chunk, lock=True)
+        valid = {}
+        for pid in chunk:
+            change = merged[pid]
+            if pid not in products:
+                results[pid] = {"result": "not_found"}
+                continue
+            error = _validate_bulk_change(change)
+            if error:
+                results[pid] = {"result": "invalid", "error": error}
+            elif (products[pid].stock or 0) + change.get('stock_delta', 0) < 0:
+                results[pid] = {"result": "insufficient_stock", "available": products[pid].stock or 0}
+            else:
+                results[pid] = {"result": "updated"}
+                valid[pid] = change
+        if not valid:
+            continue
+
+        for flag in (True, False):
+            flag_ids = [pid for pid, c in valid.items() if c.get('is_active') is flag]
+            if flag_ids:
+                db.session.execute(
+                    update(Product).where(Product.id.in_(flag_ids)).values(is_active=flag)
+                    .execution_options(synchronize_session=False)
+                )
+        for field in ('price', 'promo_price'):
+            values = {pid: c[field] for pid, c in valid.items() if field in c}
+            if values:
+                col = getattr(Product, field)
+                db.session.execute(
+                    update(Product).where(Product.id.in_(values.keys())).values({col: case(values, value=Product.id)})
+                    .execution_options(synchronize_session=False)
+                )
+        adjust_stock({pid: c['stock_delta'] for pid, c in valid.items() if c.get('stock_delta')}, products, operator=operator)
+        for pid in valid:
+            db.session.expire(products[pid])
+    return [dict(id=pid, **r) for pid, r in results.items()]
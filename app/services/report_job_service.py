@@ -0,0 +1,311 @@
+from app.models.report_job import ReportJob
+from app import db
+from app.services.report_service import (
+    parse_date_range, sales_summary,
+    stream_orders_csv, stream_customers_csv, stream_products_csv,
+    write_orders_xlsx, write_customers_xlsx, write_products_xlsx,
+)
+from app.services.sales_aggregation_service import resolve_timezone, SalesAggregationError, PERIODS
+from flask import current_app
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy import func, update
+from sqlalchemy.exc import IntegrityError
+import hashlib
+import json
+import os
+import threading
+import uuid
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_SUCCEEDED = 'succeeded'
+JOB_FAILED = 'failed'
+JOB_STATUSES = (JOB_QUEUED, JOB_RUNNING, JOB_SUCCEEDED, JOB_FAILED)
+
+REPORT_EXECUTOR = 'report_executor'
+JOB_INTERRUPTED = "工作執行中斷（逾時未回報心跳）"
+
+
+class ReportJobError(ValueError):
+    """報表工作參數不合法"""
+
+
+def _write_csv(chunks, path):
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        for chunk in chunks:
+            f.write(chunk)
+
+
+def _write_json(data, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, default=str)
+
+
+def _run_orders(path, fmt, params):
+    start, end = parse_date_range(params.get('start'), params.get('end'))
+    statuses = params.get('status')
+    if fmt == 'xlsx':
+        write_orders_xlsx(path, start, end, statuses)
+    else:
+        _write_csv(stream_orders_csv(start, end, statuses), path)
+
+
+def _run_customers(path, fmt, params):
+    start, end = parse_date_range(params.get('start'), params.get('end'))
+    if fmt == 'xlsx':
+        write_customers_xlsx(path, start, end)
+    else:
+        _write_csv(stream_customers_csv(start, end), path)
+
+
+def _run_products(path, fmt, params):
+    start, end = parse_date_range(params.get('start'), params.get('end'))
+    if fmt == 'xlsx':
+        write_products_xlsx(path, start, end, params.get('is_active'))
+    else:
+        _write_csv(stream_products_csv(start, end, params.get('is_active')), path)
+
+
+def _run_sales(path, fmt, params):
+    _write_json(sales_summary(params.get('period', 'day'), params.get('start'), params.get('end'), params.get('tz')), path)
+
+
+# 工作種類：允許的格式、允許的參數、執行函式
+REPORT_KINDS = {
+    'orders': (('csv', 'xlsx'), ('start', 'end', 'status'), _run_orders),
+    'customers': (('csv', 'xlsx'), ('start', 'end'), _run_customers),
+    'products': (('csv', 'xlsx'), ('start', 'end', 'is_active'), _run_products),
+    'sales': (('json',), ('start', 'end', 'period', 'tz'), _run_sales),
+}
+
+
+def normalize_job_params(kind, fmt, params):
+    """檢查工作種類、格式與參數，回傳正規化後的參數（相同條件得到相同內容，用於去重）"""
+    if kind not in REPORT_KINDS:
+        raise ReportJobError(f"不支援的報表種類 {kind}")
+    formats, allowed, _ = REPORT_KINDS[kind]
+    if fmt not in formats:
+        raise ReportJobError(f"{kind} 僅支援 {', '.join(formats)} 格式")
+    if not isinstance(params, dict):
+        raise ReportJobError("params 必須為物件")
+    unknown = set(params) - set(allowed)
+    if unknown:
+        raise ReportJobError(f"不支援的參數 {', '.join(sorted(unknown))}")
+    normalized = {k: v for k, v in params.items() if v not in (None, '', [])}
+    try:
+        parse_date_range(normalized.get('start'), normalized.get('end'))
+    except (TypeError, ValueError) as e:
+        raise ReportJobError(str(e))
+    if 'status' in normalized:
+        statuses = normalized['status']
+        if isinstance(statuses, str):
+            statuses = statuses.split(',')
+        normalized['status'] = sorted({s for s in statuses if s})
+    if 'is_active' in normalized and not isinstance(normalized['is_active'], bool):
+        raise ReportJobError("is_active 必須為布林值")
+    if normalized.get('period', 'day') not in PERIODS:
+        raise ReportJobError(f"period 僅支援 {'、'.join(PERIODS)}")
+    try:
+        resolve_timezone(normalized.get('tz'))
+    except SalesAggregationError as e:
+        raise ReportJobError(str(e))
+    return normalized
+
+
+def _job_key(kind, fmt, params):
+    raw = json.dumps([kind, fmt, params], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+def submit_report_job(kind, fmt, params, user_id=None):
+    """
+    建立報表工作並交給背景執行，回傳 (job, created)
+    相同種類 / 格式 / 參數的工作若仍在排隊或執行中，直接回傳該工作（created=False），不重複掃描
+    - 排隊超過 REPORT_JOB_CLAIM_TIMEOUT 仍無人領取（原 worker 已重啟）：交給本 worker 重新派送
+    - 執行中但超過 REPORT_JOB_TIMEOUT 沒有心跳：視為中斷，改為失敗後重新建立
+    """
+    params = normalize_job_params(kind, fmt, params)
+    key = _job_key(kind, fmt, params)
+    existing = ReportJob.query.filter_by(active_key=key).first()
+    if existing is not None:
+        now = datetime.utcnow()
+        if existing.status == JOB_QUEUED:
+            if existing.created_at < now - _seconds('REPORT_JOB_CLAIM_TIMEOUT', 30):
+                _dispatch(existing.id)
+            return existing, False
+        if not _is_stale(existing, now):
+            return existing, False
+        _finish(existing, JOB_FAILED, error=JOB_INTERRUPTED)
+        db.session.commit()
+
+    job = ReportJob(
+        id=uuid.uuid4().hex,
+        kind=kind,
+        format=fmt,
+        params=json.dumps(params, sort_keys=True, ensure_ascii=False),
+        params_hash=key,
+        active_key=key,
+        status=JOB_QUEUED,
+        created_by=user_id,
+    )
+    db.session.add(job)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # 同時有相同的工作剛被建立
+        db.session.rollback()
+        return ReportJob.query.filter_by(active_key=key).first(), False
+    _dispatch(job.id)
+    return job, True
+
+
+def report_executor():
+    """本 worker 的報表執行緒池（REPORT_WORKERS 個執行緒）"""
+    executor = current_app.extensions.get(REPORT_EXECUTOR)
+    if executor is None:
+        executor = current_app.extensions.setdefault(REPORT_EXECUTOR, ThreadPoolExecutor(
+            max_workers=current_app.config.get('REPORT_WORKERS', 2), thread_name_prefix='report-job'))
+    return executor
+
+
+def _seconds(name, default):
+    return timedelta(seconds=current_app.config.get(name, default))
+
+
+def _is_stale(job, now):
+    """執行中的工作最後一次心跳（舊資料以開始時間）超過 REPORT_JOB_TIMEOUT"""
+    last_seen = job.heartbeat_at or job.started_at or job.created_at
+    return last_seen < now - _seconds('REPORT_JOB_TIMEOUT', 120)
+
+
+def _dispatch(job_id):
+    if current_app.config.get('REPORT_JOBS_EAGER'):
+        # 測試環境：在目前的請求內直接執行
+        run_report_job(job_id)
+        return
+    report_executor().submit(_run_in_app, current_app._get_current_object(), job_id)
+
+
+def _run_in_app(app, job_id):
+    with app.app_context():
+        try:
+            run_report_job(job_id)
+        finally:
+            db.session.remove()
+
+
+def artifact_dir():
+    path = current_app.config.get('REPORT_ARTIFACT_DIR') or os.path.join(current_app.instance_path, 'reports')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _finish(job, status, error=None):
+    job.status = status
+    job.error = error
+    job.active_key = None
+    job.finished_at = datetime.utcnow()
+
+
+def _heartbeat(app, job_id, stop, interval):
+    """執行期間定期更新 heartbeat_at（獨立連線，不影響工作本身的 session）"""
+    with app.app_context():
+        while not stop.wait(interval):
+            with db.engine.begin() as conn:
+                conn.execute(
+                    update(ReportJob)
+                    .where(ReportJob.id == job_id, ReportJob.status == JOB_RUNNING)
+                    .values(heartbeat_at=datetime.utcnow())
+                )
+
+
+def run_report_job(job_id):
+    """
+    執行一個排隊中的工作：結果先寫到 .part 暫存檔，完成後才改名，下載時不會讀到寫一半的檔案
+    以條件式 UPDATE 取得工作（queued -> running），同一個工作只會被執行一次
+    執行期間每 REPORT_JOB_HEARTBEAT 秒更新心跳，供其他 worker 判斷是否中斷
+    """
+    now = datetime.utcnow()
+    claimed = db.session.execute(
+        update(ReportJob)
+        .where(ReportJob.id == job_id, ReportJob.status == JOB_QUEUED)
+        .values(status=JOB_RUNNING, started_at=now, heartbeat_at=now)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    db.session.commit()
+    if not claimed:
+        return None
+    stop = threading.Event()
+    threading.Thread(
+        target=_heartbeat,
+        args=(current_app._get_current_object(), job_id, stop, current_app.config.get('REPORT_JOB_HEARTBEAT', 30)),
+        name=f'report-job-heartbeat-{job_id}',
+        daemon=True,
+    ).start()
+    try:
+        job = db.session.get(ReportJob, job_id)
+        path = os.path.join(artifact_dir(), f"{job.id}.{job.format}")
+        tmp = path + '.part'
+        try:
+            REPORT_KINDS[job.kind][2](tmp, job.format, json.loads(job.params))
+            os.replace(tmp, path)
+        except Exception as e:
+            current_app.logger.exception(f"報表工作 {job_id} 失敗")
+            db.session.rollback()
+            job = db.session.get(ReportJob, job_id)
+            _finish(job, JOB_FAILED, error=str(e))
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        else:
+            job.artifact_path = path
+            job.artifact_size = os.path.getsize(path)
+            _finish(job, JOB_SUCCEEDED)
+        db.session.commit()
+    finally:
+        stop.set()
+    return job
+
+
+def fail_stale_report_jobs(now=None):
+    """執行中但超過 REPORT_JOB_TIMEOUT 沒有心跳的工作（worker 已中斷）改為失敗，回傳筆數"""
+    now = now or datetime.utcnow()
+    cutoff = now - _seconds('REPORT_JOB_TIMEOUT', 120)
+    jobs = ReportJob.query.filter(
+        ReportJob.status == JOB_RUNNING,
+        func.coalesce(ReportJob.heartbeat_at, ReportJob.started_at) < cutoff,
+    ).all()
+    for job in jobs:
+        _finish(job, JOB_FAILED, error=JOB_INTERRUPTED)
+    db.session.commit()
+    return len(jobs)
+
+
+def run_pending_report_jobs(limit=None, min_age=0):
+    """
+    依建立順序執行排隊中的工作，回傳實際執行的筆數
+    min_age 秒內建立的工作先留給提交的 worker 自行執行；已被其他 worker 領取的工作會略過
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=min_age)
+    query = (
+        db.session.query(ReportJob.id)
+        .filter(ReportJob.status == JOB_QUEUED, ReportJob.created_at <= cutoff)
+        .order_by(ReportJob.created_at)
+    )
+    if limit:
+        query = query.limit(limit)
+    ids = [row.id for row in query]
+    db.session.commit()
+    return sum(1 for job_id in ids if run_report_job(job_id) is not None)
+
+
+def purge_report_jobs(older_than_days=7):
+    """刪除已結束且超過保存天數的工作與結果檔，回傳刪除筆數"""
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    jobs = ReportJob.query.filter(ReportJob.status.in_((JOB_SUCCEEDED, JOB_FAILED)), ReportJob.finished_at < cutoff).all()
+    for job in jobs:
+        if job.artifact_path and os.path.exists(job.artifact_path):
+            os.remove(job.artifact_path)
+        db.session.delete(job)
+    db.session.commit()
+    return len(jobs)
@@ -1,37 +1,47 @@
-from app.models.order import Order
+from app.models.order import Order, OrderItem
+from app.models.payment import Payment
 from app.models.product import Product
 from app.models.customer import Customer
 from app import db
-from sqlalchemy import func
+from app.services.sales_rollup_service import sales_from_rollup, product_ranking_from_rollup
+from app.services.sales_aggregation_service import sales_buckets, resolve_timezone, SalesAggregationError, PERIODS
+from app.utils.xlsx import SheetSpec, write_xlsx
+from app.utils.cache import get_cache
+from flask import current_app
+from sqlalchemy import func, select
 from datetime import datetime
 import csv, io
 
-def sales_summary(period='day', start=None, end=None):
-    # period: day/month/year
-    q = db.session.query(
-        func.date_format(Order.created_at, '%Y-%m-%d' if period=='day' else ('%Y-%m' if period=='month' else '%Y')),
-        func.sum(Order.total_amount)
+REPORT_CACHE = 'reports'
+
+def report_cache():
+    """報表結果快取（/api/reports/sales、/product-ranking、/customer-summary）"""
+    return get_cache(
+        REPORT_CACHE,
+        ttl=current_app.config.get('REPORT_CACHE_TTL', 60),
+        max_entries=current_app.config.get('REPORT_CACHE_MAX_ENTRIES', 256),
     )
-    if start:
-        q = q.filter(Order.created_at >= start)
-    if end:
-        q = q.filter(Order.created_at <= end)
-    q = q.group_by(1).order_by(1)
-    return [{'period': r[0], 'total': float(r[1])} for r in q.all()]
 
-def product_sales_ranking(start=None, end=None, limit=10):
-    from app.models.order import OrderItem
-    q = db.session.query(
-        Product.name,
-        func.sum(OrderItem.quantity).label('qty'),
-        func.sum(OrderItem.subtotal).label('amount')
-    ).join(OrderItem, Product.id==OrderItem.product_id)
-    if start:
-        q = q.filter(OrderItem.created_at >= start)
-    if end:
-        q = q.filter(OrderItem.created_at <= end)
-    q = q.group_by(Product.id).order_by(func.sum(OrderItem.quantity).desc()).limit(limit)
-    return [{'product': r[0], 'quantity': int(r[1]), 'amount': float(r[2])} for r in q.all()]
+def cached_report(endpoint, params, compute):
+    """
+    依端點與正規化後的參數快取序列化後的 JSON（存活 REPORT_CACHE_TTL 秒，不隨訂單寫入清除）
+    同時間相同參數的請求只計算一次，其餘等待共用結果（single-flight）
+    """
+    key = (endpoint,) + tuple(sorted((k, v) for k, v in params.items() if v is not None))
+    return report_cache().get_or_compute(key, lambda: current_app.json.dumps(compute()))
+
+def sales_summary(period='day', start=None, end=None, tz=None):
+    # period: day/week/month/year
+    # UTC 的日 / 月 / 年讀取每日銷售彙總表；週或指定時區時依訂單建立時間重新分組（sales_buckets）
+    if period == 'week' or resolve_timezone(tz) is not None:
+        return sales_buckets(period, start, end, tz)
+    if period not in PERIODS:
+        raise SalesAggregationError(f"period 僅支援 {'、'.join(PERIODS)}")
+    return sales_from_rollup(period, start, end)
+
+def product_sales_ranking(start=None, end=None, limit=10, sort_by='qty'):
+    # 熱銷商品：加總每日商品銷售（建單、改單、取消時增量維護），不 JOIN 訂單明細
+    return product_ranking_from_rollup(start, end, limit, sort_by)
 
 def customer_sales_summary():
     q = db.session.query(
@@ -41,26 +51,151 @@ def customer_sales_summary():
     ).join(Order, Customer.id==Order.customer_id).group_by(Customer.id)
     return [{'customer_id': r[0], 'name': r[1], 'order_count': int(r[2]), 'total_amount': float(r[3])} for r in q.all()]
 
+EXPORT_YIELD_PER = 1000   # 每次自資料庫 cursor 取回的筆數
+EXPORT_FLUSH_ROWS = 500   # 每累積多少列輸出一個 chunk
+
+CUSTOMER_EXPORT = (
+    ['ID', '姓名', '電話', '地址', 'Email', '標籤'],
+    lambda c: [c.id, c.name, c.phone, c.address, c.email, c.tags],
+)
+ORDER_EXPORT = (
+    ['訂單編號', '客戶', '金額', '狀態', '建立時間'],
+    lambda o: [o.id, o.customer_id, o.total_amount, o.status, o.created_at],
+)
+PRODUCT_EXPORT = (
+    ['商品ID', '名稱', '分類', '價格', '促銷價', '庫存'],
+    lambda p: [p.id, p.name, p.category_id, p.price, p.promo_price, p.stock],
+)
+
+def iter_csv(header, rows, to_row, flush_rows=EXPORT_FLUSH_ROWS):
+    """逐段產生 CSV 文字：先輸出表頭，之後每 flush_rows 列輸出一次，記憶體用量固定"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    pending = 0
+    for row in rows:
+        writer.writerow(to_row(row))
+        pending += 1
+        if pending >= flush_rows:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    if pending:
+        yield buffer.getvalue()
+
+def _stream(stmt, yield_per=EXPORT_YIELD_PER):
+    """server-side cursor 分批讀取（只取匯出需要的欄位，不建立 ORM 物件）"""
+    return db.session.execute(stmt.execution_options(yield_per=yield_per))
+
+def parse_date_range(start=None, end=None):
+    """
+    解析 ISO 日期 / 日期時間字串，回傳 (start, end) datetime
+    只有日期的 end 包含整天；格式錯誤時拋出 ValueError
+    """
+    try:
+        start_at = datetime.fromisoformat(start) if start else None
+        end_at = datetime.fromisoformat(end) if end else None
+    except ValueError:
+        raise ValueError("start / end 必須為 ISO 日期格式（YYYY-MM-DD）")
+    if end_at is not None and len(end) <= 10:
+        end_at = end_at.replace(hour=23, minute=59, second=59, microsecond=999999)
+    return start_at, end_at
+
+def _created_between(stmt, column, start=None, end=None):
+    if start:
+        stmt = stmt.where(column >= start)
+    if end:
+        stmt = stmt.where(column <= end)
+    return stmt
+
+def customers_export_stmt(start=None, end=None):
+    stmt = select(Customer.id, Customer.name, Customer.phone, Customer.address, Customer.email, Customer.tags, Customer.created_at).order_by(Customer.id)
+    return _created_between(stmt, Customer.created_at, start, end)
+
+def _order_filters(stmt, start=None, end=None, statuses=None):
+    stmt = _created_between(stmt, Order.created_at, start, end)
+    if statuses:
+        stmt = stmt.where(Order.status.in_(statuses))
+    return stmt
+
+def orders_export_stmt(start=None, end=None, statuses=None):
+    stmt = select(
+        Order.id, Order.order_sn, Order.user_id, Order.customer_id, Order.total_amount, Order.shipping_fee,
+        Order.status, Order.payment_status, Order.receiver_name, Order.item_summary, Order.created_at,
+    ).order_by(Order.id)
+    return _order_filters(stmt, start, end, statuses)
+
+def order_items_export_stmt(start=None, end=None, statuses=None):
+    """訂單明細（篩選條件套用在所屬訂單上）"""
+    stmt = (
+        select(OrderItem.order_id, Order.order_sn, OrderItem.product_id, OrderItem.product_name, OrderItem.qty, OrderItem.price)
+        .join(Order, Order.id == OrderItem.order_id)
+        .order_by(OrderItem.order_id, OrderItem.id)
+    )
+    return _order_filters(stmt, start, end, statuses)
+
+def payments_export_stmt(start=None, end=None, statuses=None):
+    """付款紀錄（篩選條件套用在所屬訂單上）"""
+    stmt = (
+        select(Payment.id, Payment.order_id, Order.order_sn, Payment.amount, Payment.status, Payment.payment_method, Payment.transaction_id, Payment.paid_at)
+        .join(Order, Order.id == Payment.order_id)
+        .order_by(Payment.id)
+    )
+    return _order_filters(stmt, start, end, statuses)
+
+def products_export_stmt(start=None, end=None, is_active=None):
+    stmt = select(Product.id, Product.name, Product.category_id, Product.price, Product.promo_price, Product.stock, Product.is_active).order_by(Product.id)
+    stmt = _created_between(stmt, Product.created_at, start, end)
+    if is_active is not None:
+        stmt = stmt.where(Product.is_active.is_(is_active))
+    return stmt
+
+def stream_customers_csv(start=None, end=None):
+    header, to_row = CUSTOMER_EXPORT
+    return iter_csv(header, _stream(customers_export_stmt(start, end)), to_row)
+
+def stream_orders_csv(start=None, end=None, statuses=None):
+    header, to_row = ORDER_EXPORT
+    return iter_csv(header, _stream(orders_export_stmt(start, end, statuses)), to_row)
+
+def stream_products_csv(start=None, end=None, is_active=None):
+    header, to_row = PRODUCT_EXPORT
+    return iter_csv(header, _stream(products_export_stmt(start, end, is_active)), to_row)
+
+def write_orders_xlsx(target, start=None, end=None, statuses=None):
+    """訂單 XLSX：訂單、明細、付款三個工作表，各自以 server-side cursor 分批讀取"""
+    return write_xlsx(target, [
+        SheetSpec('訂單', [('訂單ID', 10), ('訂單編號', 24), ('使用者', 10), ('客戶', 10), ('金額', 12), ('運費', 10),
+                         ('狀態', 12), ('付款狀態', 12), ('收件人', 14), ('明細摘要', 40), ('建立時間', 20)],
+                  lambda: _stream(orders_export_stmt(start, end, statuses))),
+        SheetSpec('明細', [('訂單ID', 10), ('訂單編號', 24), ('商品ID', 10), ('商品名稱', 30), ('數量', 8), ('單價', 12), ('小計', 12)],
+                  lambda: _stream(order_items_export_stmt(start, end, statuses)),
+                  lambda r: (*r, r.qty * r.price)),
+        SheetSpec('付款', [('付款ID', 10), ('訂單ID', 10), ('訂單編號', 24), ('金額', 12), ('狀態', 10), ('方式', 10), ('交易編號', 24), ('付款時間', 20)],
+                  lambda: _stream(payments_export_stmt(start, end, statuses))),
+    ])
+
+def write_customers_xlsx(target, start=None, end=None):
+    return write_xlsx(target, [
+        SheetSpec('客戶', [('ID', 10), ('姓名', 14), ('電話', 16), ('地址', 40), ('Email', 28), ('標籤', 20), ('建立時間', 20)],
+                  lambda: _stream(customers_export_stmt(start, end))),
+    ])
+
+def write_products_xlsx(target, start=None, end=None, is_active=None):
+    return write_xlsx(target, [
+        SheetSpec('商品', [('商品ID', 10), ('名稱', 30), ('分類', 10), ('價格', 12), ('促銷價', 12), ('庫存', 10), ('上架', 8)],
+                  lambda: _stream(products_export_stmt(start, end, is_active))),
+    ])
+
 def export_customers_csv(customers):
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(['ID', '姓名', '電話', '地址', 'Email', '標籤'])
-    for c in customers:
-        writer.writerow([c.id, c.name, c.phone, c.address, c.email, c.tags])
-    return output.getvalue()
+    return ''.join(iter_csv(CUSTOMER_EXPORT[0], customers, CUSTOMER_EXPORT[1]))
 
 def export_orders_csv(orders):
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(['訂單編號', '客戶', '金額', '狀態', '建立時間'])
-    for o in orders:
-        writer.writerow([o.id, o.customer_id, o.total_amount, o.status, o.created_at])
-    return output.getvalue()
+    return ''.join(iter_csv(ORDER_EXPORT[0], orders, ORDER_EXPORT[1]))
 
 def export_products_csv(products):
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(['商品ID', '名稱', '分類', '價格', '促銷價', '庫存'])
-    for p in products:
-        writer.writerow([p.id, p.name, p.category_id, p.price, p.promo_price, p.stock])
-    return output.getvalue()
+    return ''.join(iter_csv(PRODUCT_EXPORT[0], products, PRODUCT_EXPORT[1]))
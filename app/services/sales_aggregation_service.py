@@ -0,0 +1,216 @@
+from app.models.order import Order
+from app import db
+from sqlalchemy import String, func, select, type_coerce
+from datetime import date, datetime, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+import numpy as np
+
+PERIODS = ('day', 'week', 'month', 'year')
+FETCH_BATCH_SIZE = 20000
+PAID = 'paid'
+
+
+class SalesAggregationError(ValueError):
+    """不支援的期間或時區"""
+
+
+def resolve_timezone(tz):
+    """時區名稱（IANA，例如 Asia/Taipei），None / UTC 回傳 None"""
+    if not tz or tz.upper() == 'UTC':
+        return None
+    try:
+        return ZoneInfo(tz)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise SalesAggregationError(f"不支援的時區 {tz}")
+
+
+def _check_period(period):
+    if period not in PERIODS:
+        raise SalesAggregationError(f"period 僅支援 {'、'.join(PERIODS)}")
+
+
+def bucket_start(day, period):
+    """日期所屬期間的第一天（週以週一為起點，與 ISO 週相同）"""
+    if period == 'week':
+        return day - timedelta(days=day.weekday())
+    if period == 'month':
+        return day.replace(day=1)
+    if period == 'year':
+        return day.replace(month=1, day=1)
+    return day
+
+
+def next_bucket(day, period):
+    if period == 'week':
+        return day + timedelta(days=7)
+    if period == 'month':
+        return date(day.year + day.month // 12, day.month % 12 + 1, 1)
+    if period == 'year':
+        return date(day.year + 1, 1, 1)
+    return day + timedelta(days=1)
+
+
+def period_label(day, period):
+    if period == 'week':
+        year, week, _ = day.isocalendar()
+        return f"{year}-W{week:02d}"
+    if period == 'month':
+        return day.strftime('%Y-%m')
+    if period == 'year':
+        return day.strftime('%Y')
+    return day.isoformat()
+
+
+def _as_date(value):
+    if value is None or isinstance(value, date):
+        return value
+    return datetime.fromisoformat(str(value)[:10]).date()
+
+
+def _to_utc(day, tz):
+    """當地日期 00:00 對應的 UTC 時間（naive，與 orders.created_at 相同）"""
+    local = datetime.combine(day, datetime.min.time())
+    if tz is None:
+        return local
+    return local.replace(tzinfo=tz).astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _to_local_date(moment, tz):
+    if tz is None:
+        return moment.date()
+    return moment.replace(tzinfo=timezone.utc).astimezone(tz).date()
+
+
+def _summarize(groups, period):
+    """[(期間起日, 狀態, 付款狀態, 筆數, 金額)] 整理成與 sales_summary 相同的格式，依期間排序"""
+    periods = {}
+    for day, status, payment_status, count, amount in sorted(groups, key=lambda g: g[0]):
+        if not count:
+            continue
+        key = period_label(day, period)
+        p = periods.setdefault(key, {"period": key, "total": 0.0, "order_count": 0, "paid_amount": 0.0, "by_status": {}})
+        p["order_count"] += int(count)
+        p["total"] += float(amount)
+        if payment_status == PAID:
+            p["paid_amount"] += float(amount)
+        s = p["by_status"].setdefault(status, {"order_count": 0, "amount": 0.0})
+        s["order_count"] += int(count)
+        s["amount"] += float(amount)
+    return list(periods.values())
+
+
+def _range_filter(stmt, start, end, tz):
+    if start:
+        stmt = stmt.where(Order.created_at >= _to_utc(_as_date(start), tz))
+    if end:
+        stmt = stmt.where(Order.created_at < _to_utc(_as_date(end) + timedelta(days=1), tz))
+    return stmt
+
+
+def _bucket_edges(first, last, period, tz):
+    """
+    涵蓋 [first, last] 的各期間起點：回傳 (期間起日 list, 起點的 UTC 時間 datetime64 陣列)
+    在當地時間切期間再換算成 UTC，夏令時間切換日的長度自然正確
+    """
+    day = bucket_start(_to_local_date(first, tz), period)
+    last_day = _to_local_date(last, tz)
+    days = []
+    while day <= last_day:
+        days.append(day)
+        day = next_bucket(day, period)
+    edges = np.array([_to_utc(d, tz) for d in days], dtype='datetime64[us]')
+    return days, edges
+
+
+def _combo_codes(status, payment_status, combos):
+    """(狀態, 付款狀態) 編碼成 combos 的欄位編號（新組合加在最後）"""
+    statuses, s_inv = np.unique(status, return_inverse=True)
+    payments, p_inv = np.unique(payment_status, return_inverse=True)
+    lookup = np.array([[combos.setdefault((str(s), str(p)), len(combos)) for p in payments] for s in statuses], dtype=np.int64)
+    return lookup[s_inv.reshape(-1), p_inv.reshape(-1)]
+
+
+def sales_buckets(period='day', start=None, end=None, tz=None, batch_size=FETCH_BATCH_SIZE):
+    """
+    以 NumPy 分組計算日 / 週 / 月 / 年銷售（可指定時區），結果格式與 sales_summary 相同
+    - 只取建立時間、金額、狀態、付款狀態四欄，每批 batch_size 筆轉成陣列
+    - 以 searchsorted 找出所屬期間、bincount 累加筆數與金額，記憶體只與期間數成正比
+    - 不依賴資料庫的日期函式，MySQL 與 SQLite 結果相同
+    start / end 為當地日期（含）
+    """
+    _check_period(period)
+    zone = resolve_timezone(tz)
+    bounds = _range_filter(select(func.min(Order.created_at), func.max(Order.created_at)), start, end, zone)
+    first, last = db.session.execute(bounds).one()
+    if first is None:
+        return []
+    days, edges = _bucket_edges(first, last, period, zone)
+
+    combos = {}                    # (status, payment_status) -> 欄位
+    counts = np.zeros((len(days), 0), dtype=np.int64)
+    amounts = np.zeros((len(days), 0), dtype=np.float64)
+    created_at = Order.created_at
+    if db.engine.dialect.name == 'sqlite':
+        # SQLite 以 ISO 字串儲存時間，直接交給 NumPy 解析，省去逐筆轉成 datetime
+        created_at = type_coerce(Order.created_at, String)
+    stmt = _range_filter(
+        select(created_at, Order.total_amount, Order.status, func.coalesce(Order.payment_status, 'unpaid'))
+        .where(Order.created_at.isnot(None)),
+        start, end, zone,
+    )
+    # Core 查詢（不經 ORM 物件載入），伺服器端游標分批讀取
+    result = db.session.connection().execute(stmt.execution_options(yield_per=batch_size))
+    for rows in result.partitions():
+        created, amount, status, payment_status = zip(*rows)
+        codes = _combo_codes(np.array(status), np.array(payment_status), combos)
+        if len(combos) > counts.shape[1]:
+            grow = ((0, 0), (0, len(combos) - counts.shape[1]))
+            counts, amounts = np.pad(counts, grow), np.pad(amounts, grow)
+        buckets = np.searchsorted(edges, np.array(created, dtype='datetime64[us]'), side='right') - 1
+        keys = buckets * counts.shape[1] + codes
+        size = counts.size
+        counts += np.bincount(keys, minlength=size).reshape(counts.shape)
+        values = np.nan_to_num(np.array(amount, dtype=np.float64))
+        amounts += np.bincount(keys, weights=values, minlength=size).reshape(amounts.shape)
+
+    groups = []
+    for (status, payment_status), col in combos.items():
+        for i in np.flatnonzero(counts[:, col]):
+            groups.append((days[i], status, payment_status, counts[i, col], amounts[i, col]))
+    return _summarize(groups, period)
+
+
+def _sql_bucket(period, dialect):
+    """各資料庫以 SQL 計算期間起日（僅 UTC）"""
+    col = Order.created_at
+    if dialect == 'mysql':
+        return {
+            'day': func.date(col),
+            'week': func.subdate(func.date(col), func.weekday(col)),
+            'month': func.date_format(col, '%Y-%m-01'),
+            'year': func.date_format(col, '%Y-01-01'),
+        }[period]
+    if dialect == 'postgresql':
+        return func.date(func.date_trunc(period, col))
+    return {
+        'day': func.date(col),
+        'week': func.date(col, '-6 days', 'weekday 1'),
+        'month': func.date(col, 'start of month'),
+        'year': func.date(col, 'start of year'),
+    }[period]
+
+
+def sales_buckets_sql(period='day', start=None, end=None):
+    """
+    同樣的統計改以資料庫 GROUP BY 計算（UTC），作為 sales_buckets 的對照與效能比較基準
+    """
+    _check_period(period)
+    bucket = _sql_bucket(period, db.engine.dialect.name)
+    payment_status = func.coalesce(Order.payment_status, 'unpaid')
+    stmt = _range_filter(
+        select(bucket, Order.status, payment_status, func.count(), func.coalesce(func.sum(Order.total_amount), 0))
+        .where(Order.created_at.isnot(None))
+        .group_by(bucket, Order.status, payment_status),
+        start, end, None,
+    )
+    return _summarize(((_as_date(b), s, p, c, a) for b, s, p, c, a in db.session.execute(stmt)), period)
@@ -0,0 +1,239 @@
+from app.models.order import Order, OrderItem
+from app.models.product import Product
+from app.models.sales_rollup import SalesDailyRollup, ProductSalesDaily
+from app import db
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from datetime import date, datetime, timedelta
+
+PAID = 'paid'
+CANCELLED = 'cancelled'
+
+
+def sales_key(order):
+    """訂單目前在彙總表中的位置與金額：(日期, 狀態, 付款狀態, 金額)"""
+    created_at = order.created_at or datetime.utcnow()
+    return (created_at.date(), order.status, order.payment_status or 'unpaid', order.total_amount or 0)
+
+
+def record_sales_changes(changes):
+    """
+    將訂單異動套用到每日銷售彙總（在呼叫端的交易內，不 commit）
+    changes: [(before, after), ...]，皆為 sales_key() 的結果；新增訂單 before 為 None、刪除時 after 為 None
+    同一位置的增減先合併，每個位置一次 upsert（order_count / amount 以增量累加，可並行）
+    """
+    deltas = {}
+    for before, after in changes:
+        for row, sign in ((before, -1), (after, 1)):
+            if row is None:
+                continue
+            key = row[:3]
+            count, amount = deltas.get(key, (0, 0))
+            deltas[key] = (count + sign, amount + sign * row[3])
+    rows = [
+        {"day": day, "status": status, "payment_status": payment_status, "order_count": count, "amount": amount, "updated_at": datetime.utcnow()}
+        for (day, status, payment_status), (count, amount) in deltas.items()
+        if count or amount
+    ]
+    if rows:
+        db.session.execute(_upsert_increment(SalesDailyRollup, ('order_count', 'amount')), rows)
+
+
+def _upsert_increment(model, counters):
+    """依資料庫方言產生「不存在就新增、存在就累加 counters 欄位」的 INSERT"""
+    table = model.__table__
+    dialect = db.engine.dialect.name
+    if dialect == 'mysql':
+        stmt = mysql.insert(table)
+        values = {c: table.c[c] + stmt.inserted[c] for c in counters}
+        return stmt.on_duplicate_key_update(updated_at=stmt.inserted.updated_at, **values)
+    stmt = (postgresql if dialect == 'postgresql' else sqlite).insert(table)
+    values = {c: table.c[c] + stmt.excluded[c] for c in counters}
+    return stmt.on_conflict_do_update(
+        index_elements=[c.name for c in table.primary_key],
+        set_=dict(values, updated_at=stmt.excluded.updated_at),
+    )
+
+
+def product_sales_lines(day, lines, sign=1):
+    """
+    一筆訂單的明細 [(product_id, qty, price)] 轉成商品銷售增減 [(日期, 商品, 數量, 金額, 訂單數)]
+    同商品多列先合併，每個商品只計一筆訂單；sign=-1 表示扣除（取消、刪除或改單前的明細）
+    """
+    merged = {}
+    for pid, qty, price in lines:
+        q, a = merged.get(int(pid), (0, 0))
+        merged[int(pid)] = (q + qty, a + qty * (price or 0))
+    return [(day, pid, sign * q, sign * a, sign) for pid, (q, a) in merged.items()]
+
+
+def record_product_sales(changes):
+    """
+    將商品銷售增減套用到每日商品銷售（在呼叫端的交易內，不 commit）
+    changes 為 product_sales_lines() 的結果；同一天同商品先合併，抵銷為零者不寫入
+    """
+    deltas = {}
+    for day, pid, qty, amount, orders in changes:
+        q, a, o = deltas.get((day, pid), (0, 0, 0))
+        deltas[(day, pid)] = (q + qty, a + amount, o + orders)
+    now = datetime.utcnow()
+    rows = [
+        {"day": day, "product_id": pid, "qty": q, "amount": a, "order_count": o, "updated_at": now}
+        for (day, pid), (q, a, o) in deltas.items()
+        if q or a or o
+    ]
+    if rows:
+        db.session.execute(_upsert_increment(ProductSalesDaily, ('qty', 'amount', 'order_count')), rows)
+
+
+def remove_orders_product_sales(order_days):
+    """
+    訂單取消或刪除時扣除其商品銷售：order_days 為 {order_id: 訂單建立日期}（僅傳入尚未取消的訂單）
+    一次查詢所有明細
+    """
+    if not order_days:
+        return
+    lines = {}
+    rows = db.session.execute(
+        select(OrderItem.order_id, OrderItem.product_id, OrderItem.qty, OrderItem.price)
+        .where(OrderItem.order_id.in_(list(order_days)))
+    )
+    for oid, pid, qty, price in rows:
+        lines.setdefault(oid, []).append((pid, qty, price))
+    record_product_sales([c for oid, items in lines.items() for c in product_sales_lines(order_days[oid], items, sign=-1)])
+
+
+def rebuild_sales_rollup(start=None, end=None, days_per_batch=31):
+    """
+    由 orders 重新計算每日彙總與每日商品銷售（回填 / 修復用），每批日期範圍一次 DELETE + INSERT ... SELECT 並 commit
+    start / end 為 date（含），未指定時涵蓋所有訂單；回傳重建的彙總列數
+    """
+    if start is None or end is None:
+        first, last = db.session.execute(select(func.min(Order.created_at), func.max(Order.created_at))).one()
+        if first is None:
+            return 0
+        start = start or first.date()
+        end = end or last.date()
+    rebuilt = 0
+    day = start
+    while day <= end:
+        batch_end = min(day + timedelta(days=days_per_batch - 1), end)
+        lo = datetime.combine(day, datetime.min.time())
+        hi = datetime.combine(batch_end + timedelta(days=1), datetime.min.time())
+        db.session.execute(delete(SalesDailyRollup).where(SalesDailyRollup.day.between(day, batch_end)))
+        grouped = (
+            select(
+                func.date(Order.created_at),
+                Order.status,
+                func.coalesce(Order.payment_status, 'unpaid'),
+                func.count(),
+                func.coalesce(func.sum(Order.total_amount), 0),
+                func.now(),
+            )
+            .where(Order.created_at >= lo, Order.created_at < hi)
+            .group_by(func.date(Order.created_at), Order.status, func.coalesce(Order.payment_status, 'unpaid'))
+        )
+        result = db.session.execute(
+            insert(SalesDailyRollup).from_select(
+                ['day', 'status', 'payment_status', 'order_count', 'amount', 'updated_at'], grouped
+            )
+        )
+        _rebuild_product_sales(day, batch_end, lo, hi)
+        db.session.commit()
+        rebuilt += max(result.rowcount, 0)
+        day = batch_end + timedelta(days=1)
+    return rebuilt
+
+
+def _rebuild_product_sales(day, batch_end, lo, hi):
+    """重新計算日期範圍內的每日商品銷售（未取消的訂單）"""
+    db.session.execute(delete(ProductSalesDaily).where(ProductSalesDaily.day.between(day, batch_end)))
+    grouped = (
+        select(
+            func.date(Order.created_at),
+            OrderItem.product_id,
+            func.sum(OrderItem.qty),
+            func.coalesce(func.sum(OrderItem.qty * OrderItem.price), 0),
+            func.count(func.distinct(Order.id)),
+            func.now(),
+        )
+        .join(OrderItem, OrderItem.order_id == Order.id)
+        .where(Order.created_at >= lo, Order.created_at < hi, Order.status != CANCELLED)
+        .group_by(func.date(Order.created_at), OrderItem.product_id)
+    )
+    db.session.execute(
+        insert(ProductSalesDaily).from_select(['day', 'product_id', 'qty', 'amount', 'order_count', 'updated_at'], grouped)
+    )
+
+
+def _period_key(day, period):
+    if period == 'month':
+        return day.strftime('%Y-%m')
+    if period == 'year':
+        return day.strftime('%Y')
+    return day.isoformat()
+
+
+def _as_date(value):
+    if value is None or isinstance(value, date):
+        return value
+    return datetime.fromisoformat(str(value)[:10]).date()
+
+
+def sales_from_rollup(period='day', start=None, end=None):
+    """
+    由每日彙總計算日 / 月 / 年銷售：訂單數、總金額、已付款金額與各狀態明細
+    只讀取範圍內的彙總列（每天最多數個狀態組合）
+    """
+    q = select(SalesDailyRollup).order_by(SalesDailyRollup.day)
+    if start:
+        q = q.where(SalesDailyRollup.day >= _as_date(start))
+    if end:
+        q = q.where(SalesDailyRollup.day <= _as_date(end))
+    periods = {}
+    for row in db.session.execute(q).scalars():
+        if not row.order_count and not row.amount:
+            continue
+        key = _period_key(row.day, period)
+        p = periods.setdefault(key, {"period": key, "total": 0.0, "order_count": 0, "paid_amount": 0.0, "by_status": {}})
+        p["order_count"] += row.order_count
+        p["total"] += row.amount
+        if row.payment_status == PAID:
+            p["paid_amount"] += row.amount
+        s = p["by_status"].setdefault(row.status, {"order_count": 0, "amount": 0.0})
+        s["order_count"] += row.order_count
+        s["amount"] += row.amount
+    return list(periods.values())
+
+
+def product_ranking_from_rollup(start=None, end=None, limit=10, sort_by='qty'):
+    """
+    期間內的熱銷商品前 limit 名（依數量或金額），加總每日商品銷售，不掃描訂單明細
+    start / end 為日期（含）；回傳 [{'product_id', 'product', 'quantity', 'amount', 'order_count'}]
+    """
+    qty = func.sum(ProductSalesDaily.qty)
+    amount = func.sum(ProductSalesDaily.amount)
+    ranked = (
+        select(ProductSalesDaily.product_id, qty.label('qty'), amount.label('amount'),
+               func.sum(ProductSalesDaily.order_count).label('order_count'))
+        .group_by(ProductSalesDaily.product_id)
+        .having(qty > 0)
+        .order_by((amount if sort_by == 'amount' else qty).desc(), ProductSalesDaily.product_id)
+        .limit(limit)
+    )
+    if start:
+        ranked = ranked.where(ProductSalesDaily.day >= _as_date(start))
+    if end:
+        ranked = ranked.where(ProductSalesDaily.day <= _as_date(end))
+    rows = db.session.execute(ranked).all()
+    names = dict(db.session.execute(select(Product.id, Product.name).where(Product.id.in_([r.product_id for r in rows]))).all())
+    return [
+        {
+            "product_id": r.product_id,
+            "product": names.get(r.product_id),
+            "quantity": int(r.qty),
+            "amount": float(r.amount),
+            "order_count": int(r.order_count),
+        }
+        for r in rows
+    ]
@@ -0,0 +1,316 @@
+from app.models.product import Product
+from app import db
+from app.utils.cache import read_version, bump_version
+from flask import current_app
+from sqlalchemy import and_, select
+from bisect import bisect_left, insort
+import re
+import threading
+import time
+import unicodedata
+
+SEARCH_INDEX = 'product_search'
+SEARCH_BUILD = 'product_search_build'
+AUTOCOMPLETE_LIMIT = 10
+
+_SEGMENT = re.compile(r'\w+')
+
+
+def normalize(text):
+    """全形轉半形（NFKC）、不分大小寫、合併空白"""
+    return ' '.join(unicodedata.normalize('NFKC', text or '').casefold().split())
+
+
+def segments(text):
+    """切成連續的文字片段（中文、英數字；標點與空白為分隔）"""
+    return _SEGMENT.findall(normalize(text))
+
+
+def ngrams(segment):
+    """單字 + 相鄰雙字（bigram）：中文不需斷詞即可做任意子字串比對"""
+    grams = set(segment)
+    grams.update(segment[i:i + 2] for i in range(len(segment) - 1))
+    return grams
+
+
+def _query_gram(segment):
+    """查詢片段只需取一個 gram 當候選，其餘以子字串比對驗證"""
+    return segment if len(segment) == 1 else segment[:2]
+
+
+class ProductSearchIndex:
+    """
+    商品名稱的 process 內搜尋索引
+    - n-gram 倒排索引（單字 + bigram）：任意子字串查詢，取最短的 posting 當候選再驗證；
+      posting 依 id 由新到舊排列，只要前幾筆時可提早結束
+    - 依名稱排序的陣列（每個詞的起點各一筆）：以二分搜尋做前綴查詢（autocomplete）
+    - 以商品 id 增量新增 / 更新 / 移除
+    """
+
+    def __init__(self):
+        self._docs = {}      # id -> (正規化名稱, 原始名稱, is_active, category_id)
+        self._postings = {}  # gram -> [id, ...]（id 由大到小）
+        self._prefixes = []  # [(自某個詞起的正規化名稱, id), ...]
+        self._lock = threading.RLock()
+        self.built_at = time.monotonic()
+        self.version = 0          # 建立時的版本戳記
+        self.checked_at = self.built_at
+
+    def __len__(self):
+        return len(self._docs)
+
+    @staticmethod
+    def _grams(norm):
+        return {g for seg in _SEGMENT.findall(norm) for g in ngrams(seg)}
+
+    @staticmethod
+    def _prefix_entries(norm, pid):
+        return [(norm[m.start():], pid) for m in _SEGMENT.finditer(norm)]
+
+    @classmethod
+    def build(cls, rows):
+        """由 (id, name, is_active, category_id) 批次建立（依 id 排序後一次建好，不逐筆插入）"""
+        index = cls()
+        for pid, name, is_active, category_id in sorted(rows, key=lambda r: r[0], reverse=True):
+            norm = normalize(name)
+            index._docs[pid] = (norm, name, bool(is_active), category_id)
+            for gram in cls._grams(norm):
+                index._postings.setdefault(gram, []).append(pid)
+            index._prefixes += cls._prefix_entries(norm, pid)
+        index._prefixes.sort()
+        return index
+
+    def upsert(self, pid, name, is_active=True, category_id=None):
+        norm = normalize(name)
+        with self._lock:
+            old = self._docs.get(pid)
+            if old is not None and old[0] == norm:
+                self._docs[pid] = (norm, name, bool(is_active), category_id)
+                return
+            self._remove(pid)
+            self._docs[pid] = (norm, name, bool(is_active), category_id)
+            for gram in self._grams(norm):
+                posting = self._postings.setdefault(gram, [])
+                posting.insert(bisect_left(posting, -pid, key=neg), pid)
+            for entry in self._prefix_entries(norm, pid):
+                insort(self._prefixes, entry)
+
+    def remove(self, pid):
+        with self._lock:
+            self._remove(pid)
+
+    def _remove(self, pid):
+        old = self._docs.pop(pid, None)
+        if old is None:
+            return
+        for gram in self._grams(old[0]):
+            posting = self._postings.get(gram, ())
+            i = bisect_left(posting, -pid, key=neg)
+            if i < len(posting) and posting[i] == pid:
+                del posting[i]
+                if not posting:
+                    del self._postings[gram]
+        for entry in self._prefix_entries(old[0], pid):
+            i = bisect_left(self._prefixes, entry)
+            if i < len(self._prefixes) and self._prefixes[i] == entry:
+                del self._prefixes[i]
+
+    def _candidates(self, segs):
+        """依 id 由新到舊產生所有片段皆為名稱子字串的商品 id"""
+        postings = [self._postings.get(_query_gram(seg), ()) for seg in segs]
+        shortest = min(postings, key=len)
+        docs = self._docs
+        if len(segs) == 1 and len(segs[0]) <= 2:
+            return iter(shortest)  # gram 即查詢本身，不需驗證
+        return (pid for pid in shortest if all(seg in docs[pid][0] for seg in segs))
+
+    def _rank_key(self, query, first):
+        """完全相符 > 前綴相符 > 關鍵字位置越前 > 名稱越短 > 較新的商品"""
+        docs = self._docs
+
+        def key(pid):
+            norm = docs[pid][0]
+            return (norm != query, not norm.startswith(query), norm.find(first), len(norm), -pid)
+        return key
+
+    def _filtered(self, ids, is_active, category_ids):
+        docs = self._docs
+        if is_active is not None:
+            ids = (pid for pid in ids if docs[pid][2] == is_active)
+        if category_ids is not None:
+            ids = (pid for pid in ids if docs[pid][3] in category_ids)
+        return ids
+
+    def search(self, text, is_active=None, category_ids=None):
+        """
+        依相關度排序回傳所有符合的商品 id：查詢中的每個片段（以空白、標點分隔）都是名稱的子字串，
+        片段順序不限（「鍵盤 無線」也會找到「無線鍵盤」），與 name_condition() 的 LIKE 條件相同
+        category_ids 為允許的分類 id 集合
+        """
+        query = normalize(text)
+        segs = segments(text)
+        if not segs:
+            return []
+        with self._lock:
+            ids = list(self._filtered(self._candidates(segs), is_active, category_ids))
+            ids.sort(key=self._rank_key(query, segs[0]))
+            return ids
+
+    def autocomplete(self, text, limit=AUTOCOMPLETE_LIMIT):
+        """
+        輸入提示（僅上架商品），回傳 [{'id', 'name'}]
+        先以排序陣列取某個詞以查詢字串開頭者，不足再以子字串比對（由新到舊）補足，
+        兩者都在湊滿 limit 筆時提早結束
+        """
+        query = normalize(text)
+        segs = segments(text)
+        if not segs:
+            return []
+        with self._lock:
+            docs = self._docs
+            found = {}
+            prefixes = self._prefixes
+            i = bisect_left(prefixes, (query,))
+            while len(found) < limit and i < len(prefixes) and prefixes[i][0].startswith(query):
+                pid = prefixes[i][1]
+                if docs[pid][2]:
+                    found.setdefault(pid, None)
+                i += 1
+            if len(found) < limit:
+                for pid in self._filtered(self._candidates(segs), True, None):
+                    found.setdefault(pid, None)
+                    if len(found) >= limit:
+                        break
+            return [{"id": pid, "name": docs[pid][1]} for pid in found]
+
+
+def neg(pid):
+    return -pid
+
+
+def _index_rows(product_ids=None):
+    q = select(Product.id, Product.name, Product.is_active, Product.category_id).order_by(Product.id)
+    if product_ids is not None:
+        q = q.where(Product.id.in_(product_ids))
+    return db.session.execute(q).all()
+
+
+def name_condition(text):
+    """
+    索引尚未建好時的 SQL 條件：每個片段各一個 LIKE（片段順序不限），與 ProductSearchIndex.search 相同的比對方式
+    （不做全形 / 大小寫正規化，依資料庫 collation）
+    """
+    return and_(*(Product.name.like(f"%{seg}%") for seg in segments(text)))
+
+
+def fallback_autocomplete(text, limit=AUTOCOMPLETE_LIMIT):
+    """索引尚未建好時的輸入提示：LIKE 查詢上架商品，由新到舊"""
+    if not segments(text):
+        return []
+    rows = db.session.execute(
+        select(Product.id, Product.name)
+        .where(Product.is_active.is_(True), name_condition(text))
+        .order_by(Product.id.desc())
+        .limit(limit)
+    ).all()
+    return [{"id": pid, "name": name} for pid, name in rows]
+
+
+def _build_state(app):
+    """重建狀態：building 表示背景執行緒正在建立；dirty 為建立期間異動的商品 id（完成後補上）"""
+    return app.extensions.setdefault(SEARCH_BUILD, {"lock": threading.Lock(), "building": False, "dirty": set()})
+
+
+def product_search_index():
+    """
+    本 worker 的商品搜尋索引；尚未建好時回傳 None（呼叫端改用 name_condition / fallback_autocomplete）
+    第一次使用、超過 PRODUCT_SEARCH_REBUILD_SECONDS，或版本戳記與建立時不同（其他 worker 異動了商品，
+    每 CACHE_VERSION_CHECK_SECONDS 秒最多比對一次）時在背景執行緒重建，不佔用請求時間；
+    建好後整個替換，重建期間繼續使用舊索引
+    PRODUCT_SEARCH_EAGER_BUILD（測試環境）時在目前的請求內同步建立
+    """
+    app = current_app._get_current_object()
+    index = app.extensions.get(SEARCH_INDEX)
+    max_age = app.config.get('PRODUCT_SEARCH_REBUILD_SECONDS', 600)
+    if index is None or time.monotonic() - index.built_at > max_age or _version_changed(app, index):
+        if app.config.get('PRODUCT_SEARCH_EAGER_BUILD'):
+            return build_product_search_index(app)
+        state = _build_state(app)
+        with state["lock"]:
+            if state["building"]:
+                return index
+            state["building"] = True
+            state["dirty"] = set()
+        threading.Thread(target=_build_in_app, args=(app,), name='product-search-build', daemon=True).start()
+    return index
+
+
+def _version_changed(app, index):
+    now = time.monotonic()
+    if now - index.checked_at < app.config.get('CACHE_VERSION_CHECK_SECONDS', 5):
+        return False
+    index.checked_at = now
+    return read_version(SEARCH_INDEX) != index.version
+
+
+def _build_in_app(app):
+    with app.app_context():
+        try:
+            build_product_search_index(app)
+        except Exception:
+            app.logger.exception("商品搜尋索引重建失敗")
+        finally:
+            with _build_state(app)["lock"]:
+                _build_state(app)["building"] = False
+            db.session.remove()
+
+
+def build_product_search_index(app):
+    """
+    由資料庫建立完整索引並替換目前的索引；建立期間異動的商品在替換後再增量更新
+    先讀版本戳記再讀商品，建立期間其他 worker 的異動會在下次比對時再重建
+    """
+    state = _build_state(app)
+    version = read_version(SEARCH_INDEX)
+    index = ProductSearchIndex.build(_index_rows())
+    index.version = version
+    with state["lock"]:
+        app.extensions[SEARCH_INDEX] = index
+        dirty, state["dirty"] = state["dirty"], set()
+    if dirty:
+        _reindex(app, dirty)
+    return index
+
+
+def reindex_products(product_ids):
+    """
+    商品異動（commit 之後）呼叫：遞增版本戳記讓其他 worker 重建索引，並增量更新本 worker 的索引
+    期間沒有其他 worker 遞增版本時，本 worker 的索引直接跟上新版本，不必重建
+    """
+    app = current_app._get_current_object()
+    before = read_version(SEARCH_INDEX)
+    bump_version(SEARCH_INDEX)
+    after = read_version(SEARCH_INDEX)
+    _reindex(app, {int(pid) for pid in product_ids})
+    index = app.extensions.get(SEARCH_INDEX)
+    if index is not None and index.version == before and after == before + 1:
+        index.version = after
+
+
+def _reindex(app, product_ids):
+    """
+    重新讀取這些商品更新索引，已刪除的自索引移除
+    背景重建進行中時一併記錄，待新索引替換後補上（索引尚未建立時只記錄）
+    """
+    state = _build_state(app)
+    with state["lock"]:
+        if state["building"]:
+            state["dirty"] |= product_ids
+    index = app.extensions.get(SEARCH_INDEX)
+    if index is None or not product_ids:
+        return
+    rows = _index_rows(product_ids)
+    for row in rows:
+        index.upsert(*row)
+    for pid in product_ids - {row.id for row in rows}:
+        index.remove(pid)
@@ -0,0 +1,154 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from datetime import datetime
+from flask import current_app
+from app import db
+from app.models.cache_version import CacheVersion
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+
+MISSING = object()
+
+
+class TTLCache:
+    """
+    執行緒安全的 process 內快取：每筆資料有 TTL，超過 max_entries 時淘汰最久未使用的資料（LRU）
+    並記錄命中 / 未命中次數；get_or_compute 另外合併同時對同一個 key 的計算（single-flight）
+    """
+
+    def __init__(self, ttl=60, max_entries=1024, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._clock = clock
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._inflight = {}  # key -> Future（計算中）
+        self._generation = 0  # 每次 clear() 遞增；計算期間被清除的結果不寫入快取
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.invalidations = 0
+
+    def _lookup(self, key):
+        """需持有 _lock；過期的資料順便刪除"""
+        entry = self._data.get(key)
+        if entry is not None and entry[0] > self._clock():
+            self._data.move_to_end(key)
+            return entry[1]
+        if entry is not None:
+            del self._data[key]
+        return MISSING
+
+    def get(self, key, default=MISSING):
+        with self._lock:
+            value = self._lookup(key)
+            if value is MISSING:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return value
+
+    def get_or_compute(self, key, compute, ttl=None):
+        """
+        讀穿快取：未命中時只有第一個請求呼叫 compute()，同時間相同 key 的其他請求等待並共用同一個結果
+        （compute 拋出例外時，等待中的請求收到同一個例外，且不寫入快取）
+        """
+        with self._lock:
+            value = self._lookup(key)
+            if value is not MISSING:
+                self.hits += 1
+                return value
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                self.misses += 1
+                flight = self._inflight[key] = Future()
+                generation = self._generation
+            else:
+                self.coalesced += 1
+        if not leader:
+            return flight.result()
+        try:
+            value = compute()
+        except BaseException as e:
+            flight.set_exception(e)
+            raise
+        else:
+            if generation == self._generation:
+                self.set(key, value, ttl)
+            flight.set_result(value)
+            return value
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (self._clock() + (self.ttl if ttl is None else ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, *keys):
+        """刪除指定的 key（計算中的結果同樣不寫入快取）"""
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+            self._generation += 1
+            self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._generation += 1
+            self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses + self.coalesced
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                # 不需自行計算的比例（命中快取或共用其他請求的計算結果）
+                "hit_rate": round((self.hits + self.coalesced) / total, 4) if total else 0.0,
+                "size": len(self._data),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "invalidations": self.invalidations,
+            }
+
+
+def get_cache(name, ttl=60, max_entries=1024):
+    """取得目前 app 的具名快取（每個 app / worker 各自一份）"""
+    caches = current_app.extensions.setdefault('caches', {})
+    cache = caches.get(name)
+    if cache is None:
+        cache = caches.setdefault(name, TTLCache(ttl=ttl, max_entries=max_entries))
+    return cache
+
+
+def read_version(name):
+    """讀取快取版本戳記（主鍵查詢），尚未有紀錄時為 0"""
+    return db.session.execute(select(CacheVersion.version).where(CacheVersion.name == name)).scalar() or 0
+
+
+def bump_version(name):
+    """
+    遞增快取版本戳記並 commit，其他 worker 下次檢查時即會重建快取
+    以 version = version + 1 原子更新；沒有紀錄時新增（同時新增的衝突改為再更新一次）
+    """
+    stmt = (
+        update(CacheVersion)
+        .where(CacheVersion.name == name)
+        .values(version=CacheVersion.version + 1, updated_at=datetime.utcnow())
+    )
+    if db.session.execute(stmt).rowcount == 0:
+        try:
+            with db.session.begin_nested():
+                db.session.add(CacheVersion(name=name, version=1))
+        except IntegrityError:
+            db.session.execute(stmt)
+    db.session.commit()
@@ -0,0 +1,154 @@
+from app import db
+from app.models.idempotency import IdempotencyKey
+from flask import request, jsonify, current_app, make_response
+from flask_jwt_extended import get_jwt_identity
+from sqlalchemy import event, update
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime, timedelta
+from functools import wraps
+import hashlib
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 128
+PENDING_RECORD = 'idempotency_record'
+
+
+class IdempotencyConflict(RuntimeError):
+    """處理中的 key 已被逾時的重試接手，原請求的交易不可再 commit"""
+
+
+@event.listens_for(db.session, 'before_commit')
+def _mark_committed(session):
+    """
+    view 的交易 commit 前，在同一個交易內把 key 標記為已 commit（committed_at）：
+    之後即使回應來不及保存（process 中斷），重試也不會再執行一次 view
+    key 已被接手（紀錄已刪除）時中止 commit，不會產生重複的資料
+    """
+    record_id = session.info.pop(PENDING_RECORD, None)
+    if record_id is None:
+        return
+    claimed = session.execute(
+        update(IdempotencyKey)
+        .where(IdempotencyKey.id == record_id, IdempotencyKey.committed_at.is_(None))
+        .values(committed_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not claimed:
+        raise IdempotencyConflict()
+
+
+def _request_hash():
+    h = hashlib.sha256()
+    h.update(request.method.encode())
+    h.update(request.full_path.encode())
+    h.update(request.get_data())
+    return h.hexdigest()
+
+
+def _error(code, name, message):
+    return jsonify({"code": code, "name": name, "message": message}), code
+
+
+def _replay(record):
+    resp = current_app.response_class(record.response_body, status=record.status_code, mimetype='application/json')
+    resp.headers['Idempotent-Replayed'] = 'true'
+    return resp
+
+
+def _release(record_id):
+    """釋放 key 讓用戶端重試；view 的交易已 commit 時保留（重試回 409，不重複執行）"""
+    db.session.rollback()
+    IdempotencyKey.query.filter_by(id=record_id).filter(IdempotencyKey.committed_at.is_(None)).delete()
+    db.session.commit()
+
+
+def idempotent(view):
+    """
+    Idempotency-Key 裝飾器（需放在 @jwt_required() 之下）
+    - 第一次請求先登記 key（處理中），成功（2xx）後保存回應
+    - view 的交易 commit 時同一個交易內標記 committed_at（見 _mark_committed）
+    - 相同 key 的重試直接重播保存的回應，不再執行整個交易
+    - 處理中的重複請求回 409；同一 key 用於不同請求內容回 422
+    - 失敗且尚未 commit 的請求會釋放 key，讓用戶端可以重試
+    - 處理中超過 IDEMPOTENCY_LOCK_TIMEOUT 且尚未 commit 的 key 才視為中斷、允許重新執行；
+      已 commit 但回應未保存的 key 一律回 409，直到過期
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return view(*args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return _error(400, "Bad Request", f"{IDEMPOTENCY_HEADER} 長度不可超過 {MAX_KEY_LENGTH}")
+        user_id = int(get_jwt_identity())
+        endpoint = request.endpoint
+        req_hash = _request_hash()
+        now = datetime.utcnow()
+        scope = dict(user_id=user_id, endpoint=endpoint, key=key)
+
+        record = IdempotencyKey.query.filter_by(**scope).first()
+        if record is not None:
+            lock_timeout = timedelta(seconds=current_app.config.get('IDEMPOTENCY_LOCK_TIMEOUT', 60))
+            expired = record.expires_at <= now
+            abandoned = record.status_code is None and record.committed_at is None and record.created_at < now - lock_timeout
+            if not expired and not abandoned:
+                if record.request_hash != req_hash:
+                    return _error(422, "Unprocessable Entity", f"{IDEMPOTENCY_HEADER} 已用於不同的請求")
+                if record.status_code is None and record.committed_at is not None:
+                    return _error(409, "Conflict", "相同的請求已處理完成，但回應未保存，請勿以相同的 key 重試")
+                if record.status_code is None:
+                    return _error(409, "Conflict", "相同的請求正在處理中")
+                return _replay(record)
+            # 已過期或處理中斷：以條件式 DELETE 接手，期間原請求已 commit 時不刪除
+            stale = IdempotencyKey.query.filter_by(id=record.id)
+            if not expired:
+                stale = stale.filter(IdempotencyKey.committed_at.is_(None))
+            if not stale.delete(synchronize_session=False):
+                db.session.rollback()
+                return _error(409, "Conflict", "相同的請求正在處理中")
+            db.session.commit()
+
+        ttl = timedelta(hours=current_app.config.get('IDEMPOTENCY_KEY_TTL_HOURS', 24))
+        record = IdempotencyKey(request_hash=req_hash, created_at=now, expires_at=now + ttl, **scope)
+        db.session.add(record)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # 同一個 key 的另一個請求搶先登記
+            db.session.rollback()
+            return _error(409, "Conflict", "相同的請求正在處理中")
+        record_id = record.id
+
+        db.session.info[PENDING_RECORD] = record_id
+        try:
+            resp = make_response(view(*args, **kwargs))
+        except IdempotencyConflict:
+            db.session.rollback()
+            return _error(409, "Conflict", "相同的請求已由重試接手處理")
+        except Exception:
+            db.session.info.pop(PENDING_RECORD, None)
+            _release(record_id)
+            raise
+        db.session.info.pop(PENDING_RECORD, None)
+        if not 200 <= resp.status_code < 300:
+            _release(record_id)
+            return resp
+        IdempotencyKey.query.filter_by(id=record_id).update({
+            "status_code": resp.status_code,
+            "response_body": resp.get_data(as_text=True),
+        })
+        db.session.commit()
+        return resp
+    return wrapper
+
+
+def purge_expired_idempotency_keys(batch_size=1000, now=None):
+    """分批刪除已過期的 Idempotency-Key，回傳刪除筆數"""
+    now = now or datetime.utcnow()
+    deleted = 0
+    while True:
+        ids = [r.id for r in db.session.query(IdempotencyKey.id).filter(IdempotencyKey.expires_at <= now).limit(batch_size)]
+        if not ids:
+            return deleted
+        deleted += IdempotencyKey.query.filter(IdempotencyKey.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
@@ -0,0 +1,66 @@
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import and_, or_
+
+
+class InvalidCursor(ValueError):
+    """cursor 格式錯誤或與目前排序條件不符"""
+
+
+def encode_cursor(sort_by, sort_order, value, last_id):
+    """把最後一筆的 (排序欄位值, id) 編成不透明的 cursor 字串"""
+    if isinstance(value, datetime):
+        value = {"dt": value.isoformat()}
+    raw = json.dumps([sort_by, sort_order, value, last_id], separators=(',', ':'), ensure_ascii=False)
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, sort_by, sort_order):
+    """解析 cursor，回傳 (排序欄位值, id)"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        c_sort_by, c_sort_order, value, last_id = json.loads(raw)
+        if isinstance(value, dict):
+            value = datetime.fromisoformat(value["dt"])
+        last_id = int(last_id)
+    except (ValueError, TypeError, KeyError):
+        raise InvalidCursor("cursor 格式錯誤")
+    if (c_sort_by, c_sort_order) != (sort_by, sort_order):
+        raise InvalidCursor("cursor 與排序條件不符")
+    return value, last_id
+
+
+def keyset_filter(sort_col, id_col, sort_order, value, last_id):
+    """(sort_col, id) 在 cursor 之後的條件；展開成 OR 以便使用索引（sort_col 不可為 NULL，見 keyset_page）"""
+    if sort_order == 'desc':
+        return or_(sort_col < value, and_(sort_col == value, id_col < last_id))
+    return or_(sort_col > value, and_(sort_col == value, id_col > last_id))
+
+
+def keyset_order(sort_col, id_col, sort_order):
+    if sort_order == 'desc':
+        return sort_col.desc(), id_col.desc()
+    return sort_col.asc(), id_col.asc()
+
+
+def keyset_page(q, sort_col, id_col, sort_order, limit, cursor=None, nullable=False):
+    """
+    依 (sort_col, id) 取一頁，cursor 為上一頁最後一筆的 (排序欄位值, id)
+    nullable 時 sort_col 為 NULL 的資料一律排在最後（不論升降冪），依 id 同方向接續：
+    先以 sort_col IS NOT NULL 走索引取資料，不足一頁再由 NULL 的部分補足；
+    cursor 的排序欄位值為 None 時表示已進入 NULL 的部分
+    """
+    id_order = id_col.desc() if sort_order == 'desc' else id_col.asc()
+    if cursor and cursor[0] is None:
+        id_after = id_col < cursor[1] if sort_order == 'desc' else id_col > cursor[1]
+        return q.filter(sort_col.is_(None), id_after).order_by(id_order).limit(limit).all()
+    page = q
+    if cursor:
+        page = page.filter(keyset_filter(sort_col, id_col, sort_order, *cursor))
+    if nullable:
+        page = page.filter(sort_col.isnot(None))
+    rows = page.order_by(*keyset_order(sort_col, id_col, sort_order)).limit(limit).all()
+    if nullable and len(rows) < limit:
+        rows += q.filter(sort_col.is_(None)).order_by(id_order).limit(limit - len(rows)).all()
+    return rows
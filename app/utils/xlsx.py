@@ -0,0 +1,58 @@
+from openpyxl import Workbook
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+from openpyxl.utils import get_column_letter
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+# Excel 單一工作表上限 1,048,576 列（含表頭），超過時接續到下一個工作表
+MAX_SHEET_ROWS = 1048575
+
+
+class SheetSpec:
+    """
+    一個（邏輯上的）工作表：標題、欄位 [(名稱, 欄寬)]、產生資料列的函式與轉換函式
+    rows 在寫到該工作表時才呼叫，同一時間只有一個 cursor 在讀取
+    """
+
+    def __init__(self, title, columns, rows, to_row=tuple):
+        self.title = title
+        self.columns = columns
+        self.rows = rows
+        self.to_row = to_row
+
+
+def _clean(value):
+    # 控制字元會讓 Excel 無法開啟檔案
+    if isinstance(value, str):
+        return ILLEGAL_CHARACTERS_RE.sub('', value)
+    return value
+
+
+def _new_sheet(wb, spec, part):
+    ws = wb.create_sheet(spec.title if part == 1 else f"{spec.title} ({part})")
+    for i, (_, width) in enumerate(spec.columns, start=1):
+        ws.column_dimensions[get_column_letter(i)].width = width
+    ws.freeze_panes = 'A2'
+    ws.append([name for name, _ in spec.columns])
+    return ws
+
+
+def write_xlsx(target, sheets, max_rows=MAX_SHEET_ROWS):
+    """
+    以 openpyxl write-only 模式寫出 XLSX（target 為檔案路徑或 file-like），回傳各工作表寫入的列數
+    每列寫入後即序列化到暫存檔，記憶體用量與列數無關；超過 max_rows 的資料接續到「標題 (2)」等工作表
+    """
+    wb = Workbook(write_only=True)
+    counts = {}
+    for spec in sheets:
+        part = 1
+        ws = _new_sheet(wb, spec, part)
+        written = 0
+        for row in spec.rows():
+            if written and written % max_rows == 0:
+                part += 1
+                ws = _new_sheet(wb, spec, part)
+            ws.append([_clean(v) for v in spec.to_row(row)])
+            written += 1
+        counts[spec.title] = written
+    wb.save(target)
+    return counts
@@ -23,6 +23,35 @@ class BaseConfig:
     FRONTEND_URL = os.getenv("FRONTEND_URL", "http://localhost:5173")
 
     BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:5000")
+
+    # 訂單編號：每個 worker 一次向資料庫保留的號碼數
+    ORDER_SN_BLOCK_SIZE = int(os.getenv("ORDER_SN_BLOCK_SIZE", 1000))
+
+    # Idempotency-Key：回應保存時數、處理中且尚未 commit 的紀錄視為中斷的秒數
+    IDEMPOTENCY_KEY_TTL_HOURS = int(os.getenv("IDEMPOTENCY_KEY_TTL_HOURS", 24))
+    IDEMPOTENCY_LOCK_TIMEOUT = int(os.getenv("IDEMPOTENCY_LOCK_TIMEOUT", 60))
+
+    # 商品目錄快取（各 worker 各自一份）：存活秒數與最多筆數
+    CATALOG_CACHE_TTL = int(os.getenv("CATALOG_CACHE_TTL", 60))
+    CATALOG_CACHE_MAX_ENTRIES = int(os.getenv("CATALOG_CACHE_MAX_ENTRIES", 1024))
+    # 商品名稱搜尋索引（各 worker 各自一份）：在背景執行緒定期重建以反映其他 worker 的異動
+    PRODUCT_SEARCH_REBUILD_SECONDS = int(os.getenv("PRODUCT_SEARCH_REBUILD_SECONDS", 600))
+    # process 內快取（分類樹）每隔幾秒比對一次資料庫的版本戳記
+    CACHE_VERSION_CHECK_SECONDS = int(os.getenv("CACHE_VERSION_CHECK_SECONDS", 5))
+
+    # 訂單付款期限（分鐘）：期間保留庫存，逾期未付款自動取消並釋回
+    ORDER_PAYMENT_WINDOW_MINUTES = int(os.getenv("ORDER_PAYMENT_WINDOW_MINUTES", 30))
+
+    # 報表結果快取（各 worker 各自一份）：存活秒數與最多筆數
+    REPORT_CACHE_TTL = int(os.getenv("REPORT_CACHE_TTL", 60))
+    REPORT_CACHE_MAX_ENTRIES = int(os.getenv("REPORT_CACHE_MAX_ENTRIES", 256))
+    # 非同步報表工作：結果檔目錄（預設為 instance/reports）、背景執行緒數
+    REPORT_ARTIFACT_DIR = os.getenv("REPORT_ARTIFACT_DIR")
+    REPORT_WORKERS = int(os.getenv("REPORT_WORKERS", 2))
+    # 執行中每隔幾秒更新心跳；超過 REPORT_JOB_TIMEOUT 秒沒有心跳視為中斷；排隊超過 REPORT_JOB_CLAIM_TIMEOUT 秒無人領取則重新派送
+    REPORT_JOB_HEARTBEAT = int(os.getenv("REPORT_JOB_HEARTBEAT", 30))
+    REPORT_JOB_TIMEOUT = int(os.getenv("REPORT_JOB_TIMEOUT", 120))
+    REPORT_JOB_CLAIM_TIMEOUT = int(os.getenv("REPORT_JOB_CLAIM_TIMEOUT", 30))
     
 
 class DevelopmentConfig(BaseConfig):
@@ -37,6 +66,9 @@ class TestingConfig(BaseConfig):
     """測試環境設定"""
     TESTING = True
     SQLALCHEMY_DATABASE_URI = "sqlite:///:memory:"
+    # 報表工作、商品搜尋索引在請求內同步執行，測試不需等待背景執行緒
+    REPORT_JOBS_EAGER = True
+    PRODUCT_SEARCH_EAGER_BUILD = True
 
 class ProductionConfig(BaseConfig):
     """正式環境設定"""
@@ -0,0 +1,35 @@
+"""backfill orders.reserved_until for pending orders
+
+Revision ID: f2b7d5e8a3c6
+Revises: e6f1a4c9b203
+Create Date: 2026-10-19 09:14:52.608341
+
+"""
+from alembic import op
+import os
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2b7d5e8a3c6'
+down_revision = 'e6f1a4c9b203'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 加入 reserved_until 前建立的 pending 訂單沒有付款期限，不會被逾期取消：
+    # 以 created_at + ORDER_PAYMENT_WINDOW_MINUTES 補上（沒有 created_at 的以目前時間起算）
+    minutes = int(os.getenv("ORDER_PAYMENT_WINDOW_MINUTES", 30))
+    dialect = op.get_bind().dialect.name
+    if dialect == 'mysql':
+        deadline = f"DATE_ADD(COALESCE(created_at, UTC_TIMESTAMP()), INTERVAL {minutes} MINUTE)"
+    elif dialect == 'postgresql':
+        deadline = f"COALESCE(created_at, NOW() AT TIME ZONE 'utc') + INTERVAL '{minutes} minutes'"
+    else:
+        deadline = f"datetime(COALESCE(created_at, CURRENT_TIMESTAMP), '+{minutes} minutes')"
+    op.execute(f"UPDATE orders SET reserved_until = {deadline} WHERE status = 'pending' AND reserved_until IS NULL")
+
+
+def downgrade():
+    # 補上的期限無法與原本就有的區分，不還原
+    pass
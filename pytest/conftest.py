@@ -30,3 +30,31 @@ def client():
     with app.test_client() as client:
         yield client
         # 不用額外收尾：離開 with block 會自動關閉 session
+
+
+@pytest.fixture(scope="function")
+def admin_headers(client):
+    """建立一個 admin 使用者並回傳帶 JWT 的 headers"""
+    from flask_jwt_extended import create_access_token
+    from app.models import User
+    with client.application.app_context():
+        user = User(username="admin", email="admin@example.com", role="admin")
+        user.set_password("secret")
+        db.session.add(user)
+        db.session.commit()
+        token = create_access_token(identity=str(user.id), additional_claims={"role": "admin"})
+    return {"Authorization": f"Bearer {token}"}
+
+
+@pytest.fixture(scope="function")
+def make_product(client):
+    """建立商品的工廠 fixture，回傳商品 id"""
+    from app.models import Product
+
+    def _make(name="商品", price=100, stock=10, **kwargs):
+        with client.application.app_context():
+            p = Product(name=name, price=price, stock=stock, **kwargs)
+            db.session.add(p)
+            db.session.commit()
+            return p.id
+    return _make
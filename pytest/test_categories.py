@@ -0,0 +1,94 @@
+# tests/test_categories.py
+from sqlalchemy import event
+
+from app import db
+
+
+def _create(client, headers, name, parent_id=None):
+    return client.post("/categories", json={"name": name, "parent_id": parent_id}, headers=headers).get_json()["id"]
+
+
+def test_category_tree_is_served_from_snapshot_and_moves_subtree(client, admin_headers):
+    a = _create(client, admin_headers, "3C")
+    b = _create(client, admin_headers, "電腦", a)
+    c = _create(client, admin_headers, "筆電", b)
+    d = _create(client, admin_headers, "配件", c)
+    e = _create(client, admin_headers, "家電")
+
+    client.get("/categories")  # 建立快照
+    statements = []
+    with client.application.app_context():
+        engine = db.engine
+    listener = lambda *args: statements.append(args[2])
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        tree = client.get("/categories").get_json()
+        subtree = client.get(f"/categories/{b}").get_json()
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+    # 穩定狀態下分類讀取完全不查資料庫
+    assert statements == []
+    assert [n["name"] for n in tree] == ["3C", "家電"]
+    assert subtree["children"][0]["children"][0]["id"] == d
+
+    # 移動子樹：子孫的 path / depth 一併改寫
+    moved = client.put(f"/categories/{b}", json={"parent_id": e}, headers=admin_headers).get_json()
+    assert moved["path"] == f"/{e}/{b}/"
+    assert moved["children"][0]["children"][0]["path"] == f"/{e}/{b}/{c}/{d}/"
+    assert moved["children"][0]["children"][0]["depth"] == 3
+    assert client.get(f"/categories/{a}").get_json()["children"] == []
+
+    # 不能移到自己的子孫底下、有子分類時不能刪除
+    assert client.put(f"/categories/{b}", json={"parent_id": d}, headers=admin_headers).status_code == 400
+    assert client.delete(f"/categories/{b}", headers=admin_headers).status_code == 400
+
+
+def test_product_category_filter_covers_subtree(client, admin_headers):
+    root = _create(client, admin_headers, "3C")
+    child = _create(client, admin_headers, "電腦", root)
+    leaf = _create(client, admin_headers, "筆電", child)
+    other = _create(client, admin_headers, "家電")
+    for name, cid in [("手機", root), ("桌機", child), ("輕薄筆電", leaf), ("吹風機", other)]:
+        client.post("/products", json={"name": name, "price": 10, "category_id": cid}, headers=admin_headers)
+
+    names = lambda cid, **kw: {p["name"] for p in client.get("/products", query_string={"category_id": cid, **kw}).get_json()["data"]}
+    assert names(root) == {"手機", "桌機", "輕薄筆電"}
+    assert names(child, name="筆電") == {"輕薄筆電"}
+
+    # 移動分類後子孫索引與快取一併失效
+    client.put(f"/categories/{child}", json={"parent_id": other}, headers=admin_headers)
+    assert names(root) == {"手機"}
+    assert names(other) == {"吹風機", "桌機", "輕薄筆電"}
+
+
+def test_category_snapshot_follows_version_stamp_from_other_workers(client, admin_headers):
+    from app.models import Category
+    from app.utils.cache import bump_version
+
+    client.application.config["CACHE_VERSION_CHECK_SECONDS"] = 0
+    cid = _create(client, admin_headers, "3C")
+    pid = client.post("/products", json={"name": "手機", "price": 10, "category_id": cid}, headers=admin_headers).get_json()["id"]
+    assert client.get(f"/products/{pid}").get_json()["category"]["name"] == "3C"
+
+    # 模擬其他 worker 改名並遞增版本戳記
+    with client.application.app_context():
+        db.session.get(Category, cid).name = "電子產品"
+        db.session.commit()
+    assert client.get("/categories").get_json()[0]["name"] == "3C"
+    with client.application.app_context():
+        bump_version("categories")
+    assert client.get("/categories").get_json()[0]["name"] == "電子產品"
+    assert client.get(f"/products/{pid}").get_json()["category"]["name"] == "電子產品"
+
+
+def test_move_category_persists_parent_and_path(client, admin_headers):
+    from app.models import Category
+    a = _create(client, admin_headers, "3C")
+    b = _create(client, admin_headers, "電腦", a)
+    c = _create(client, admin_headers, "家電")
+    rv = client.put(f"/categories/{b}", json={"name": "電腦周邊", "parent_id": c}, headers=admin_headers)
+    assert rv.status_code == 200
+    # 重新自資料庫讀取：parent_id、path 與同一請求的改名都已寫入
+    with client.application.app_context():
+        moved = db.session.get(Category, b)
+        assert (moved.parent_id, moved.path, moved.depth, moved.name) == (c, f"/{c}/{b}/", 1, "電腦周邊")
@@ -0,0 +1,40 @@
+# tests/test_inventory.py
+from app import db
+from app.models import InventoryMovement, Product
+from app.services.inventory_service import reconcile_stock
+
+
+def test_stock_changes_are_recorded_in_ledger(client, admin_headers):
+    pid = client.post("/products", json={"name": "鍵盤", "price": 100, "stock": 5}, headers=admin_headers).get_json()["id"]
+    client.put(f"/products/{pid}/stock", json={"delta": 3}, headers=admin_headers)
+    client.post("/orders", json={
+        "receiver_name": "王小明", "receiver_phone": "0912345678", "shipping_address": "台北市",
+        "items": [{"product_id": pid, "qty": 2}],
+    }, headers=admin_headers)
+    client.put(f"/products/{pid}", json={"stock": 10}, headers=admin_headers)
+
+    movements = client.get(f"/products/{pid}/movements", headers=admin_headers).get_json()
+    assert [(m["kind"], m["qty"]) for m in reversed(movements)] == [
+        ("opening", 5), ("receipt", 3), ("sale", -2), ("adjustment", 4),
+    ]
+    with client.application.app_context():
+        assert reconcile_stock() == []
+
+
+def test_stock_decrement_never_goes_negative(client, admin_headers, make_product):
+    pid = make_product(stock=2)
+    rv = client.put(f"/products/{pid}/stock", json={"delta": -3}, headers=admin_headers)
+    assert rv.status_code == 400
+    assert rv.get_json()["errors"][0]["available"] == 2
+    assert client.get(f"/products/{pid}").get_json()["stock"] == 2
+
+
+def test_reconcile_stock_fixes_drift(client, make_product):
+    pid = make_product(stock=7)  # 直接寫入資料庫，沒有異動帳
+    with client.application.app_context():
+        db.session.add(InventoryMovement(product_id=pid, kind="opening", qty=4))
+        db.session.commit()
+        assert reconcile_stock() == [{"product_id": pid, "stock": 7, "ledger": 4}]
+        reconcile_stock(fix=True)
+        db.session.commit()
+        assert db.session.get(Product, pid).stock == 4
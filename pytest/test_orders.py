@@ -0,0 +1,347 @@
+# tests/test_orders.py
+from app import db
+from app.models import Product
+
+
+def _order_payload(*items):
+    return {
+        "receiver_name": "王小明",
+        "receiver_phone": "0912345678",
+        "shipping_address": "台北市",
+        "items": [{"product_id": pid, "qty": qty} for pid, qty in items],
+    }
+
+
+def _stock(client, pid):
+    with client.application.app_context():
+        return db.session.get(Product, pid).stock
+
+
+def test_create_order_reserves_stock(client, admin_headers, make_product):
+    p1 = make_product(name="鍵盤", price=100, stock=5)
+    p2 = make_product(name="滑鼠", price=50, stock=3)
+    rv = client.post("/orders", json=_order_payload((p1, 2), (p2, 1), (p1, 1)), headers=admin_headers)
+    assert rv.status_code == 201
+    assert rv.get_json()["total_amount"] == 350
+    assert _stock(client, p1) == 2
+    assert _stock(client, p2) == 2
+
+
+def test_create_order_reports_all_shortages(client, admin_headers, make_product):
+    p1 = make_product(name="鍵盤", stock=1)
+    p2 = make_product(name="滑鼠", stock=0)
+    p3 = make_product(name="螢幕", stock=9)
+    rv = client.post("/orders", json=_order_payload((p1, 2), (p2, 1), (p3, 1)), headers=admin_headers)
+    assert rv.status_code == 400
+    errors = rv.get_json()["errors"]
+    assert sorted(e["product_id"] for e in errors) == [p1, p2]
+    # 整筆交易回滾，不會只扣部分庫存
+    assert _stock(client, p3) == 9
+
+
+def test_create_order_validates_product_id(client, admin_headers, make_product):
+    for pid in ("abc", True, 0, -1, "-1", 1.5, [1]):
+        rv = client.post("/orders", json=_order_payload((pid, 1)), headers=admin_headers)
+        assert rv.status_code == 400, pid
+        assert "product_id" in rv.get_json()["message"]
+    # 數字字串照舊接受
+    pid = make_product(stock=5)
+    rv = client.post("/orders", json=_order_payload((str(pid), 1)), headers=admin_headers)
+    assert rv.status_code == 201
+    assert rv.get_json()["items"][0]["product_id"] == pid
+
+
+def test_list_orders_cursor_pagination(client, admin_headers, make_product):
+    pid = make_product(stock=100)
+    created = [client.post("/orders", json=_order_payload((pid, 1)), headers=admin_headers).get_json()["id"] for _ in range(5)]
+    seen, cursor = [], None
+    while True:
+        params = {"pagination": "cursor", "page_size": 2, "sort_by": "status"}
+        if cursor:
+            params["cursor"] = cursor
+        body = client.get("/orders", query_string=params, headers=admin_headers).get_json()
+        assert "total" not in body
+        seen += [o["id"] for o in body["data"]]
+        cursor = body["next_cursor"]
+        if not cursor:
+            break
+    # 狀態全部相同時依 id 接續，不重複也不遺漏
+    assert seen == sorted(created, reverse=True)
+
+
+def test_list_orders_cursor_includes_null_sort_values(client, admin_headers, make_product):
+    from app.models import Order
+    pid = make_product(stock=100)
+    created = [client.post("/orders", json=_order_payload((pid, 1)), headers=admin_headers).get_json()["id"] for _ in range(5)]
+    with client.application.app_context():
+        for oid in created[1::2]:
+            db.session.get(Order, oid).created_at = None
+        db.session.commit()
+    for sort_order in ("desc", "asc"):
+        seen, cursor = [], None
+        while True:
+            params = {"pagination": "cursor", "page_size": 2, "sort_by": "created_at", "sort_order": sort_order}
+            if cursor:
+                params["cursor"] = cursor
+            body = client.get("/orders", query_string=params, headers=admin_headers).get_json()
+            seen += [o["id"] for o in body["data"]]
+            cursor = body["next_cursor"]
+            if not cursor:
+                break
+        # created_at 為 NULL 的訂單排在最後，依 id 接續
+        assert sorted(seen) == sorted(created)
+        assert seen[-2:] == sorted(created[1::2], reverse=sort_order == "desc")
+
+
+def test_list_orders_cursor_rejects_mismatched_sort(client, admin_headers, make_product):
+    pid = make_product(stock=100)
+    for _ in range(3):
+        client.post("/orders", json=_order_payload((pid, 1)), headers=admin_headers)
+    body = client.get("/orders", query_string={"pagination": "cursor", "page_size": 1, "with_total": "true"}, headers=admin_headers).get_json()
+    assert body["total"] == 3
+    rv = client.get("/orders", query_string={"cursor": body["next_cursor"], "sort_by": "total_amount"}, headers=admin_headers)
+    assert rv.status_code == 400
+
+
+def test_list_orders_loads_items_with_fixed_queries(client, admin_headers, make_product):
+    from sqlalchemy import event
+    pid = make_product(stock=100)
+    for qty in (1, 2, 3, 4):
+        client.post("/orders", json=_order_payload((pid, qty)), headers=admin_headers)
+
+    def count_queries(**params):
+        statements = []
+        with client.application.app_context():
+            engine = db.engine
+        listener = lambda *args: statements.append(args[2])
+        event.listen(engine, "before_cursor_execute", listener)
+        try:
+            body = client.get("/orders", query_string=params, headers=admin_headers).get_json()
+        finally:
+            event.remove(engine, "before_cursor_execute", listener)
+        return body, len(statements)
+
+    body, small = count_queries(page_size=1)
+    assert len(body["data"][0]["items"]) == 1
+    _, large = count_queries(page_size=4)
+    assert small == large
+
+    body, _ = count_queries(items="summary")
+    assert "items" not in body["data"][0]
+    assert body["data"][0]["item_count"] == 1
+    assert body["data"][0]["item_qty"] == 4
+
+
+def test_batch_update_status_reports_per_id_outcomes(client, admin_headers, make_product):
+    from app.models import Notification, OrderHistory
+    pid = make_product(stock=100)
+    a, b = [client.post("/orders", json=_order_payload((pid, 1)), headers=admin_headers).get_json()["id"] for _ in range(2)]
+    client.put("/orders/status", json={"ids": [b], "status": "cancelled"}, headers=admin_headers)
+
+    rv = client.put("/orders/status", json={"ids": [a, b, 999], "status": "confirmed"}, headers=admin_headers)
+    assert rv.status_code == 200
+    results = {r["id"]: r["result"] for r in rv.get_json()["results"]}
+    assert results == {a: "updated", b: "invalid_transition", 999: "not_found"}
+    with client.application.app_context():
+        assert OrderHistory.query.filter_by(order_id=a, status="confirmed").count() == 1
+        assert Notification.query.filter_by(type="order_status").count() == 2
+
+    rv = client.put("/orders/status", json={"ids": [a], "status": "unknown"}, headers=admin_headers)
+    assert rv.status_code == 400
+
+
+def test_order_sn_blocks_do_not_overlap(client):
+    from app.services.order_sn_service import OrderSnGenerator
+    with client.application.app_context():
+        gens = [OrderSnGenerator(db.engine, block_size=3) for _ in range(2)]
+        sns = [gens[i % 2].next_sn() for i in range(20)]
+    assert len(set(sns)) == 20
+    assert all(sn.startswith("OMS") and len(sn) == 21 for sn in sns)
+
+
+def test_list_orders_keyword_search(client, admin_headers, make_product):
+    pid = make_product(stock=100)
+    first = client.post("/orders", json=_order_payload((pid, 1)), headers=admin_headers).get_json()
+    payload = _order_payload((pid, 1))
+    payload["receiver_name"] = "陳大文"
+    client.post("/orders", json=payload, headers=admin_headers)
+
+    body = client.get("/orders", query_string={"keyword": "大文"}, headers=admin_headers).get_json()
+    assert [o["receiver_name"] for o in body["data"]] == ["陳大文"]
+    body = client.get("/orders", query_string={"keyword": first["order_sn"]}, headers=admin_headers).get_json()
+    assert [o["id"] for o in body["data"]] == [first["id"]]
+    # 訂單編號格式、但沒有訂單編號以此開頭時仍搜尋備註與收件人
+    payload = _order_payload((pid, 1))
+    payload["remark"] = "改寄 ABC12345 的地址"
+    noted = client.post("/orders", json=payload, headers=admin_headers).get_json()
+    body = client.get("/orders", query_string={"keyword": "ABC12345"}, headers=admin_headers).get_json()
+    assert [o["id"] for o in body["data"]] == [noted["id"]]
+
+
+def test_create_order_idempotency_key_replays_response(client, admin_headers, make_product):
+    from app.models import Order
+    pid = make_product(stock=5)
+    headers = dict(admin_headers, **{"Idempotency-Key": "retry-1"})
+    first = client.post("/orders", json=_order_payload((pid, 2)), headers=headers)
+    retry = client.post("/orders", json=_order_payload((pid, 2)), headers=headers)
+    assert first.status_code == retry.status_code == 201
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert retry.get_json()["id"] == first.get_json()["id"]
+    assert _stock(client, pid) == 3
+    with client.application.app_context():
+        assert Order.query.count() == 1
+
+    rv = client.post("/orders", json=_order_payload((pid, 1)), headers=headers)
+    assert rv.status_code == 422
+
+
+def test_failed_request_releases_idempotency_key(client, admin_headers, make_product):
+    pid = make_product(stock=1)
+    headers = dict(admin_headers, **{"Idempotency-Key": "retry-2"})
+    assert client.post("/orders", json=_order_payload((pid, 2)), headers=headers).status_code == 400
+    with client.application.app_context():
+        db.session.get(Product, pid).stock = 2
+        db.session.commit()
+    assert client.post("/orders", json=_order_payload((pid, 2)), headers=headers).status_code == 201
+
+
+def test_idempotency_key_never_reruns_committed_request(client, admin_headers, make_product, monkeypatch):
+    from datetime import datetime, timedelta
+    from app.models import IdempotencyKey, Order
+    client.application.config["IDEMPOTENCY_LOCK_TIMEOUT"] = 0
+    pid = make_product(stock=5)
+    headers = dict(admin_headers, **{"Idempotency-Key": "retry-3"})
+
+    # 訂單已 commit、回應保存前中斷：重試（即使已逾時）不再建立第二筆訂單
+    def crash(self, **kwargs):
+        raise RuntimeError("worker 中斷")
+    with monkeypatch.context() as m:
+        m.setattr(Order, "to_dict", crash)
+        assert client.post("/orders", json=_order_payload((pid, 1)), headers=headers).status_code == 500
+    assert client.post("/orders", json=_order_payload((pid, 1)), headers=headers).status_code == 409
+    with client.application.app_context():
+        assert Order.query.count() == 1
+    assert _stock(client, pid) == 4
+
+    # 執行超過 IDEMPOTENCY_LOCK_TIMEOUT 時 key 已被重試接手（紀錄被刪除）：原請求的交易不可 commit
+    from app.routes import orders
+    reserve_stock = orders.reserve_stock
+
+    def taken_over(*args, **kwargs):
+        IdempotencyKey.query.filter_by(key="retry-4").delete()
+        return reserve_stock(*args, **kwargs)
+    monkeypatch.setattr(orders, "reserve_stock", taken_over)
+    rv = client.post("/orders", json=_order_payload((pid, 1)), headers=dict(admin_headers, **{"Idempotency-Key": "retry-4"}))
+    assert rv.status_code == 409
+    with client.application.app_context():
+        assert Order.query.count() == 1
+    assert _stock(client, pid) == 4
+
+
+def test_update_order_diffs_items_and_adjusts_stock(client, admin_headers, make_product):
+    p1 = make_product(name="鍵盤", price=100, stock=10)
+    p2 = make_product(name="滑鼠", price=50, stock=10)
+    p3 = make_product(name="螢幕", price=300, stock=10)
+    order = client.post("/orders", json=_order_payload((p1, 2), (p2, 1)), headers=admin_headers).get_json()
+    p1_line = next(i for i in order["items"] if i["product_id"] == p1)
+
+    rv = client.put(f"/orders/{order['id']}", json={"items": [{"product_id": p1, "qty": 3}, {"product_id": p3, "qty": 1}]}, headers=admin_headers)
+    assert rv.status_code == 200
+    body = rv.get_json()
+    assert body["total_amount"] == 600
+    assert body["item_count"] == 2
+    lines = {i["product_id"]: i for i in body["items"]}
+    assert set(lines) == {p1, p3}
+    assert lines[p1]["id"] == p1_line["id"]  # 原列就地更新，不刪除重建
+    assert (_stock(client, p1), _stock(client, p2), _stock(client, p3)) == (7, 10, 9)
+
+    rv = client.put(f"/orders/{order['id']}", json={"items": [{"product_id": p3, "qty": 20}]}, headers=admin_headers)
+    assert rv.status_code == 400
+    assert _stock(client, p1) == 7
+
+
+def test_sweeper_cancels_expired_orders_and_releases_stock(client, admin_headers, make_product):
+    from datetime import datetime, timedelta
+    from app.models import Order
+    from app.services.order_service import sweep_expired_orders
+
+    pid = make_product(stock=10)
+    expired = client.post("/orders", json=_order_payload((pid, 3)), headers=admin_headers).get_json()["id"]
+    fresh = client.post("/orders", json=_order_payload((pid, 2)), headers=admin_headers).get_json()["id"]
+    assert _stock(client, pid) == 5
+    with client.application.app_context():
+        db.session.get(Order, expired).reserved_until = datetime.utcnow() - timedelta(minutes=1)
+        db.session.commit()
+        assert sweep_expired_orders(batch_size=1) == 1
+        assert db.session.get(Order, expired).status == "cancelled"
+        assert db.session.get(Order, fresh).status == "pending"
+    assert _stock(client, pid) == 8
+    # 逾期但尚未被排程取消的訂單庫存仍保留，照常付款；之後的排程不會取消已付款訂單
+    with client.application.app_context():
+        db.session.get(Order, fresh).reserved_until = datetime.utcnow() - timedelta(minutes=1)
+        db.session.commit()
+    assert client.post(f"/payments/{fresh}", headers=admin_headers).status_code == 201
+    with client.application.app_context():
+        assert sweep_expired_orders() == 0
+        assert db.session.get(Order, fresh).status == "paid"
+    assert _stock(client, pid) == 8
+
+
+def test_late_ecpay_payment_on_cancelled_order_is_flagged_for_refund(client, admin_headers, make_product):
+    from app.models import Order, Payment
+    pid = make_product(stock=10)
+    late = client.post("/orders", json=_order_payload((pid, 3)), headers=admin_headers).get_json()["id"]
+    paid = client.post("/orders", json=_order_payload((pid, 2)), headers=admin_headers).get_json()["id"]
+    client.put("/orders/status", json={"ids": [late], "status": "cancelled"}, headers=admin_headers)
+    assert _stock(client, pid) == 8
+
+    def callback(oid):
+        return client.post("/payments/ecpay/callback", data={"MerchantTradeNo": f"OMS{oid}0000000001", "RtnCode": "1"}).get_data(as_text=True)
+
+    assert callback(late) == "1|OK"
+    assert callback(paid) == "1|OK"
+    assert callback(paid) == "1|OK"  # 重送的通知不重複入帳
+    with client.application.app_context():
+        assert db.session.get(Order, late).status == "cancelled"
+        assert db.session.get(Order, paid).status == "paid"
+        assert [p.status for p in Payment.query.filter_by(order_id=late)] == ["refund_required"]
+        assert Payment.query.filter_by(order_id=paid).count() == 1
+    # 已取消訂單的庫存不會因延遲付款而重複賣出
+    assert _stock(client, pid) == 8
+    assert client.post(f"/payments/{late}", headers=admin_headers).status_code == 400
+
+
+def test_batch_status_skips_orders_changed_after_read(client, admin_headers, make_product, monkeypatch):
+    from sqlalchemy import update
+    from app.models import Order, OrderHistory
+    from app.services import order_service
+
+    pid = make_product(stock=10)
+    raced = client.post("/orders", json=_order_payload((pid, 3)), headers=admin_headers).get_json()["id"]
+    other = client.post("/orders", json=_order_payload((pid, 2)), headers=admin_headers).get_json()["id"]
+    apply_transition = order_service._apply_transition
+    target = {"id": raced}
+
+    def paid_meanwhile(rows, values):
+        # 讀取後、UPDATE 前訂單已被付款
+        db.session.execute(update(Order).where(Order.id == target["id"]).values(status="paid"))
+        return apply_transition(rows, values)
+
+    monkeypatch.setattr(order_service, "_apply_transition", paid_meanwhile)
+    rv = client.put("/orders/status", json={"ids": [raced, other], "status": "cancelled"}, headers=admin_headers)
+    results = {r["id"]: r["result"] for r in rv.get_json()["results"]}
+    assert results == {raced: "invalid_transition", other: "updated"}
+    with client.application.app_context():
+        assert db.session.get(Order, raced).status == "paid"
+        assert OrderHistory.query.filter_by(order_id=raced, status="cancelled").count() == 0
+    # 只釋回實際取消的訂單庫存
+    assert _stock(client, pid) == 7
+
+    # 不支援 RETURNING 時比對 rowcount，不符則整批 rollback
+    third = client.post("/orders", json=_order_payload((pid, 1)), headers=admin_headers).get_json()["id"]
+    with client.application.app_context():
+        monkeypatch.setattr(db.engine.dialect, "update_returning", False)
+    target["id"] = third
+    rv = client.put("/orders/status", json={"ids": [third], "status": "cancelled"}, headers=admin_headers)
+    assert rv.status_code == 409
+    assert _stock(client, pid) == 6
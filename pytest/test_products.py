@@ -0,0 +1,231 @@
+# tests/test_products.py
+
+
+def test_catalog_cache_hits_and_invalidates_on_write(client, admin_headers, make_product):
+    pid = make_product(name="鍵盤", price=100)
+    assert client.get("/products").get_json()["total"] == 1
+    assert client.get(f"/products/{pid}").get_json()["price"] == 100
+    client.get("/products")
+    client.get(f"/products/{pid}")
+    stats = client.get("/products/cache/stats", headers=admin_headers).get_json()
+    assert (stats["hits"], stats["misses"]) == (2, 2)
+
+    client.put(f"/products/{pid}", json={"price": 120}, headers=admin_headers)
+    assert client.get(f"/products/{pid}").get_json()["price"] == 120
+    client.post("/products", json={"name": "滑鼠", "price": 50}, headers=admin_headers)
+    assert client.get("/products").get_json()["total"] == 2
+    assert client.get("/products/999").status_code == 404
+
+
+def test_product_options_etag_and_delta(client, admin_headers, make_product):
+    p1 = make_product(name="鍵盤", price=100)
+    p2 = make_product(name="滑鼠", price=50)
+    rv = client.get("/products/options", headers=admin_headers)
+    assert [o["id"] for o in rv.get_json()] == [p1, p2]
+    etag = rv.headers["ETag"]
+    version = rv.headers["X-Catalog-Version"]
+    assert client.get("/products/options", headers=dict(admin_headers, **{"If-None-Match": etag})).status_code == 304
+
+    client.put(f"/products/{p1}", json={"price": 90}, headers=admin_headers)
+    client.delete(f"/products/{p2}", headers=admin_headers)
+    delta = client.get("/products/options", query_string={"since_version": version}, headers=admin_headers).get_json()
+    assert delta["full"] is False
+    assert [o["price"] for o in delta["changed"]] == [90]
+    assert delta["removed"] == [p2]
+    assert client.get("/products/options", headers=dict(admin_headers, **{"If-None-Match": etag})).status_code == 200
+
+
+def test_product_options_patches_stock_changes(client, admin_headers, make_product):
+    from sqlalchemy import update
+    from app import db
+    from app.models import Product
+    p1 = make_product(name="鍵盤", price=100, stock=5)
+    p2 = make_product(name="滑鼠", price=50, stock=5)
+    version = client.get("/products/options", headers=admin_headers).headers["X-Catalog-Version"]
+    # 未經 invalidate 的異動：用來確認庫存異動時不會重新掃描整個商品表
+    with client.application.app_context():
+        db.session.execute(update(Product).where(Product.id == p2).values(price=45))
+        db.session.commit()
+
+    client.post("/orders", json={
+        "receiver_name": "王小明", "receiver_phone": "0912345678", "shipping_address": "台北市",
+        "items": [{"product_id": p1, "qty": 2}],
+    }, headers=admin_headers)
+    delta = client.get("/products/options", query_string={"since_version": version}, headers=admin_headers).get_json()
+    assert delta["full"] is False
+    assert delta["changed"] == [{"id": p1, "name": "鍵盤", "price": 100, "stock": 3}]
+    assert [o["price"] for o in client.get("/products/options", headers=admin_headers).get_json()] == [100, 50]
+
+
+def test_bulk_update_products_reports_per_sku_results(client, admin_headers, make_product):
+    p1 = make_product(name="鍵盤", price=100, stock=5)
+    p2 = make_product(name="滑鼠", price=50, stock=1)
+    p3 = make_product(name="螢幕", price=300, stock=0)
+    rv = client.put("/products/bulk", json={"items": [
+        {"id": p1, "is_active": False, "price": 80, "promo_price": 70, "stock_delta": -2},
+        {"id": p2, "price": 45, "stock_delta": -3},
+        {"id": p3, "stock_delta": 10},
+        {"id": p3, "stock_delta": 5},
+        {"id": 999, "is_active": True},
+        {"id": p1, "price": "free"},
+    ]}, headers=admin_headers)
+    assert rv.status_code == 200
+    results = {r["id"]: r["result"] for r in rv.get_json()["results"]}
+    assert results == {p1: "invalid", p2: "insufficient_stock", p3: "updated", 999: "not_found"}
+
+    rv = client.put("/products/bulk", json={"items": [
+        {"id": p1, "is_active": False, "price": 80, "promo_price": 70, "stock_delta": -2},
+    ]}, headers=admin_headers)
+    assert rv.get_json()["counts"] == {"updated": 1}
+    p = client.get(f"/products/{p1}").get_json()
+    assert (p["is_active"], p["price"], p["promo_price"], p["stock"]) == (False, 80, 70, 3)
+    assert client.get(f"/products/{p2}").get_json()["price"] == 50
+    assert client.get(f"/products/{p3}").get_json()["stock"] == 15
+
+
+def test_batch_active_single_update(client, admin_headers, make_product):
+    ids = [make_product(name=f"商品{i}") for i in range(3)]
+    rv = client.put("/products/batch/active", json={"ids": ids + [999], "is_active": False}, headers=admin_headers)
+    assert rv.get_json()["updated"] == 3
+    assert client.get("/products", query_string={"is_active": "false"}).get_json()["total"] == 3
+
+
+def test_search_ranks_chinese_names_and_tracks_writes(client, admin_headers):
+    def create(name, **kw):
+        return client.post("/products", json={"name": name, "price": 10, **kw}, headers=admin_headers).get_json()["id"]
+
+    kb = create("無線鍵盤")
+    mech = create("機械式鍵盤 RGB")
+    create("鍵盤膜")
+    off = create("藍牙鍵盤", is_active=False)
+    create("滑鼠")
+
+    rv = client.get("/products?name=鍵盤").get_json()
+    assert rv["total"] == 4
+    assert rv["data"][0]["name"] == "鍵盤膜"  # 前綴相符優先
+    assert [p["id"] for p in client.get("/products?name=rgb").get_json()["data"]] == [mech]
+
+    names = [p["name"] for p in client.get("/products/autocomplete?q=鍵").get_json()]
+    assert names[0] == "鍵盤膜" and "藍牙鍵盤" not in names
+
+    # 增量更新：改名與上架後立即可查到
+    client.put(f"/products/{kb}", json={"name": "無線滑鼠"}, headers=admin_headers)
+    client.put("/products/batch/active", json={"ids": [off], "is_active": True}, headers=admin_headers)
+    assert {p["name"] for p in client.get("/products/autocomplete?q=滑鼠").get_json()} == {"滑鼠", "無線滑鼠"}
+    assert "藍牙鍵盤" in [p["name"] for p in client.get("/products/autocomplete?q=鍵盤").get_json()]
+
+
+def test_search_index_builds_in_background_with_like_fallback(client, make_product, monkeypatch):
+    import threading
+    from app.services import search_service
+    client.application.config["PRODUCT_SEARCH_EAGER_BUILD"] = False
+    make_product(name="無線鍵盤")
+    make_product(name="鍵盤膜")
+    release = threading.Event()
+    index_rows = search_service._index_rows
+    monkeypatch.setattr(search_service, "_index_rows", lambda ids=None: release.wait(5) and index_rows(ids))
+
+    # 索引在背景建立中：請求不等待，改用 LIKE（片段順序不限）
+    assert [p["name"] for p in client.get("/products?name=鍵盤 無線").get_json()["data"]] == ["無線鍵盤"]
+    assert [p["name"] for p in client.get("/products/autocomplete?q=鍵盤").get_json()] == ["鍵盤膜", "無線鍵盤"]
+    release.set()
+    for t in threading.enumerate():
+        if t.name == "product-search-build":
+            t.join(5)
+    with client.application.app_context():
+        assert len(client.application.extensions[search_service.SEARCH_INDEX]) == 2
+    assert client.get("/products/autocomplete?q=鍵盤").get_json()[0]["name"] == "鍵盤膜"
+
+
+def test_search_rechecks_filters_and_follows_other_workers(client, admin_headers, make_product):
+    from sqlalchemy import update
+    from app import db
+    from app.models import Product
+    from app.services.search_service import SEARCH_INDEX
+    from app.utils.cache import bump_version
+    client.application.config["CACHE_VERSION_CHECK_SECONDS"] = 0
+    pid = make_product(name="無線鍵盤")
+    assert client.get("/products?name=鍵盤&is_active=true").get_json()["total"] == 1
+    version = client.application.extensions[SEARCH_INDEX].version
+
+    # 其他 worker 下架：本 worker 的索引尚未更新，篩選仍以資料庫為準
+    with client.application.app_context():
+        db.session.execute(update(Product).where(Product.id == pid).values(is_active=False))
+        db.session.commit()
+    assert client.get("/products?name=鍵盤&is_active=true&page_size=5").get_json()["total"] == 0
+    assert client.get("/products/autocomplete?q=鍵盤").get_json() == []
+
+    # 其他 worker 改名並遞增版本戳記：本 worker 下次比對時重建索引
+    with client.application.app_context():
+        db.session.execute(update(Product).where(Product.id == pid).values(name="藍牙滑鼠"))
+        bump_version(SEARCH_INDEX)
+    assert [p["id"] for p in client.get("/products?name=滑鼠").get_json()["data"]] == [pid]
+    assert client.application.extensions[SEARCH_INDEX].version == version + 1
+
+    # 本 worker 自己的異動以增量更新跟上版本，不重建
+    index = client.application.extensions[SEARCH_INDEX]
+    client.put(f"/products/{pid}", json={"name": "藍牙耳機"}, headers=admin_headers)
+    assert [p["id"] for p in client.get("/products?name=耳機").get_json()["data"]] == [pid]
+    assert client.application.extensions[SEARCH_INDEX] is index
+
+
+def test_list_products_with_facets(client, admin_headers):
+    cats = [client.post("/categories", json={"name": n}, headers=admin_headers).get_json()["id"] for n in ("周邊", "耗材")]
+    for name, cat, stock, active in [
+        ("鍵盤", cats[0], 5, True), ("滑鼠", cats[0], 0, True), ("耳機", cats[0], 2, False),
+        ("碳粉匣", cats[1], 9, True), ("滑鼠墊", None, 1, True),
+    ]:
+        client.post("/products", json={"name": name, "price": 10, "stock": stock, "category_id": cat, "is_active": active}, headers=admin_headers)
+
+    rv = client.get(f"/products?facets=true&is_active=true&category_id={cats[0]}").get_json()
+    assert rv["total"] == 2
+    facets = rv["facets"]
+    # 分類 facet 不套用分類本身的篩選
+    assert {f["category_id"]: f["count"] for f in facets["category"]} == {cats[0]: 2, cats[1]: 1, None: 1}
+    assert facets["is_active"] == {"true": 2, "false": 1}
+    assert facets["in_stock"] == {"true": 1, "false": 1}
+
+    rv = client.get("/products?facets=true&in_stock=true&name=滑鼠").get_json()
+    assert [p["name"] for p in rv["data"]] == ["滑鼠墊"]
+    assert rv["facets"]["in_stock"] == {"true": 1, "false": 1}
+
+
+def test_order_stock_changes_invalidate_only_affected_products(client, admin_headers, make_product):
+    pid = make_product(name="鍵盤", stock=2)
+    other = make_product(name="滑鼠", stock=5)
+    assert client.get("/products?in_stock=true&facets=true").get_json()["total"] == 2
+    assert client.get(f"/products/{pid}").get_json()["stock"] == 2
+    assert client.get(f"/products/{other}").get_json()["stock"] == 5
+
+    order = client.post("/orders", json={
+        "receiver_name": "王小明", "receiver_phone": "0912345678", "shipping_address": "台北市",
+        "items": [{"product_id": pid, "qty": 2}],
+    }, headers=admin_headers).get_json()
+    # 下單扣庫存 commit 後只清除該商品的快取；清單頁的庫存在 TTL 內更新，不清空整個目錄快取
+    before = client.get("/products/cache/stats", headers=admin_headers).get_json()
+    assert client.get(f"/products/{pid}").get_json()["stock"] == 0
+    assert client.get(f"/products/{other}").get_json()["stock"] == 5
+    assert client.get("/products?in_stock=true&facets=true").get_json()["total"] == 2
+    after = client.get("/products/cache/stats", headers=admin_headers).get_json()
+    assert (after["hits"] - before["hits"], after["misses"] - before["misses"]) == (2, 1)
+
+    client.put("/orders/status", json={"ids": [order["id"]], "status": "cancelled"}, headers=admin_headers)
+    assert client.get(f"/products/{pid}").get_json()["stock"] == 2
+
+
+def test_set_stock_uses_locked_current_stock(client, make_product):
+    from sqlalchemy import update
+    from app import db
+    from app.models import InventoryMovement, Product
+    from app.services.product_service import set_stock
+    pid = make_product(stock=10)
+    with client.application.app_context():
+        prod = db.session.get(Product, pid)
+        # 讀取後庫存被其他交易扣掉 3
+        db.session.execute(update(Product).where(Product.id == pid).values(stock=7).execution_options(synchronize_session=False))
+        assert prod.stock == 10
+        set_stock(prod, 5)
+        db.session.commit()
+        assert db.session.get(Product, pid).stock == 5
+        movement = InventoryMovement.query.filter_by(product_id=pid).order_by(InventoryMovement.id.desc()).first()
+        assert movement.qty == -2
@@ -0,0 +1,272 @@
+# tests/test_reports.py
+from app import db
+from app.models import SalesDailyRollup, ProductSalesDaily
+from app.services.sales_rollup_service import rebuild_sales_rollup
+from app.services.report_service import report_cache
+
+
+def _order(client, headers, pid, qty):
+    return client.post("/orders", json={
+        "receiver_name": "王小明", "receiver_phone": "0912345678", "shipping_address": "台北市",
+        "items": [{"product_id": pid, "qty": qty}],
+    }, headers=headers).get_json()["id"]
+
+
+def _rollup(client):
+    with client.application.app_context():
+        return sorted((r.status, r.payment_status, r.order_count, r.amount) for r in SalesDailyRollup.query if r.order_count)
+
+
+def test_sales_rollup_tracks_order_writes(client, admin_headers, make_product):
+    pid = make_product(price=100, stock=50)
+    o1 = _order(client, admin_headers, pid, 1)
+    o2 = _order(client, admin_headers, pid, 2)
+    o3 = _order(client, admin_headers, pid, 3)
+    client.post(f"/payments/{o1}", headers=admin_headers)
+    client.put("/orders/status", json={"ids": [o2], "status": "cancelled"}, headers=admin_headers)
+    client.put(f"/orders/{o3}", json={"items": [{"product_id": pid, "qty": 4}]}, headers=admin_headers)
+
+    expected = [("cancelled", "unpaid", 1, 200.0), ("paid", "paid", 1, 100.0), ("pending", "unpaid", 1, 400.0)]
+    assert _rollup(client) == expected
+
+    [day] = client.get("/api/reports/sales").get_json()
+    assert day["order_count"] == 3
+    assert day["total"] == 700
+    assert day["paid_amount"] == 100
+    assert day["by_status"]["cancelled"] == {"order_count": 1, "amount": 200}
+    assert client.get("/api/reports/sales?period=year").get_json()[0]["period"] == day["period"][:4]
+
+    # 重建結果與增量維護一致
+    with client.application.app_context():
+        db.session.query(SalesDailyRollup).delete()
+        db.session.commit()
+        rebuild_sales_rollup()
+    assert _rollup(client) == expected
+
+
+def test_export_orders_streams_filtered_csv(client, admin_headers, make_product):
+    pid = make_product(price=100, stock=50)
+    o1 = _order(client, admin_headers, pid, 1)
+    _order(client, admin_headers, pid, 2)
+    client.post(f"/payments/{o1}", headers=admin_headers)
+
+    rv = client.get("/api/reports/export/orders?status=paid")
+    assert rv.is_streamed
+    lines = rv.get_data(as_text=True).splitlines()
+    assert lines[0] == "訂單編號,客戶,金額,狀態,建立時間"
+    assert [line.split(",")[0] for line in lines[1:]] == [str(o1)]
+    assert len(client.get("/api/reports/export/orders?end=2000-01-01").get_data(as_text=True).splitlines()) == 1
+    assert client.get("/api/reports/export/orders?start=yesterday").status_code == 400
+
+
+def test_export_orders_xlsx_has_order_item_and_payment_sheets(client, admin_headers, make_product):
+    import io
+    from openpyxl import load_workbook
+
+    pid = make_product(name="鍵盤", price=100, stock=50)
+    o1 = _order(client, admin_headers, pid, 2)
+    _order(client, admin_headers, pid, 1)
+    client.post(f"/payments/{o1}", headers=admin_headers)
+
+    rv = client.get("/api/reports/export/orders?format=xlsx&status=paid")
+    assert rv.status_code == 200
+    wb = load_workbook(io.BytesIO(rv.data), read_only=True)
+    assert wb.sheetnames == ["訂單", "明細", "付款"]
+    orders = list(wb["訂單"].values)
+    assert len(orders) == 2 and orders[1][0] == o1
+    assert list(wb["明細"].values)[1][3:] == ("鍵盤", 2, 100, 200)
+    assert list(wb["付款"].values)[1][1] == o1
+
+
+def test_write_xlsx_rolls_over_to_next_sheet():
+    import io
+    from openpyxl import load_workbook
+    from app.utils.xlsx import SheetSpec, write_xlsx
+
+    buf = io.BytesIO()
+    counts = write_xlsx(buf, [SheetSpec("資料", [("n", 8)], lambda: ((i,) for i in range(5)))], max_rows=2)
+    assert counts == {"資料": 5}
+    assert load_workbook(buf, read_only=True).sheetnames == ["資料", "資料 (2)", "資料 (3)"]
+
+
+def test_report_job_runs_dedupes_and_downloads(client, admin_headers, make_product, tmp_path):
+    from app.models import ReportJob
+    client.application.config["REPORT_ARTIFACT_DIR"] = str(tmp_path)
+    pid = make_product(price=100, stock=10)
+    _order(client, admin_headers, pid, 1)
+
+    rv = client.post("/api/reports/jobs", json={"kind": "orders", "format": "csv", "params": {"status": "pending"}}, headers=admin_headers)
+    assert rv.status_code == 202
+    job = rv.get_json()
+    assert job["status"] == "succeeded"
+    rv = client.get(f"/api/reports/jobs/{job['id']}/download", headers=admin_headers)
+    assert rv.status_code == 200
+    assert len(rv.get_data(as_text=True).strip().splitlines()) == 2
+    assert [p.name for p in tmp_path.iterdir()] == [f"{job['id']}.csv"]
+
+    # 相同條件的工作仍在執行中時不重複建立
+    with client.application.app_context():
+        running = db.session.get(ReportJob, job["id"])
+        running.status, running.active_key = "running", running.params_hash
+        db.session.commit()
+    rv = client.post("/api/reports/jobs", json={"kind": "orders", "format": "csv", "params": {"status": ["pending"]}}, headers=admin_headers)
+    assert rv.status_code == 200
+    assert rv.get_json()["id"] == job["id"] and rv.get_json()["deduplicated"]
+    assert client.get(f"/api/reports/jobs/{job['id']}/download", headers=admin_headers).status_code == 409
+
+    assert client.post("/api/reports/jobs", json={"kind": "orders", "format": "json"}, headers=admin_headers).status_code == 400
+
+
+
+def test_report_jobs_recover_after_worker_restart(client, admin_headers, make_product, tmp_path, monkeypatch):
+    from datetime import datetime, timedelta
+    from app.models import ReportJob
+    from app.services import report_job_service
+    client.application.config.update(REPORT_ARTIFACT_DIR=str(tmp_path), REPORT_JOBS_EAGER=False)
+    dispatched = []
+    # worker 重啟：記憶體中的執行緒池遺失，工作停在 queued
+    monkeypatch.setattr(report_job_service, "_dispatch", dispatched.append)
+    payload = {"kind": "products", "format": "csv", "params": {}}
+    job_id = client.post("/api/reports/jobs", json=payload, headers=admin_headers).get_json()["id"]
+    assert dispatched == [job_id]
+
+    # 無人領取超過 REPORT_JOB_CLAIM_TIMEOUT：再次提交時重新派送
+    client.post("/api/reports/jobs", json=payload, headers=admin_headers)
+    assert dispatched == [job_id]
+    with client.application.app_context():
+        db.session.get(ReportJob, job_id).created_at = datetime.utcnow() - timedelta(minutes=5)
+        db.session.commit()
+    assert client.post("/api/reports/jobs", json=payload, headers=admin_headers).get_json()["id"] == job_id
+    assert dispatched == [job_id, job_id]
+
+    with client.application.app_context():
+        # run-report-jobs 輪詢執行排隊中的工作
+        assert report_job_service.run_pending_report_jobs() == 1
+        assert db.session.get(ReportJob, job_id).status == "succeeded"
+
+        # 是否中斷依心跳判斷，與建立時間無關
+        old = datetime.utcnow() - timedelta(hours=2)
+        alive = ReportJob(id="alive", kind="orders", format="csv", params="{}", params_hash="a", active_key="a",
+                          status="running", created_at=old, started_at=old, heartbeat_at=datetime.utcnow())
+        dead = ReportJob(id="dead", kind="orders", format="csv", params="{}", params_hash="d", active_key="d",
+                         status="running", created_at=datetime.utcnow(), started_at=datetime.utcnow() - timedelta(minutes=5))
+        db.session.add_all([alive, dead])
+        db.session.commit()
+        assert report_job_service.fail_stale_report_jobs() == 1
+        assert db.session.get(ReportJob, "alive").status == "running"
+        assert db.session.get(ReportJob, "dead").status == "failed"
+        assert db.session.get(ReportJob, "dead").active_key is None
+
+
+def test_sales_buckets_match_sql_group_by_and_shift_with_timezone(client, admin_headers, make_product):
+    from datetime import datetime, timedelta
+    from app.models import Order
+    from app.services.sales_aggregation_service import sales_buckets, sales_buckets_sql
+    pid = make_product(price=100, stock=50)
+    ids = [_order(client, admin_headers, pid, qty) for qty in (1, 2, 3, 4, 5)]
+    client.post(f"/payments/{ids[0]}", headers=admin_headers)
+    stamps = [datetime(2025, 12, 29, 1), datetime(2025, 12, 31, 20), datetime(2026, 1, 1, 3), datetime(2026, 1, 31, 17), datetime(2026, 2, 2, 9)]
+    with client.application.app_context():
+        for oid, ts in zip(ids, stamps):
+            db.session.get(Order, oid).created_at = ts
+        db.session.commit()
+        for period in ("day", "week", "month", "year"):
+            assert sales_buckets(period, batch_size=2) == sales_buckets_sql(period)
+        assert [p["period"] for p in sales_buckets("week")] == ["2026-W01", "2026-W05", "2026-W06"]
+
+        # 台北時間（UTC+8）：12/31 20:00 UTC 屬於 1/1，1/31 17:00 UTC 屬於 2/1
+        taipei = sales_buckets("month", tz="Asia/Taipei")
+        assert [(p["period"], p["order_count"]) for p in taipei] == [("2025-12", 1), ("2026-01", 2), ("2026-02", 2)]
+        assert taipei[0]["paid_amount"] == 100
+        assert [p["period"] for p in sales_buckets("day", start="2026-01-01", end="2026-01-01", tz="Asia/Taipei")] == ["2026-01-01"]
+
+    assert client.get("/api/reports/sales?tz=Mars/Olympus").status_code == 400
+    assert client.get("/api/reports/sales?period=week").get_json()[0]["period"] == "2026-W01"
+
+
+def test_product_ranking_tracks_order_writes(client, admin_headers, make_product):
+    keyboard = make_product(name="鍵盤", price=100, stock=50)
+    mouse = make_product(name="滑鼠", price=300, stock=50)
+    screen = make_product(name="螢幕", price=1000, stock=50)
+    o1 = client.post("/orders", json={
+        "receiver_name": "王小明", "receiver_phone": "0912345678", "shipping_address": "台北市",
+        "items": [{"product_id": keyboard, "qty": 2}, {"product_id": mouse, "qty": 1}, {"product_id": keyboard, "qty": 1}],
+    }, headers=admin_headers).get_json()["id"]
+    o2 = _order(client, admin_headers, mouse, 2)
+    o3 = _order(client, admin_headers, screen, 5)
+    client.put("/orders/status", json={"ids": [o3], "status": "cancelled"}, headers=admin_headers)
+    client.put(f"/orders/{o2}", json={"items": [{"product_id": mouse, "qty": 1}, {"product_id": screen, "qty": 1}]}, headers=admin_headers)
+
+    ranking = client.get("/api/reports/product-ranking").get_json()
+    assert [(r["product"], r["quantity"], r["amount"], r["order_count"]) for r in ranking] == [
+        ("鍵盤", 3, 300.0, 1), ("滑鼠", 2, 600.0, 2), ("螢幕", 1, 1000.0, 1)]
+    by_amount = client.get("/api/reports/product-ranking?sort_by=amount&limit=2").get_json()
+    assert [r["product_id"] for r in by_amount] == [screen, mouse]
+    assert client.get("/api/reports/product-ranking?start=2000-01-01&end=2000-12-31").get_json() == []
+
+    client.delete(f"/orders/{o1}", headers=admin_headers)
+    with client.application.app_context():
+        report_cache().clear()  # 報表結果在 TTL 內會被快取
+    assert [r["product"] for r in client.get("/api/reports/product-ranking").get_json()] == ["滑鼠", "螢幕"]
+
+    # 重建結果與增量維護一致
+    def snapshot():
+        with client.application.app_context():
+            return sorted((r.product_id, r.qty, r.amount, r.order_count) for r in ProductSalesDaily.query if r.qty)
+    expected = snapshot()
+    with client.application.app_context():
+        db.session.query(ProductSalesDaily).delete()
+        db.session.commit()
+        rebuild_sales_rollup()
+    assert snapshot() == expected
+
+
+def test_report_cache_keys_on_normalized_params(client, admin_headers, make_product):
+    pid = make_product(price=100, stock=10)
+    _order(client, admin_headers, pid, 1)
+    first = client.get("/api/reports/sales?start=2000-01-01").get_json()
+    _order(client, admin_headers, pid, 1)
+    # 相同參數（日期寫法不同、tz=UTC 等同預設）在 TTL 內直接回傳快取結果
+    assert client.get("/api/reports/sales?start=2000-01-01T00:00&tz=UTC&period=day").get_json() == first
+    assert client.get("/api/reports/sales").get_json()[0]["order_count"] == 2
+    assert client.get("/api/reports/sales?start=bad").status_code == 400
+
+    stats = client.get("/api/reports/cache/stats", headers=admin_headers).get_json()
+    assert (stats["hits"], stats["misses"], stats["size"]) == (1, 2, 2)
+
+
+def test_ttl_cache_single_flight_shares_one_computation():
+    import threading
+    import time
+    import pytest
+    from app.utils.cache import TTLCache
+    cache = TTLCache(ttl=60)
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        release.wait(5)
+        return "result"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_compute("k", compute))) for _ in range(8)]
+    for t in threads:
+        t.start()
+    while cache.stats()["misses"] + cache.stats()["coalesced"] < 8:
+        time.sleep(0.001)
+    release.set()
+    for t in threads:
+        t.join()
+    assert results == ["result"] * 8 and len(calls) == 1
+    assert cache.get_or_compute("k", compute) == "result"
+    stats = cache.stats()
+    assert (stats["misses"], stats["coalesced"], stats["hits"]) == (1, 7, 1)
+
+    # 計算失敗時等待者收到相同例外，且不寫入快取
+    def fail():
+        raise ValueError("boom")
+    for _ in range(2):
+        with pytest.raises(ValueError, match="boom"):
+            cache.get_or_compute("bad", fail)
+    assert cache.stats()["misses"] == 3
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+訂單編號產生器壓力測試
+
+模擬多個 gunicorn worker（獨立 process）同時對同一個資料庫產生訂單編號，
+驗證所有編號都不重複、各 process 內單調遞增，並輸出吞吐量與 DB 往返次數。
+
+使用方式：
+    python scripts/bench_order_sn.py --workers 8 --count 20000 --block-size 1000
+
+未指定 --database-url 時使用暫存的 SQLite 檔案
+"""
+
+import argparse
+import multiprocessing as mp
+import os
+import sys
+import tempfile
+import time
+
+# 添加專案根目錄到 Python 路徑
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _worker(database_url, block_size, count, start_event, queue):
+    from sqlalchemy import create_engine
+    from app.services.order_sn_service import OrderSnGenerator
+
+    engine = create_engine(database_url)
+    gen = OrderSnGenerator(engine, block_size=block_size)
+    allocations = 0
+    original = gen._allocate_block
+
+    def counted():
+        nonlocal allocations
+        allocations += 1
+        return original()
+
+    gen._allocate_block = counted
+    start_event.wait()
+    t0 = time.perf_counter()
+    sns = [gen.next_sn() for _ in range(count)]
+    elapsed = time.perf_counter() - t0
+    queue.put((os.getpid(), sns, elapsed, allocations))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--count', type=int, default=20000, help='每個 worker 產生的編號數')
+    parser.add_argument('--block-size', type=int, default=1000)
+    parser.add_argument('--database-url')
+    args = parser.parse_args()
+
+    tmpdir = None
+    database_url = args.database_url
+    if not database_url:
+        tmpdir = tempfile.TemporaryDirectory()
+        database_url = f"sqlite:///{os.path.join(tmpdir.name, 'bench.db')}"
+
+    from sqlalchemy import create_engine
+    from app.models.sequence import IdSequence
+    IdSequence.__table__.create(create_engine(database_url), checkfirst=True)
+
+    ctx = mp.get_context('spawn')
+    start_event = ctx.Event()
+    queue = ctx.Queue()
+    procs = [ctx.Process(target=_worker, args=(database_url, args.block_size, args.count, start_event, queue)) for _ in range(args.workers)]
+    for p in procs:
+        p.start()
+    t0 = time.perf_counter()
+    start_event.set()
+    results = [queue.get() for _ in procs]
+    wall = time.perf_counter() - t0
+    for p in procs:
+        p.join()
+
+    all_sns = []
+    for pid, sns, elapsed, allocations in results:
+        seqs = [int(sn[-10:]) for sn in sns]
+        monotonic = all(a < b for a, b in zip(seqs, seqs[1:]))
+        print(f"  worker {pid}: {len(sns)} 筆, {len(sns) / elapsed:,.0f} 筆/秒, DB 往返 {allocations} 次, 單調遞增={monotonic}")
+        assert monotonic, f"worker {pid} 編號非單調遞增"
+        all_sns.extend(sns)
+
+    total = len(all_sns)
+    unique = len(set(all_sns))
+    print(f"總計 {total} 筆，不重複 {unique} 筆，整體 {total / wall:,.0f} 筆/秒（{wall:.2f}s）")
+    if tmpdir:
+        tmpdir.cleanup()
+    if unique != total:
+        print("❌ 發現重複的訂單編號")
+        sys.exit(1)
+    print("✅ 所有訂單編號皆不重複")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+銷售統計效能測試：NumPy 分組（sales_buckets）與資料庫 GROUP BY（sales_buckets_sql）
+
+以隨機訂單（建立時間分散在 --days 天內）填入資料庫，比較兩種做法在日 / 週 / 月 / 年的
+耗時，並驗證結果一致。
+
+使用方式：
+    python scripts/bench_sales_aggregation.py --orders 500000 --days 730
+
+未指定 --database-url 時使用暫存的 SQLite 檔案；指定時會寫入測試訂單，請使用空的測試資料庫
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# 添加專案根目錄到 Python 路徑
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+STATUSES = ["pending", "paid", "confirmed", "shipped", "delivered", "cancelled"]
+
+
+def seed_orders(db, count, days, seed, batch=20000):
+    from sqlalchemy import insert
+    from app.models import Order, User
+
+    rng = random.Random(seed)
+    user = User(username="bench", email="bench@example.com", password_hash="-", role="admin")
+    db.session.add(user)
+    db.session.flush()
+    start = datetime.utcnow() - timedelta(days=days)
+    for offset in range(0, count, batch):
+        rows = []
+        for i in range(offset, min(offset + batch, count)):
+            status = rng.choice(STATUSES)
+            rows.append({
+                "user_id": user.id,
+                "order_sn": f"BENCH{i:012d}",
+                "total_amount": round(rng.uniform(50, 5000), 2),
+                "status": status,
+                "payment_status": "paid" if status in ("paid", "shipped", "delivered") else "unpaid",
+                "shipping_fee": 0,
+                "receiver_name": "測試",
+                "receiver_phone": "0912345678",
+                "shipping_address": "台北市",
+                "created_at": start + timedelta(seconds=rng.randrange(days * 86400)),
+            })
+        db.session.execute(insert(Order), rows)
+    db.session.commit()
+
+
+def timed(fn):
+    t0 = time.perf_counter()
+    result = fn()
+    return result, (time.perf_counter() - t0) * 1000
+
+
+def max_diff(a, b):
+    """兩種結果的期間、筆數須完全相同，回傳金額的最大差異"""
+    assert [(p["period"], p["order_count"]) for p in a] == [(p["period"], p["order_count"]) for p in b]
+    return max((abs(x["total"] - y["total"]) for x, y in zip(a, b)), default=0.0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="銷售統計效能測試")
+    parser.add_argument("--orders", type=int, default=200000)
+    parser.add_argument("--days", type=int, default=730)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--tz", default="Asia/Taipei", help="另外量測指定時區的分組")
+    parser.add_argument("--database-url")
+    args = parser.parse_args()
+
+    tmpdir = None
+    if not args.database_url:
+        tmpdir = tempfile.TemporaryDirectory()
+        args.database_url = f"sqlite:///{os.path.join(tmpdir.name, 'bench.db')}"
+    os.environ["DATABASE_URL"] = args.database_url
+
+    from app import create_app, db
+    from app.services.sales_aggregation_service import PERIODS, sales_buckets, sales_buckets_sql
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        _, seed_ms = timed(lambda: seed_orders(db, args.orders, args.days, args.seed))
+        print(f"資料庫：{db.engine.dialect.name}，寫入 {args.orders} 筆訂單 {seed_ms / 1000:.1f}s")
+        for period in PERIODS:
+            sql, sql_ms = timed(lambda: sales_buckets_sql(period))
+            vec, vec_ms = timed(lambda: sales_buckets(period))
+            diff = max_diff(sql, vec)
+            print(f"{period:<6} GROUP BY={sql_ms:8.1f}ms  NumPy={vec_ms:8.1f}ms  期間數={len(vec):<4} 金額最大差異={diff:.6f}")
+        if args.tz:
+            tz_result, tz_ms = timed(lambda: sales_buckets("day", tz=args.tz))
+            print(f"day（{args.tz}）NumPy={tz_ms:.1f}ms  期間數={len(tz_result)}")
+
+    if tmpdir:
+        tmpdir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -35,10 +35,14 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from app import create_app, db
 from app.models.user import User
 from app.models.product import Product, Category
+from app.services.category_service import place_category
 from app.models.customer import Customer
 from app.models.order import Order, OrderItem
 from app.models.payment import Payment
 from app.models.notification import Notification
+from app.services.inventory_service import record_opening_stock, reserve_stock
+from app.services.order_service import reservation_deadline
+from app.services.sales_rollup_service import rebuild_sales_rollup
 
 # 初始化 Faker（繁體中文）
 fake = Faker('zh_TW')
@@ -148,6 +152,7 @@ def create_categories():
         )
         
         db.session.add(category)
+        place_category(category)
         created_categories.append(category)
         print(f"  ✅ 建立分類: {category.name}")
     
@@ -285,6 +290,9 @@ def create_products(categories):
         )
         
         db.session.add(product)
+        db.session.flush()
+        # 期初庫存寫入異動帳，reconcile-stock 才對得上
+        record_opening_stock(product, operator='seed')
         created_products.append(product)
         print(f"  ✅ 建立商品: {product.name} (NT${product.price})")
     
@@ -389,6 +397,7 @@ def create_orders(customers, products, users):
         
         # 隨機選擇 1-4 個商品
         order_products = random.sample(products, random.randint(1, 4))
+        status = random.choice(order_statuses)
         
         # 計算訂單總金額
         total_amount = Decimal('0.00')
@@ -396,6 +405,11 @@ def create_orders(customers, products, users):
         
         for product in order_products:
             quantity = random.randint(1, 3)
+            if status != 'cancelled':
+                # 未取消的訂單會扣庫存，不超過目前庫存
+                quantity = min(quantity, product.stock or 0)
+                if not quantity:
+                    continue
             price = Decimal(str(product.price))
             subtotal = price * quantity
             total_amount += subtotal
@@ -406,6 +420,8 @@ def create_orders(customers, products, users):
                 'price': price,
                 'subtotal': subtotal
             })
+        if not order_items:
+            continue
         
         # 建立訂單
         order_date = datetime.utcnow() - timedelta(days=random.randint(1, 90))
@@ -415,7 +431,11 @@ def create_orders(customers, products, users):
             order_sn=order_sn,
             user_id=customer_user.id,
             customer_id=customer.id,
-            status=random.choice(order_statuses),
+            status=status,
+            payment_status='paid' if status in ['confirmed', 'shipped', 'delivered'] else 'unpaid',
+            # 範例的 pending 訂單自載入時起算付款期限，逾期由 sweep-expired-orders 取消
+            reserved_until=reservation_deadline() if status == 'pending' else None,
+            created_at=order_date,
             total_amount=float(total_amount),
             shipping_address=customer.address or fake.address(),
             receiver_name=customer.name,
@@ -436,6 +456,13 @@ def create_orders(customers, products, users):
                 price=float(item_data['price'])
             )
             db.session.add(order_item)
+        order.set_item_summary((item_data['product'].name, item_data['quantity']) for item_data in order_items)
+        # 與建立訂單相同：扣庫存並寫入異動帳（已取消的訂單庫存視為已釋回）
+        if status != 'cancelled':
+            reserve_stock(
+                [{'product_id': item_data['product'].id, 'qty': item_data['quantity']} for item_data in order_items],
+                order_id=order.id, operator='seed',
+            )
         
         # 建立支付記錄（某些訂單）
         if order.status in ['confirmed', 'shipped', 'delivered'] or random.choice([True, False]):
@@ -456,6 +483,8 @@ def create_orders(customers, products, users):
             print(f"  ✅ 已建立 {i + 1} 個訂單")
     
     db.session.commit()
+    # 由訂單重算每日銷售彙總與每日商品銷售
+    rebuild_sales_rollup()
     print(f"✅ 完成建立 {len(created_orders)} 個訂單")
     return created_orders
 